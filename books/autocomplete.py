@@ -0,0 +1,614 @@
+import array
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Count
+
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Normalization
+# -------------------------------
+
+
+def normalize_prefix(text):
+    """Lowercase, strip accents and collapse whitespace for prefix matching."""
+    if not text:
+        return ""
+    text = str(text)
+    if text.isascii():
+        # Nothing to decompose; casefold() and lower() agree on ASCII.
+        return " ".join(text.lower().split())
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.casefold().split())
+
+
+# -------------------------------
+# Packed base index
+# -------------------------------
+
+# Snapshot layout: 16-byte header (magic, metadata length), JSON metadata
+# with each section's offset and size, then the sections, 8-byte aligned.
+_SNAPSHOT_MAGIC = b"BKAC\x00\x00\x00\x01"
+_HEADER = struct.Struct("<8sQ")
+# Sorts above every UTF-8 byte, so `key + _HIGH` bounds all keys starting with key.
+_HIGH = b"\xff"
+
+
+def _id_hash(google_id):
+    return int.from_bytes(hashlib.blake2b(google_id.encode(), digest_size=8).digest(), "little")
+
+
+# Separates google_id, title and each author inside a packed record.
+_FIELD_SEP = "\x1f"
+
+
+def _record(google_id, title, authors):
+    fields = [google_id, title or "", *authors]
+    record = _FIELD_SEP.join(fields)
+    if record.count(_FIELD_SEP) != len(fields) - 1:
+        record = _FIELD_SEP.join(field.replace(_FIELD_SEP, " ") for field in fields)
+    return record.encode()
+
+
+def _aligned(size):
+    return -(-size // 8) * 8
+
+
+class _SortedKeys:
+    """Read-only sequence over the packed keys, so bisect can search them."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, pos):
+        return bytes(self.blob[self.offsets[pos]:self.offsets[pos + 1]])
+
+
+class PackedBooks:
+    """
+    The read-only bulk of a PrefixIndex, in flat buffers instead of Python
+    objects:
+
+    - keys, key_offsets, key_slots: the sorted UTF-8 keys and each one's book slot
+    - records, record_offsets: google_id, title and authors of each slot
+    - weights: the popularity of each slot
+    - id_hashes, id_slots: sorted google_id hashes, to find a book's slot
+
+    Built in memory, or memory-mapped from a snapshot file so every worker
+    on a host shares one copy through the page cache.
+    """
+
+    SECTIONS = {
+        "keys": "B", "key_offsets": "I", "key_slots": "I",
+        "records": "B", "record_offsets": "I", "weights": "I",
+        "id_hashes": "Q", "id_slots": "I",
+    }
+
+    def __init__(self, sections, memo=None, meta=None):
+        for name in self.SECTIONS:
+            setattr(self, name, sections[name])
+        self.sorted_keys = _SortedKeys(self.keys, self.key_offsets)
+        self.memo = memo or {}
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.weights)
+
+    @classmethod
+    def build(cls, rows, keys_for):
+        """Pack (google_id, title, authors, weight) rows."""
+        records, record_offsets, weights = bytearray(), array.array("I", [0]), array.array("I")
+        entries, id_hashes = [], array.array("Q")
+        for google_id, title, authors, weight in rows:
+            slot = len(weights)
+            authors = list(authors or ())
+            records += _record(google_id, title, authors)
+            record_offsets.append(len(records))
+            weights.append(max(int(weight or 0), 0))
+            id_hashes.append(_id_hash(google_id))
+            entries.extend(_entry(key, slot) for key in keys_for(title, authors))
+        entries.sort()
+        by_hash = sorted(range(len(id_hashes)), key=id_hashes.__getitem__)
+
+        keys, key_offsets, key_slots = bytearray(), array.array("I", [0]), array.array("I")
+        for entry in entries:
+            keys += entry[:-5]
+            key_offsets.append(len(keys))
+            key_slots.append(_entry_slot(entry))
+        del entries
+        return cls({
+            "keys": bytes(keys), "key_offsets": key_offsets, "key_slots": key_slots,
+            "records": bytes(records), "record_offsets": record_offsets, "weights": weights,
+            "id_hashes": array.array("Q", (id_hashes[slot] for slot in by_hash)),
+            "id_slots": array.array("I", by_hash),
+        })
+
+    def key_range(self, prefix):
+        lo = bisect.bisect_left(self.sorted_keys, prefix)
+        return lo, bisect.bisect_left(self.sorted_keys, prefix + _HIGH, lo)
+
+    def book(self, slot):
+        record = bytes(self.records[self.record_offsets[slot]:self.record_offsets[slot + 1]])
+        google_id, title, *authors = record.decode().split(_FIELD_SEP)
+        return google_id, title, tuple(authors), self.weights[slot]
+
+    def slot_for(self, google_id):
+        id_hash = _id_hash(google_id)
+        pos = bisect.bisect_left(self.id_hashes, id_hash)
+        if pos < len(self.id_hashes) and self.id_hashes[pos] == id_hash:
+            return self.id_slots[pos]
+        return None
+
+    def save(self, path, **meta):
+        """Write the buffers to `path` atomically; `meta` is stored alongside."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        buffers = {name: memoryview(getattr(self, name)).cast("B") for name in self.SECTIONS}
+        sections, offset = {}, 0
+        for name, data in buffers.items():
+            sections[name] = [offset, data.nbytes]
+            offset += _aligned(data.nbytes)
+        header = json.dumps({"sections": sections, "memo": self.memo, **meta}).encode()
+        start = _aligned(_HEADER.size + len(header))
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as snapshot:
+            snapshot.write(_HEADER.pack(_SNAPSHOT_MAGIC, len(header)))
+            snapshot.write(header)
+            for name, data in buffers.items():
+                snapshot.seek(start + sections[name][0])
+                snapshot.write(data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as snapshot_file:
+            snapshot = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = _HEADER.unpack_from(snapshot, 0)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an autocomplete index.")
+        meta = json.loads(snapshot[_HEADER.size:_HEADER.size + length])
+        start, view = _aligned(_HEADER.size + length), memoryview(snapshot)
+        sections = {
+            name: view[start + offset:start + offset + size].cast(cls.SECTIONS[name])
+            for name, (offset, size) in meta.pop("sections").items()
+        }
+        return cls(sections, meta.pop("memo"), meta)
+
+
+def _entry(key, slot):
+    """One sortable key entry: UTF-8 key, NUL, then the slot (big-endian)."""
+    return key.encode() + b"\x00" + slot.to_bytes(4, "big")
+
+
+def _entry_slot(entry):
+    return int.from_bytes(entry[-4:], "big")
+
+
+# -------------------------------
+# Prefix index
+# -------------------------------
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index over book titles and author names.
+
+    The bulk lives in a PackedBooks: a prefix lookup is two bisects over
+    the packed keys plus a scan of the matching range, and book metadata
+    is decoded only for the results. Books added or edited after the
+    build go to a small sorted overlay (an edited book's packed copy is
+    masked) that is folded in by the next build. Wide prefixes ("t", "th")
+    are answered from a memo of popularity-ordered top-K results,
+    precomputed by build() and kept current by add().
+    """
+
+    MEMO_DEPTH = 20
+
+    def __init__(self, scan_limit=2000, memo_size=2048):
+        self.scan_limit = scan_limit
+        self.memo_size = memo_size
+        self._base = PackedBooks.build([], self._keys_for)
+        self._extra_entries = []  # sorted _entry() bytes for overlay books
+        self._extra_books = []  # slot - len(base) -> (google_id, title, authors, weight)
+        self._extra_slots = {}  # google_id -> overlay slot
+        self._masked = set()  # base slots superseded by an overlay copy
+        self._memo = OrderedDict()
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def __len__(self):
+        return len(self._base) - len(self._masked) + len(self._extra_books)
+
+    @staticmethod
+    def _keys_for(title, authors):
+        keys = {normalize_prefix(title)}
+        for author in authors or []:
+            name = normalize_prefix(author)
+            if name:
+                keys.add(name)
+                # Let "tolkien" find "J. R. R. Tolkien".
+                keys.add(name.rsplit(" ", 1)[-1])
+        keys.discard("")
+        return keys
+
+    def _book(self, slot):
+        base = self._base
+        return base.book(slot) if slot < len(base) else self._extra_books[slot - len(base)]
+
+    def _rank(self, slot):
+        base = self._base
+        weight = base.weights[slot] if slot < len(base) else self._extra_books[slot - len(base)][3]
+        return weight, -slot
+
+    def _top_slots(self, base, lo, hi, k, extra=(), masked=frozenset()):
+        seen = set(base.key_slots[lo:hi])
+        seen.difference_update(masked)
+        seen.update(_entry_slot(entry) for entry in extra)
+
+        def rank(slot):
+            if slot < len(base):
+                return base.weights[slot], -slot
+            return self._extra_books[slot - len(base)][3], -slot
+
+        return heapq.nlargest(k, seen, key=rank)
+
+    def _wide_prefixes(self, keys, length=2):
+        """Prefixes up to `length` characters that match more than scan_limit entries."""
+        found, frontier = [], [""]
+        for _ in range(length):
+            next_frontier = []
+            for base in frontier:
+                encoded = base.encode()
+                # Keys equal to `base` have no next character.
+                pos = bisect.bisect_right(keys, encoded)
+                end = bisect.bisect_left(keys, encoded + _HIGH, pos)
+                while pos < end:
+                    prefix = keys[pos].decode()[:len(base) + 1]
+                    stop = bisect.bisect_left(keys, prefix.encode() + _HIGH, pos, end)
+                    if prefix[-1] != " " and stop - pos > self.scan_limit:
+                        found.append(prefix)
+                        next_frontier.append(prefix)
+                    pos = stop
+            frontier = next_frontier
+        return found
+
+    def _install(self, base):
+        with self._lock:
+            self._base = base
+            self._extra_entries, self._extra_books, self._extra_slots = [], [], {}
+            self._masked = set()
+            self._memo = OrderedDict((prefix, list(slots)) for prefix, slots in base.memo.items())
+            self.ready = True
+
+    def pack(self, rows):
+        """
+        Pack `rows` of (google_id, title, authors, weight) without touching
+        the live index. The top-K of every wide short prefix, and of every
+        prefix memoized now, goes in the memo, so no request pays for a cold
+        wide prefix after the swap.
+        """
+        base = PackedBooks.build(rows, self._keys_for)
+        with self._lock:
+            hot = list(self._memo)
+        for prefix in dict.fromkeys(self._wide_prefixes(base.sorted_keys) + hot):
+            lo, hi = base.key_range(prefix.encode())
+            if hi - lo > self.scan_limit:
+                base.memo[prefix] = self._top_slots(base, lo, hi, self.MEMO_DEPTH)
+        return base
+
+    def build(self, rows):
+        """Replace the index with `rows` of (google_id, title, authors, weight)."""
+        self._install(self.pack(rows))
+
+    def save(self, path, **meta):
+        """Write the packed part (not the overlay) and its memo to a snapshot file."""
+        self._base.save(path, **meta)
+
+    def load(self, path):
+        """Replace the index with a snapshot written by save(); returns its metadata."""
+        base = PackedBooks.load(path)
+        self._install(base)
+        return base.meta
+
+    def add(self, google_id, title, authors, weight=None):
+        """Insert or refresh one book without rebuilding the index."""
+        new_keys = self._keys_for(title, authors)
+        with self._lock:
+            base = self._base
+            slot = self._extra_slots.get(google_id)
+            if slot is not None:
+                _, old_title, old_authors, old_weight = self._book(slot)
+                old_keys = self._keys_for(old_title, old_authors)
+            else:
+                old_keys = set()
+                base_slot = base.slot_for(google_id)
+                if base_slot is not None and base_slot not in self._masked:
+                    _, old_title, old_authors, old_weight = base.book(base_slot)
+                    self._masked.add(base_slot)
+                    self._update_memo(base_slot, self._keys_for(old_title, old_authors), set())
+                else:
+                    old_weight = 0
+                slot = len(base) + len(self._extra_books)
+                self._extra_books.append(None)
+                self._extra_slots[google_id] = slot
+            if weight is None:
+                weight = old_weight
+            self._extra_books[slot - len(base)] = (google_id, title, tuple(authors or ()), weight or 0)
+
+            for key in old_keys - new_keys:
+                entry = _entry(key, slot)
+                pos = bisect.bisect_left(self._extra_entries, entry)
+                if pos < len(self._extra_entries) and self._extra_entries[pos] == entry:
+                    del self._extra_entries[pos]
+            for key in new_keys - old_keys:
+                bisect.insort(self._extra_entries, _entry(key, slot))
+            self._update_memo(slot, old_keys, new_keys)
+
+    def _update_memo(self, slot, old_keys, new_keys):
+        """
+        Re-rank `slot` inside every memoized top-K its keys fall under.
+
+        A top-K stays exact when a book moves within it or climbs into it.
+        When a book leaves or drops below the last memoized entry the list
+        just gets one shorter (whatever ranked next is unknown); search()
+        recomputes a list that has become shorter than the requested limit.
+        """
+        rank = self._rank(slot)
+        prefixes = {key[:end] for key in old_keys | new_keys for end in range(1, len(key) + 1)}
+        for prefix in prefixes:
+            memo = self._memo.get(prefix)
+            if memo is None:
+                continue
+            size = len(memo)
+            if slot in memo:
+                memo.remove(slot)
+            if not memo or not any(key.startswith(prefix) for key in new_keys):
+                continue
+            if rank > self._rank(memo[-1]):
+                pos = next(pos for pos, other in enumerate(memo) if rank > self._rank(other))
+                memo.insert(pos, slot)
+                del memo[size:]
+
+    def search(self, query, limit=10):
+        """Return up to `limit` books whose title or author starts with `query`."""
+        prefix = normalize_prefix(query)
+        if not prefix:
+            return []
+        encoded = prefix.encode()
+        with self._lock:
+            base, extra = self._base, self._extra_entries
+            lo, hi = base.key_range(encoded)
+            extra_lo = bisect.bisect_left(extra, encoded)
+            extra_hi = bisect.bisect_left(extra, encoded + _HIGH, extra_lo)
+            matches = (base, lo, hi)
+            overlay = (extra[extra_lo:extra_hi], self._masked)
+            if (hi - lo) + (extra_hi - extra_lo) <= self.scan_limit:
+                slots = self._top_slots(*matches, limit, *overlay)
+            else:
+                memo = self._memo.get(prefix)
+                if memo is None or len(memo) < limit:
+                    memo = self._top_slots(*matches, max(limit, self.MEMO_DEPTH), *overlay)
+                    self._memo[prefix] = memo
+                    if len(self._memo) > self.memo_size:
+                        self._memo.popitem(last=False)
+                else:
+                    self._memo.move_to_end(prefix)
+                slots = memo[:limit]
+            books = [self._book(slot) for slot in slots]
+        return [{"google_id": book[0], "title": book[1], "authors": list(book[2])} for book in books]
+
+
+# -------------------------------
+# Process-wide index
+# -------------------------------
+
+AUTOCOMPLETE_REFRESH_SECONDS = getattr(settings, "AUTOCOMPLETE_REFRESH_SECONDS", 5)
+AUTOCOMPLETE_REBUILD_SECONDS = getattr(settings, "AUTOCOMPLETE_REBUILD_SECONDS", 60 * 60)
+
+# Bumped in the shared cache on every Book write, so other processes know to
+# pull in the new books.
+INDEX_VERSION_KEY = "autocomplete_index_version"
+# Held in the shared cache by the one process building a new snapshot.
+BUILD_LOCK_KEY = "autocomplete_index_build"
+REFRESH_OVERLAP = 500
+
+book_index = PrefixIndex(
+    scan_limit=getattr(settings, "AUTOCOMPLETE_SCAN_LIMIT", 2000),
+    memo_size=getattr(settings, "AUTOCOMPLETE_MEMO_SIZE", 2048),
+)
+_build_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_rebuilder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autocomplete")
+# What this process has loaded: the shared version seen, the highest Book id,
+# the snapshot's mtime, and when it last checked for changes.
+_sync = {"version": None, "max_id": 0, "snapshot_mtime": None, "checked_at": 0.0}
+
+
+def _index_path():
+    return str(getattr(settings, "AUTOCOMPLETE_INDEX_PATH", settings.BASE_DIR / "var" / "autocomplete"))
+
+
+def _snapshot_mtime():
+    try:
+        return os.stat(_index_path()).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def build_book_index():
+    """
+    Load every local book into the index, weighted by user interactions,
+    and save it as the snapshot other processes load.
+    """
+    # Read before loading: a write that lands during the load bumps the
+    # version again and is picked up by the next refresh.
+    version = cache.get(INDEX_VERSION_KEY)
+    rows = (
+        Book.objects.annotate(popularity=Count("interactions"))
+        .values_list("id", "google_id", "title", "authors", "popularity")
+        .iterator(chunk_size=5000)
+    )
+    max_id = 0
+
+    def tracked():
+        nonlocal max_id
+        for book_id, *row in rows:
+            max_id = max(max_id, book_id)
+            yield row
+
+    # Save, then map the file like every other process instead of keeping
+    # a private heap copy of the whole index.
+    book_index.pack(tracked()).save(_index_path(), max_id=max_id, version=version)
+    load_book_index()
+
+
+def _build_book_index_once():
+    """build_book_index() unless another process holds the build lock; returns whether it ran."""
+    if not cache.add(BUILD_LOCK_KEY, True, AUTOCOMPLETE_REBUILD_SECONDS):
+        return False
+    try:
+        build_book_index()
+    finally:
+        cache.delete(BUILD_LOCK_KEY)
+    return True
+
+
+def load_book_index():
+    """Map the saved snapshot, then pull in books saved since it was built."""
+    mtime = _snapshot_mtime()
+    meta = book_index.load(_index_path())
+    _sync.update(version=meta["version"], max_id=meta["max_id"], snapshot_mtime=mtime, checked_at=time.monotonic())
+    refresh_book_index()
+
+
+def warm_book_index():
+    """
+    Load the snapshot while the process starts, before it takes requests.
+    Starting workers never scan the Book table: without a snapshot (run
+    `manage.py rebuild_autocomplete_index`), the first request builds it.
+    """
+    if not getattr(settings, "AUTOCOMPLETE_BUILD_ON_STARTUP", True) or _snapshot_mtime() is None:
+        return
+    try:
+        ensure_book_index()
+    except DatabaseError:
+        # No database yet (e.g. before migrate); the first request retries.
+        logger.exception("Loading the autocomplete index at startup failed")
+
+
+def ensure_book_index():
+    """
+    Ready the index once per process: map the snapshot if there is one,
+    else build it (and the snapshot) unless another process already is;
+    the index then stays unready and the next call checks again.
+    """
+    if book_index.ready:
+        return book_index
+    with _build_lock:
+        if book_index.ready:
+            return book_index
+        if _snapshot_mtime() is not None:
+            try:
+                load_book_index()
+                return book_index
+            except (OSError, ValueError):
+                logger.exception("Loading the autocomplete snapshot failed; rebuilding it")
+        _build_book_index_once()
+    return book_index
+
+
+def refresh_book_index():
+    """
+    Pull in books saved by other processes since the last check. New books
+    are found by id, re-reading the last REFRESH_OVERLAP ids in case a
+    lower id committed late; edits to existing books and popularity changes
+    arrive with the next snapshot.
+    """
+    version = cache.get(INDEX_VERSION_KEY)
+    _sync["checked_at"] = time.monotonic()
+    if version == _sync["version"]:
+        return 0
+    rows = list(
+        Book.objects.filter(id__gt=_sync["max_id"] - REFRESH_OVERLAP).order_by("id")
+        .values_list("id", "google_id", "title", "authors")
+    )
+    for book_id, google_id, title, authors in rows:
+        book_index.add(google_id, title, authors)
+    if rows:
+        _sync["max_id"] = max(_sync["max_id"], rows[-1][0])
+    _sync["version"] = version
+    return len(rows)
+
+
+def _in_background(task):
+    try:
+        task()
+    except Exception:
+        logger.exception("Updating the autocomplete index failed")
+    finally:
+        close_old_connections()
+        _refresh_lock.release()
+
+
+def _maybe_refresh():
+    """
+    Every AUTOCOMPLETE_REFRESH_SECONDS: map a snapshot saved by another
+    process, or rebuild the snapshot once it is AUTOCOMPLETE_REBUILD_SECONDS
+    old (one process does, under BUILD_LOCK_KEY), or else pull in new books.
+    """
+    now = time.monotonic()
+    if now - _sync["checked_at"] < AUTOCOMPLETE_REFRESH_SECONDS:
+        return
+    # One thread refreshes; the others keep serving the current index.
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    _sync["checked_at"] = now
+    mtime = _snapshot_mtime()
+    if mtime is not None and mtime != _sync["snapshot_mtime"]:
+        task = load_book_index
+    elif mtime is None or time.time() - mtime >= AUTOCOMPLETE_REBUILD_SECONDS:
+        task = _build_book_index_once
+    else:
+        try:
+            refresh_book_index()
+        finally:
+            _refresh_lock.release()
+        return
+    _rebuilder.submit(_in_background, task)  # releases the lock when done
+
+
+def autocomplete_books(query, limit=10):
+    """Answer a typeahead query from the in-memory index."""
+    if not ensure_book_index().ready:
+        return []  # another process is building the first snapshot
+    _maybe_refresh()
+    return book_index.search(query, limit=limit)
+
+
+def index_book(book):
+    """Keep the index in step with a saved Book and tell other processes about it."""
+    # Bumped after commit, so a process that refreshes on it can see the row.
+    transaction.on_commit(lambda: cache.set(INDEX_VERSION_KEY, time.time_ns(), None))
+    if book_index.ready:
+        book_index.add(book.google_id, book.title, book.authors)
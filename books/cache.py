@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Book
+
+
+# -------------------------------
+# L1: bounded in-process LRU
+# -------------------------------
+
+class LRUCache:
+    """Thread-safe LRU bounded by entry count."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# -------------------------------
+# L1 + L2 Book cache
+# -------------------------------
+
+class BookCache:
+    """
+    Two-tier cache for hydrated Book rows.
+
+    L1 is a per-process LRU, L2 the shared Django cache. Every write bumps a
+    per-book version stamp in L2. An L1 entry is trusted without any network
+    call for `l1_ttl` seconds; after that it is revalidated against the
+    version stamp, so other workers serve a stale book for at most `l1_ttl`.
+    """
+
+    def __init__(self, max_entries=10000, l1_ttl=5, l2_ttl=60 * 60):
+        self.l1 = LRUCache(max_entries)
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self._counts = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+
+    @staticmethod
+    def _version_key(google_id):
+        return f"book_version_{google_id}"
+
+    @staticmethod
+    def _entry_key(google_id):
+        return f"book_{google_id}"
+
+    def _count(self, name):
+        self._counts[name] += 1
+
+    def get(self, google_id):
+        """Return the Book for `google_id`, or None if it is not in the DB."""
+        local = self.l1.get(google_id)
+        now = time.monotonic()
+        if local is not None and now - local[2] < self.l1_ttl:
+            self._count("l1_hits")
+            return local[0]
+
+        version_key, entry_key = self._version_key(google_id), self._entry_key(google_id)
+        shared = cache.get_many([version_key, entry_key])
+        version = shared.get(version_key, 0)
+
+        if local is not None and local[1] == version:
+            self.l1.set(google_id, (local[0], version, now))
+            self._count("l1_hits")
+            return local[0]
+
+        entry = shared.get(entry_key)
+        if entry is not None and entry[0] == version:
+            self.l1.set(google_id, (entry[1], version, now))
+            self._count("l2_hits")
+            return entry[1]
+
+        self._count("misses")
+        book = Book.objects.filter(google_id=google_id).first()
+        if book is not None:
+            # Stored under the version read *before* the query: a concurrent
+            # write bumps the version and makes this entry unreachable.
+            cache.set(entry_key, (version, book), self.l2_ttl)
+            self.l1.set(google_id, (book, version, now))
+        return book
+
+    def get_many(self, google_ids):
+        """
+        {google_id: Book} for the ids that exist, with one L2 round trip and
+        at most one query for all misses. Same freshness rules as get().
+        """
+        books, now = {}, time.monotonic()
+        stale = {}
+        for google_id in google_ids:
+            local = self.l1.get(google_id)
+            if local is not None and now - local[2] < self.l1_ttl:
+                self._count("l1_hits")
+                books[google_id] = local[0]
+            else:
+                stale[google_id] = local
+        if not stale:
+            return books
+
+        keys = [key for google_id in stale for key in (self._version_key(google_id), self._entry_key(google_id))]
+        shared = cache.get_many(keys)
+        missing = {}
+        for google_id, local in stale.items():
+            version = shared.get(self._version_key(google_id), 0)
+            entry = shared.get(self._entry_key(google_id))
+            if local is not None and local[1] == version:
+                self._count("l1_hits")
+                books[google_id] = local[0]
+            elif entry is not None and entry[0] == version:
+                self._count("l2_hits")
+                books[google_id] = entry[1]
+            else:
+                self._count("misses")
+                missing[google_id] = version
+                continue
+            self.l1.set(google_id, (books[google_id], version, now))
+
+        if missing:
+            fetched = Book.objects.filter(google_id__in=list(missing))
+            cache.set_many(
+                {self._entry_key(book.google_id): (missing[book.google_id], book) for book in fetched},
+                self.l2_ttl,
+            )
+            for book in fetched:
+                self.l1.set(book.google_id, (book, missing[book.google_id], now))
+                books[book.google_id] = book
+        return books
+
+    def invalidate(self, google_id):
+        """Called on every Book write; other processes notice via the version."""
+        cache.set(self._version_key(google_id), time.time_ns(), None)
+        self.l1.delete(google_id)
+
+    def stats(self):
+        total = sum(self._counts.values())
+        return {
+            **self._counts,
+            "l1_entries": len(self.l1),
+            "l1_hit_rate": self._counts["l1_hits"] / total if total else 0.0,
+            "l2_hit_rate": self._counts["l2_hits"] / total if total else 0.0,
+        }
+
+
+book_cache = BookCache(
+    max_entries=getattr(settings, "BOOK_CACHE_L1_MAX_ENTRIES", 10000),
+    l1_ttl=getattr(settings, "BOOK_CACHE_L1_TTL", 5),
+    l2_ttl=getattr(settings, "BOOK_CACHE_L2_TTL", 60 * 60),
+)
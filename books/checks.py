@@ -0,0 +1,44 @@
+import logging
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# Backends whose data never leaves the process.
+PROCESS_LOCAL_CACHES = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+SHARED_CACHE_MESSAGE = "The default cache is private to each process."
+SHARED_CACHE_HINT = (
+    "Set CACHE_URL to a Redis or Memcached server. Without it, book and library "
+    "invalidations, account changes, replica pins and the trending list do not "
+    "reach other workers."
+)
+
+
+def cache_is_process_local():
+    return settings.CACHES["default"]["BACKEND"] in PROCESS_LOCAL_CACHES
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if not cache_is_process_local():
+        return []
+    if getattr(settings, "DATABASE_REPLICAS", []):
+        # Read-your-writes pins set by one worker would be invisible to the rest.
+        return [Error(SHARED_CACHE_MESSAGE, hint=SHARED_CACHE_HINT, id="books.E002")]
+    return [Warning(SHARED_CACHE_MESSAGE, hint=SHARED_CACHE_HINT, id="books.W001")]
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache_deploy(app_configs, **kwargs):
+    if not cache_is_process_local():
+        return []
+    return [Error(SHARED_CACHE_MESSAGE, hint=SHARED_CACHE_HINT, id="books.E001")]
+
+
+def warn_if_cache_is_process_local():
+    """Log the shared-cache warning when a server process starts."""
+    if cache_is_process_local():
+        logging.getLogger(__name__).warning("%s %s", SHARED_CACHE_MESSAGE, SHARED_CACHE_HINT)
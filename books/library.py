@@ -0,0 +1,65 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import book_cache
+from .models import UserBookInteraction
+
+LIBRARY_CACHE_TTL = getattr(settings, "LIBRARY_CACHE_TTL", 60 * 60)
+
+
+# -------------------------------
+# Versioned per-user projection
+# -------------------------------
+
+def _version_key(user_id):
+    return f"library_version_{user_id}"
+
+
+def _library_key(user_id, version):
+    return f"library_{user_id}_v{version}"
+
+
+def get_library_version(user_id):
+    """Current library version for a user, created on first use."""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_library(user_id):
+    """Bump the user's library version; every cached projection becomes unreachable."""
+    cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def get_library(user_id, favorites_only=False):
+    """
+    [(book, status, is_favorite)] for a user's shelf.
+
+    The cached projection is only (google_id, status, is_favorite) tuples;
+    books are hydrated from the book cache, so book edits show up without
+    touching any library entry. Library and favorites share one projection.
+    """
+    key = _library_key(user_id, get_library_version(user_id))
+    entries = cache.get(key)
+    if entries is None:
+        interactions = list(
+            UserBookInteraction.objects.filter(user_id=user_id).select_related("book").order_by("pk")
+        )
+        entries = [(i.book.google_id, i.status, i.is_favorite) for i in interactions]
+        cache.set(key, entries, LIBRARY_CACHE_TTL)
+        # The rows were just loaded with their books; no need to hydrate.
+        books = {i.book.google_id: i.book for i in interactions}
+    else:
+        books = book_cache.get_many([google_id for google_id, _, is_favorite in entries
+                                     if is_favorite or not favorites_only])
+
+    return [
+        (books[google_id], status, is_favorite)
+        for google_id, status, is_favorite in entries
+        if google_id in books and (is_favorite or not favorites_only)
+    ]
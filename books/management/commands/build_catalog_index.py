@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books.providers import build_catalog_index, index_path_for
+
+
+class Command(BaseCommand):
+    help = "Build the offset index used by LocalCatalogProvider for a JSON Lines catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default=None, help="Catalog file (defaults to BOOK_CATALOG_PATH).")
+
+    def handle(self, *args, **options):
+        path = options["path"] or getattr(settings, "BOOK_CATALOG_PATH", None)
+        if not path:
+            raise CommandError("Pass a catalog path or set BOOK_CATALOG_PATH.")
+        try:
+            count = build_catalog_index(path)
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError(f"Could not index {path}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} books into {index_path_for(path)}"))
@@ -0,0 +1,113 @@
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter (under -X importtime) so nothing is already
+# imported. Prints one JSON object with the phase and per-app timings.
+STARTUP_SCRIPT = r"""
+import json, time
+start = time.perf_counter()
+
+import django
+from django.apps import AppConfig
+from django.conf import settings
+
+settings.INSTALLED_APPS
+settings_done = time.perf_counter()
+
+apps_timing = {}
+original_create = AppConfig.create.__func__
+
+
+def timed(label, phase, func):
+    def wrapper():
+        began = time.perf_counter()
+        result = func()
+        apps_timing[label][phase] = time.perf_counter() - began
+        return result
+    return wrapper
+
+
+def timed_create(cls, entry):
+    began = time.perf_counter()
+    config = original_create(cls, entry)
+    apps_timing[config.label] = {"config": time.perf_counter() - began}
+    config.import_models = timed(config.label, "models", config.import_models)
+    config.ready = timed(config.label, "ready", config.ready)
+    return config
+
+
+AppConfig.create = classmethod(timed_create)
+django.setup()
+setup_done = time.perf_counter()
+
+from django.urls import get_resolver
+get_resolver().url_patterns
+urls_done = time.perf_counter()
+
+print(json.dumps({
+    "phases": {
+        "django + settings import": settings_done - start,
+        "app registry (django.setup)": setup_done - settings_done,
+        "URLconf + views import": urls_done - setup_done,
+        "total": urls_done - start,
+    },
+    "apps": apps_timing,
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """Cumulative microseconds per top-level package from `-X importtime` output."""
+    totals = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        # Nested imports are indented two more spaces per level; only count
+        # top-level ones so packages are not counted twice.
+        if len(name) - len(name.lstrip(" ")) != 1:
+            continue
+        totals[name.strip().split(".")[0]] += int(cumulative)
+    return totals
+
+
+class Command(BaseCommand):
+    help = "Report where process startup time goes: imports, app registry and URLconf."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=15, help="Number of packages to list.")
+        parser.add_argument("--json", action="store_true", help="Print the raw report as JSON.")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "config.settings")}
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+            capture_output=True, text=True, cwd=settings.BASE_DIR, env=env,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        report["imports"] = dict(parse_importtime(result.stderr).most_common(options["limit"]))
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write("Phases:")
+        for phase, seconds in report["phases"].items():
+            self.stdout.write(f"  {phase:<32} {seconds * 1000:8.1f} ms")
+
+        self.stdout.write("\nApps (config / models / ready):")
+        for label, timing in report["apps"].items():
+            parts = [timing.get(phase, 0) * 1000 for phase in ("config", "models", "ready")]
+            self.stdout.write(f"  {label:<24} " + " / ".join(f"{part:7.1f}" for part in parts) + " ms")
+
+        self.stdout.write("\nSlowest top-level imports (cumulative):")
+        for package, micros in report["imports"].items():
+            self.stdout.write(f"  {package:<32} {micros / 1000:8.1f} ms")
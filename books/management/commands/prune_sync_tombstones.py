@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.sync import SYNC_TOMBSTONE_DAYS, prune_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than SYNC_TOMBSTONE_DAYS."
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} tombstones older than {SYNC_TOMBSTONE_DAYS} days"))
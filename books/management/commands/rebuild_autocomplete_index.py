@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.autocomplete import book_index, build_book_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the autocomplete snapshot that workers memory-map at startup."
+
+    def handle(self, *args, **options):
+        build_book_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {len(book_index)} books"))
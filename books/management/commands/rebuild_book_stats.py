@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from books.popularity import rebuild_counts, refresh_trending
+
+
+class Command(BaseCommand):
+    help = "Recount per-book engagement counters and trending scores from interactions and refresh the trending list."
+
+    def handle(self, *args, **options):
+        rebuild_counts()
+        trending = refresh_trending()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters; {len(trending)} trending books"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.similarity import rebuild_similarity_index
+
+
+class Command(BaseCommand):
+    help = "Re-embed every local book and save the similar-books vector index."
+
+    def handle(self, *args, **options):
+        count = rebuild_similarity_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} books"))
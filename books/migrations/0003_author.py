@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+def backfill_authors(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Author = apps.get_model('books', 'Author')
+    Through = Author.books.through
+    # The database being migrated, not wherever the router would send a query.
+    db_alias = schema_editor.connection.alias
+
+    authors = {}
+    links = []
+    for google_id, names in Book.objects.using(db_alias).values_list('google_id', 'authors').iterator(chunk_size=2000):
+        for name in names or []:
+            canonical = " ".join(str(name).split()).casefold()[:255]
+            if not canonical:
+                continue
+            if canonical not in authors:
+                authors[canonical] = Author.objects.using(db_alias).get_or_create(
+                    canonical_name=canonical, defaults={'name': str(name)[:255]}
+                )[0].pk
+            links.append(Through(author_id=authors[canonical], book_id=google_id))
+        if len(links) >= 5000:
+            Through.objects.using(db_alias).bulk_create(links, ignore_conflicts=True)
+            links = []
+    Through.objects.using(db_alias).bulk_create(links, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_review_userbookinteraction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('canonical_name', models.CharField(max_length=255, unique=True)),
+                ('books', models.ManyToManyField(blank=True, related_name='author_entries', to='books.book')),
+            ],
+        ),
+        migrations.RunPython(backfill_authors, migrations.RunPython.noop),
+    ]
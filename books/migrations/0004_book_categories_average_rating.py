@@ -0,0 +1,34 @@
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_author'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='categories',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='average_rating',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['categories'], name='book_categories_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['average_rating', 'google_id'], name='book_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['published_date', 'google_id'], name='book_published_idx'),
+        ),
+    ]
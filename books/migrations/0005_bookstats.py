@@ -0,0 +1,53 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_counts(apps, schema_editor):
+    Interaction = apps.get_model('books', 'UserBookInteraction')
+    BookStats = apps.get_model('books', 'BookStats')
+    db_alias = schema_editor.connection.alias
+    rows = Interaction.objects.using(db_alias).values('book_id').annotate(
+        want_to_read=Count('id', filter=Q(status='WTR')),
+        reading=Count('id', filter=Q(status='RDG')),
+        read=Count('id', filter=Q(status='RD')),
+        favorite=Count('id', filter=Q(is_favorite=True)),
+    )
+    BookStats.objects.using(db_alias).bulk_create(
+        [
+            BookStats(
+                book_id=row['book_id'],
+                want_to_read_count=row['want_to_read'],
+                reading_count=row['reading'],
+                read_count=row['read'],
+                favorite_count=row['favorite'],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_categories_average_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookStats',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='books.book')),
+                ('want_to_read_count', models.IntegerField(default=0)),
+                ('reading_count', models.IntegerField(default=0)),
+                ('read_count', models.IntegerField(default=0)),
+                ('favorite_count', models.IntegerField(default=0)),
+                ('trending_score', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-trending_score'], name='bookstats_trending_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
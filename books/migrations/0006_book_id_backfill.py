@@ -0,0 +1,114 @@
+"""
+First half of moving Book's primary key from google_id to a bigint id.
+
+Runs online, outside a transaction: it adds shadow columns (books_book.id and
+a book_ref column on every table referencing Book), kept filled for new
+writes by a column default and a trigger, backfills existing rows in small
+committed batches, then proves the shadow columns are never NULL with
+validated CHECK constraints and builds the final indexes with CREATE INDEX
+CONCURRENTLY. Nothing the running code reads changes. 0007 then swaps the
+columns without scanning any table.
+"""
+from django.db import migrations
+
+BATCH_SIZE = 5000
+
+# Tables with a book_id column referencing books_book.google_id.
+REFERENCING_TABLES = [
+    'books_userbookinteraction',
+    'books_review',
+    'books_author_books',
+    'books_bookstats',
+]
+
+# Final indexes, built on the shadow columns so the swap only attaches them.
+INDEXES = [
+    ('books_book_id_uniq', 'books_book', 'UNIQUE', 'id'),
+    ('books_book_google_id_key', 'books_book', 'UNIQUE', 'google_id'),
+    ('books_userbookinteraction_user_id_book_id_uniq', 'books_userbookinteraction', 'UNIQUE', 'user_id, book_ref'),
+    ('books_userbookinteraction_book_id_idx', 'books_userbookinteraction', '', 'book_ref'),
+    ('books_review_user_id_book_id_uniq', 'books_review', 'UNIQUE', 'user_id, book_ref'),
+    ('books_review_book_id_idx', 'books_review', '', 'book_ref'),
+    ('books_author_books_author_id_book_id_uniq', 'books_author_books', 'UNIQUE', 'author_id, book_ref'),
+    ('books_author_books_book_id_idx', 'books_author_books', '', 'book_ref'),
+    ('books_bookstats_book_id_uniq', 'books_bookstats', 'UNIQUE', 'book_ref'),
+]
+
+
+def _run_in_batches(schema_editor, sql):
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(sql, [BATCH_SIZE])
+            if cursor.rowcount < BATCH_SIZE:
+                break
+
+
+def add_and_backfill(apps, schema_editor):
+    execute = schema_editor.execute
+    # Rows written by the running code get book_ref from their google_id.
+    # (A row inserted before its book in the same transaction would get NULL
+    # and fail the CHECK below; the app always creates the book first.)
+    execute("""
+        CREATE OR REPLACE FUNCTION books_fill_book_ref() RETURNS trigger AS $$
+        BEGIN
+            NEW.book_ref := (SELECT id FROM books_book WHERE google_id = NEW.book_id);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    execute('ALTER TABLE books_book ADD COLUMN IF NOT EXISTS id bigint')
+    execute('CREATE SEQUENCE IF NOT EXISTS books_book_id_backfill_seq OWNED BY books_book.id')
+    # New rows get an id straight away; existing ones are numbered below.
+    execute("ALTER TABLE books_book ALTER COLUMN id SET DEFAULT nextval('books_book_id_backfill_seq')")
+    _run_in_batches(schema_editor, """
+        UPDATE books_book SET id = nextval('books_book_id_backfill_seq')
+        WHERE google_id IN (SELECT google_id FROM books_book WHERE id IS NULL LIMIT %s)
+    """)
+    execute('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS books_book_id_uniq ON books_book (id)')
+
+    for table in REFERENCING_TABLES:
+        execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS book_ref bigint')
+        execute(f'DROP TRIGGER IF EXISTS {table}_book_ref ON {table}')
+        execute(
+            f'CREATE TRIGGER {table}_book_ref BEFORE INSERT OR UPDATE OF book_id ON {table} '
+            f'FOR EACH ROW EXECUTE FUNCTION books_fill_book_ref()'
+        )
+        _run_in_batches(schema_editor, f"""
+            UPDATE {table} AS ref SET book_ref = book.id
+            FROM books_book AS book
+            WHERE book.google_id = ref.book_id
+              AND ref.ctid IN (SELECT ctid FROM {table} WHERE book_ref IS NULL LIMIT %s)
+        """)
+
+    # Validated CHECKs let 0007's SET NOT NULL skip its table scan.
+    # VALIDATE only takes a SHARE UPDATE EXCLUSIVE lock, so writes continue.
+    for table, column in [('books_book', 'id')] + [(table, 'book_ref') for table in REFERENCING_TABLES]:
+        execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_{column}_not_null')
+        execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_not_null CHECK ({column} IS NOT NULL) NOT VALID')
+        execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_{column}_not_null')
+
+    for name, table, unique, columns in INDEXES:
+        execute(f'CREATE {unique} INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})')
+
+
+def drop_shadow_columns(apps, schema_editor):
+    for name, *_ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+    for table in REFERENCING_TABLES:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_book_ref ON {table}')
+        schema_editor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS book_ref')
+    schema_editor.execute('DROP FUNCTION IF EXISTS books_fill_book_ref()')
+    schema_editor.execute('ALTER TABLE books_book DROP COLUMN IF EXISTS id')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('books', '0005_bookstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_and_backfill, drop_shadow_columns),
+    ]
@@ -0,0 +1,82 @@
+"""
+Second half of the Book primary key change (see 0006): swap the shadow
+columns in under one short lock. Nothing here scans a table: 0006's triggers
+and validated CHECKs guarantee the shadow columns are filled, its concurrently
+built indexes are only attached, and the new foreign keys are added NOT VALID
+(0009 validates them without blocking writes). Not reversible.
+"""
+from django.db import migrations, models
+
+# (table, constraint name, constraint kind, prebuilt index from 0006)
+REFERENCING_TABLES = [
+    ('books_userbookinteraction', 'books_userbookinteraction_user_id_book_id_uniq', 'UNIQUE',
+     'books_userbookinteraction_user_id_book_id_uniq'),
+    ('books_review', 'books_review_user_id_book_id_uniq', 'UNIQUE', 'books_review_user_id_book_id_uniq'),
+    ('books_author_books', 'books_author_books_author_id_book_id_uniq', 'UNIQUE',
+     'books_author_books_author_id_book_id_uniq'),
+    ('books_bookstats', 'books_bookstats_pkey', 'PRIMARY KEY', 'books_bookstats_book_id_uniq'),
+]
+
+
+def swap_primary_key(apps, schema_editor):
+    execute = schema_editor.execute
+    tables = ', '.join(['books_book'] + [table for table, *_ in REFERENCING_TABLES])
+    execute(f'LOCK TABLE {tables} IN ACCESS EXCLUSIVE MODE')
+
+    # Dropping the old columns also drops their foreign keys, indexes and
+    # constraints, which releases the old primary key. SET NOT NULL is proven
+    # by 0006's validated CHECK, so Postgres skips the scan.
+    for table, *_ in REFERENCING_TABLES:
+        execute(f'DROP TRIGGER {table}_book_ref ON {table}')
+        execute(f'ALTER TABLE {table} DROP COLUMN book_id')
+        execute(f'ALTER TABLE {table} RENAME COLUMN book_ref TO book_id')
+        execute(f'ALTER TABLE {table} ALTER COLUMN book_id SET NOT NULL')
+        execute(f'ALTER TABLE {table} DROP CONSTRAINT {table}_book_ref_not_null')
+    execute('DROP FUNCTION books_fill_book_ref()')
+
+    execute('ALTER TABLE books_book DROP CONSTRAINT books_book_pkey')
+    execute('ALTER TABLE books_book ALTER COLUMN id SET NOT NULL')
+    execute('ALTER TABLE books_book DROP CONSTRAINT books_book_id_not_null')
+    execute('ALTER TABLE books_book ADD CONSTRAINT books_book_pkey PRIMARY KEY USING INDEX books_book_id_uniq')
+    execute('ALTER TABLE books_book ADD CONSTRAINT books_book_google_id_key UNIQUE USING INDEX books_book_google_id_key')
+    # Hand numbering over to an identity column, as Django creates for BigAutoField.
+    execute('ALTER TABLE books_book ALTER COLUMN id DROP DEFAULT')
+    execute('DROP SEQUENCE books_book_id_backfill_seq')
+    execute('ALTER TABLE books_book ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+    execute("SELECT setval(pg_get_serial_sequence('books_book', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM books_book")
+
+    for table, constraint, kind, index in REFERENCING_TABLES:
+        execute(f'ALTER TABLE {table} ADD CONSTRAINT {constraint} {kind} USING INDEX {index}')
+        # Enforced for new rows right away; existing rows are checked by 0009.
+        execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_book_id_fk_books_book_id FOREIGN KEY (book_id) '
+            f'REFERENCES books_book (id) DEFERRABLE INITIALLY DEFERRED NOT VALID'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_book_id_backfill'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(swap_primary_key),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='book',
+                    name='google_id',
+                    field=models.CharField(max_length=100, unique=True),
+                ),
+                migrations.AddField(
+                    model_name='book',
+                    name='id',
+                    field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+                    preserve_default=False,
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # The sync indexes on the interaction and review tables are built
+    # concurrently, which cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('books', '0007_book_surrogate_primary_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbookinteraction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        AddIndexConcurrently(
+            model_name='userbookinteraction',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='interaction_sync_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='review',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='review_sync_idx'),
+        ),
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('interaction', 'Interaction'), ('review', 'Review')], max_length=12)),
+                ('object_id', models.BigIntegerField()),
+                ('book_pk', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_tombstones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_sync_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+"""
+Validates the foreign keys 0007 added NOT VALID. VALIDATE CONSTRAINT scans
+each referencing table but only takes a SHARE UPDATE EXCLUSIVE lock, so reads
+and writes continue; each table is validated in its own transaction.
+"""
+from django.db import migrations
+
+REFERENCING_TABLES = [
+    'books_userbookinteraction',
+    'books_review',
+    'books_author_books',
+    'books_bookstats',
+]
+
+
+def validate_foreign_keys(apps, schema_editor):
+    for table in REFERENCING_TABLES:
+        schema_editor.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_book_id_fk_books_book_id')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('books', '0008_sync_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(validate_foreign_keys, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,9 @@
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
 class Book(models.Model):
-    google_id = models.CharField(max_length=100, unique=True, primary_key=True)
+    google_id = models.CharField(max_length=100, unique=True)
     title = models.CharField(max_length=255)
     authors = models.JSONField(default=list) 
     published_date = models.CharField(max_length=20, null=True, blank=True)
@@ -10,11 +11,39 @@ class Book(models.Model):
     full_description = models.TextField(null=True, blank=True)
     short_description = models.TextField(null=True, blank=True) # For the AI summary on page load
     ai_summary = models.TextField(null=True, blank=True) # For the on-demand AI summary
+    categories = models.JSONField(default=list, blank=True)
+    average_rating = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Serves categories__contains lookups for category browse
+            GinIndex(fields=['categories'], name='book_categories_gin'),
+            # Keyset pagination: (sort value, google_id) tie-breaker
+            models.Index(fields=['average_rating', 'google_id'], name='book_rating_idx'),
+            models.Index(fields=['published_date', 'google_id'], name='book_published_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class Author(models.Model):
+    """
+    Normalized author, linked to every Book that lists them in `authors`.
+    `canonical_name` is the case-insensitive lookup key.
+    """
+    name = models.CharField(max_length=255)
+    canonical_name = models.CharField(max_length=255, unique=True)
+    books = models.ManyToManyField(Book, related_name='author_entries', blank=True)
+
+    @staticmethod
+    def canonicalize(name):
+        return " ".join(str(name).split()).casefold()[:255]
+
+    def __str__(self):
+        return self.name
+
+
 class UserBookInteraction(models.Model):
     class Status(models.TextChoices):
         WANT_TO_READ = 'WTR', 'Want to Read'
@@ -34,10 +63,15 @@ class UserBookInteraction(models.Model):
         blank=True
     )
     is_favorite = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         # Ensures a user can only have one interaction entry per book
         unique_together = ('user', 'book')
+        indexes = [
+            # Delta sync: a user's changes in (updated_at, id) order
+            models.Index(fields=['user', 'updated_at', 'id'], name='interaction_sync_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.book.title}'
@@ -49,10 +83,61 @@ class Review(models.Model):
     rating = models.PositiveSmallIntegerField() # e.g., 1 to 5
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         # Ensures a user can only write one review per book
         unique_together = ('user', 'book')
+        indexes = [
+            models.Index(fields=['user', 'updated_at', 'id'], name='review_sync_idx'),
+        ]
+
+    def __str__(self):
+        return f'Review for {self.book.title} by {self.user.username}'
+
+
+class BookStats(models.Model):
+    """
+    Engagement counters and time-decayed trending score for a book,
+    aggregated from UserBookInteraction writes by books/popularity.py.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    want_to_read_count = models.IntegerField(default=0)
+    reading_count = models.IntegerField(default=0)
+    read_count = models.IntegerField(default=0)
+    favorite_count = models.IntegerField(default=0)
+    # log(sum of event weights * e^(decay * (event time - epoch))); see popularity.py
+    trending_score = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-trending_score'], name='bookstats_trending_idx'),
+        ]
+
+    def __str__(self):
+        return f'Stats for {self.book_id}'
+
+
+class SyncTombstone(models.Model):
+    """
+    Marker left behind when a user's interaction or review is deleted, so
+    delta sync (books/sync.py) can tell clients to drop their copy.
+    """
+    class Kind(models.TextChoices):
+        INTERACTION = 'interaction', 'Interaction'
+        REVIEW = 'review', 'Review'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sync_tombstones')
+    kind = models.CharField(max_length=12, choices=Kind.choices)
+    object_id = models.BigIntegerField()
+    # Plain integer, not a foreign key: the book may be the thing that was deleted.
+    book_pk = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_sync_idx'),
+        ]
 
     def __str__(self):
-        return f'Review for {self.book.title} by {self.user.username}'
\ No newline at end of file
+        return f'Deleted {self.kind} {self.object_id}'
@@ -0,0 +1,271 @@
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+
+from .models import Book, BookStats, UserBookInteraction
+
+logger = logging.getLogger(__name__)
+
+Status = UserBookInteraction.Status
+
+STATUS_COUNTERS = {
+    Status.WANT_TO_READ: "want_to_read_count",
+    Status.READING: "reading_count",
+    Status.READ: "read_count",
+}
+
+# Trending weight of each engagement event.
+EVENT_WEIGHTS = {
+    Status.WANT_TO_READ: 1.0,
+    Status.READING: 2.0,
+    Status.READ: 2.0,
+    "favorite": 3.0,
+}
+
+TRENDING_CACHE_KEY = "trending_books"
+TRENDING_EPOCH = 1735689600  # 2025-01-01T00:00:00Z
+TRENDING_HALF_LIFE_HOURS = getattr(settings, "TRENDING_HALF_LIFE_HOURS", 48)
+TRENDING_SIZE = getattr(settings, "TRENDING_SIZE", 100)
+TRENDING_CACHE_TTL = getattr(settings, "TRENDING_CACHE_TTL", 5 * 60)
+FLUSH_EVENTS = getattr(settings, "POPULARITY_FLUSH_EVENTS", 200)
+FLUSH_INTERVAL = getattr(settings, "POPULARITY_FLUSH_INTERVAL", 10)
+
+
+# -------------------------------
+# Time-decayed score
+# -------------------------------
+
+def _decay_rate():
+    return math.log(2) / (TRENDING_HALF_LIFE_HOURS * 3600)
+
+
+def event_score(weight, timestamp):
+    """
+    Log-space score of one event. Instead of decaying every book over time,
+    later events are worth exponentially more relative to a fixed epoch, so
+    stored scores stay comparable and only touched rows are ever written.
+    """
+    return math.log(weight) + _decay_rate() * (timestamp - TRENDING_EPOCH)
+
+
+def combine_scores(a, b):
+    """log(e^a + e^b) without overflow; None means "no events"."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+# -------------------------------
+# Write-behind buffer
+# -------------------------------
+
+class PopularityBuffer:
+    """
+    Per-process buffer of counter deltas and trending events. Many
+    interaction writes on the same hot book collapse into one row update
+    per flush instead of one contended UPDATE each.
+
+    A flush is due after FLUSH_EVENTS events, or FLUSH_INTERVAL seconds after
+    the oldest buffered event. A timer thread enforces the interval, so a
+    quiet process does not sit on its last few events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(Counter)
+        self._scores = {}
+        self._events = 0
+        self._oldest = None  # monotonic time of the oldest unflushed event
+        self._timer = None
+        self._wakeup = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="popularity")
+
+    def record(self, book_id, deltas, weights):
+        now = time.time()
+        with self._lock:
+            self._deltas[book_id].update(deltas)
+            for weight in weights:
+                self._scores[book_id] = combine_scores(self._scores.get(book_id), event_score(weight, now))
+            self._events += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._wakeup.set()
+            # Started here rather than at import so it also runs in forked workers.
+            if self._timer is None or not self._timer.is_alive():
+                self._timer = threading.Thread(target=self._run_timer, name="popularity-timer", daemon=True)
+                self._timer.start()
+            due = self._events >= FLUSH_EVENTS or time.monotonic() - self._oldest >= FLUSH_INTERVAL
+            if due:
+                self._oldest = None
+        if due:
+            self._executor.submit(self._flush_in_background)
+
+    def _run_timer(self):
+        while True:
+            with self._lock:
+                oldest = self._oldest
+                due = oldest is not None and time.monotonic() - oldest >= FLUSH_INTERVAL
+                if due:
+                    self._oldest = None
+            if due:
+                self._executor.submit(self._flush_in_background)
+            elif oldest is None:
+                # Idle until the next event arrives.
+                self._wakeup.wait()
+                self._wakeup.clear()
+            else:
+                time.sleep(max(oldest + FLUSH_INTERVAL - time.monotonic(), 0))
+
+    def _drain(self):
+        with self._lock:
+            deltas, scores = self._deltas, self._scores
+            self._deltas, self._scores, self._events, self._oldest = defaultdict(Counter), {}, 0, None
+        return deltas, scores
+
+    def flush(self):
+        """Apply buffered changes in one transaction and refresh the trending list."""
+        deltas, scores = self._drain()
+        # Books deleted since their events were buffered are skipped.
+        book_ids = set(Book.objects.filter(pk__in=set(deltas) | set(scores)).values_list("pk", flat=True))
+        if not book_ids:
+            return 0
+        with transaction.atomic():
+            BookStats.objects.bulk_create(
+                [BookStats(book_id=book_id) for book_id in book_ids], ignore_conflicts=True
+            )
+            rows = list(BookStats.objects.select_for_update().filter(book_id__in=book_ids).order_by("book_id"))
+            for row in rows:
+                for field, delta in deltas.get(row.book_id, {}).items():
+                    setattr(row, field, getattr(row, field) + delta)
+                row.trending_score = combine_scores(row.trending_score, scores.get(row.book_id))
+            BookStats.objects.bulk_update(
+                rows,
+                ["want_to_read_count", "reading_count", "read_count", "favorite_count", "trending_score"],
+            )
+        refresh_trending()
+        return len(rows)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing popularity counters failed")
+        finally:
+            close_old_connections()
+
+
+buffer = PopularityBuffer()
+atexit.register(buffer.flush)
+
+
+# -------------------------------
+# Interaction hooks (see signals.py)
+# -------------------------------
+
+def snapshot(interaction):
+    """Remember the state an interaction was loaded with."""
+    interaction._popularity_state = (interaction.status, interaction.is_favorite)
+
+
+def _changes(old, new):
+    (old_status, old_favorite), (new_status, new_favorite) = old, new
+    deltas, weights = Counter(), []
+    if old_status != new_status:
+        if old_status in STATUS_COUNTERS:
+            deltas[STATUS_COUNTERS[old_status]] -= 1
+        if new_status in STATUS_COUNTERS:
+            deltas[STATUS_COUNTERS[new_status]] += 1
+            weights.append(EVENT_WEIGHTS[new_status])
+    if old_favorite != new_favorite:
+        deltas["favorite_count"] += 1 if new_favorite else -1
+        if new_favorite:
+            weights.append(EVENT_WEIGHTS["favorite"])
+    return deltas, weights
+
+
+def _record_after_commit(book_id, deltas, weights):
+    if deltas or weights:
+        transaction.on_commit(lambda: buffer.record(book_id, deltas, weights))
+
+
+def interaction_saved(interaction, created):
+    old = (None, False) if created else getattr(interaction, "_popularity_state", (None, False))
+    new = (interaction.status, interaction.is_favorite)
+    snapshot(interaction)
+    _record_after_commit(interaction.book_id, *_changes(old, new))
+
+
+def interaction_deleted(interaction):
+    old = getattr(interaction, "_popularity_state", (interaction.status, interaction.is_favorite))
+    deltas, _ = _changes(old, (None, False))
+    _record_after_commit(interaction.book_id, deltas, [])
+
+
+# -------------------------------
+# Trending list
+# -------------------------------
+
+def refresh_trending():
+    """Store the top TRENDING_SIZE book ids, best first, in the shared cache."""
+    book_ids = list(
+        BookStats.objects.filter(trending_score__isnull=False)
+        .order_by("-trending_score")
+        .values_list("book_id", flat=True)[:TRENDING_SIZE]
+    )
+    cache.set(TRENDING_CACHE_KEY, book_ids, TRENDING_CACHE_TTL)
+    return book_ids
+
+
+def get_trending_book_ids(limit=10):
+    book_ids = cache.get(TRENDING_CACHE_KEY)
+    if book_ids is None:
+        book_ids = refresh_trending()
+    return book_ids[:limit]
+
+
+def rebuild_scores():
+    """
+    {book_id: trending score} from the interactions' current state. Each
+    interaction counts as one event of its status and favorite weight at
+    its last update, since earlier events are not stored.
+    """
+    scores = {}
+    rows = UserBookInteraction.objects.values_list("book_id", "status", "is_favorite", "updated_at")
+    for book_id, status, is_favorite, updated_at in rows.iterator(chunk_size=5000):
+        weight = EVENT_WEIGHTS.get(status, 0) + (EVENT_WEIGHTS["favorite"] if is_favorite else 0)
+        if weight:
+            scores[book_id] = combine_scores(scores.get(book_id), event_score(weight, updated_at.timestamp()))
+    return scores
+
+
+def rebuild_counts():
+    """Recount every book's counters and trending score from UserBookInteraction (e.g. after a crash)."""
+    rows = UserBookInteraction.objects.values("book_id").annotate(
+        want_to_read_count=Count("id", filter=Q(status=Status.WANT_TO_READ)),
+        reading_count=Count("id", filter=Q(status=Status.READING)),
+        read_count=Count("id", filter=Q(status=Status.READ)),
+        favorite_count=Count("id", filter=Q(is_favorite=True)),
+    )
+    scores = rebuild_scores()
+    fields = ["want_to_read_count", "reading_count", "read_count", "favorite_count"]
+    with transaction.atomic():
+        BookStats.objects.update(**{field: 0 for field in fields}, trending_score=None)
+        BookStats.objects.bulk_create(
+            [BookStats(**row, trending_score=scores.get(row["book_id"])) for row in rows.iterator()],
+            update_conflicts=True,
+            unique_fields=["book"],
+            update_fields=fields + ["trending_score"],
+            batch_size=1000,
+        )
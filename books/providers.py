@@ -0,0 +1,243 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import Signal, receiver
+from django.utils.module_loading import import_string
+
+
+# Sent after every upstream HTTP call with `url` (no query string), `status`
+# (None if the call raised) and `duration` in seconds.
+upstream_request = Signal()
+
+
+# -------------------------------
+# Provider interface
+# -------------------------------
+
+class BookProvider:
+    """
+    A source of raw book data. Results use the upstream shapes the
+    normalizers in services.py expect: Google Books volumes/search
+    responses and NYT bestseller entries. Returning None means "no answer",
+    and the next provider in BOOK_PROVIDERS is asked.
+    """
+
+    def search(self, query, max_results=20, start_index=0):
+        return None
+
+    def get_details(self, google_id):
+        return None
+
+    def get_bestsellers(self, list_name, limit):
+        return None
+
+
+# -------------------------------
+# HTTP provider (Google Books + NYT)
+# -------------------------------
+
+def _get(url, params):
+    import requests  # loaded on first upstream call, not at startup
+
+    started, status = time.perf_counter(), None
+    try:
+        response = requests.get(url, params=params, timeout=10)
+        status = response.status_code
+        return response
+    finally:
+        upstream_request.send(sender=None, url=url, status=status, duration=time.perf_counter() - started)
+
+
+class HttpBookProvider(BookProvider):
+    """Live Google Books and NYT Books APIs."""
+
+    def search(self, query, max_results=20, start_index=0):
+        url = "https://www.googleapis.com/books/v1/volumes"
+        params = {
+            "q": query,
+            "maxResults": max_results,
+            "startIndex": start_index,
+            "key": getattr(settings, "GOOGLE_BOOKS_API_KEY", None),
+        }
+        response = _get(url, params)
+        if response.status_code != 200:
+            return None
+        return response.json()
+
+    def get_details(self, google_id):
+        url = f"https://www.googleapis.com/books/v1/volumes/{google_id}"
+        params = {"key": getattr(settings, "GOOGLE_BOOKS_API_KEY", None)}
+        response = _get(url, params)
+        if response.status_code != 200:
+            return None
+        return response.json()
+
+    def get_bestsellers(self, list_name, limit):
+        url = f"https://api.nytimes.com/svc/books/v3/lists/current/{list_name}.json"
+        params = {"api-key": getattr(settings, "NYT_BOOKS_API_KEY", None)}
+        response = _get(url, params)
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        return data.get("results", {}).get("books", [])[:limit]
+
+
+# -------------------------------
+# Local catalog provider (memory-mapped)
+# -------------------------------
+
+# Index layout: 16-byte header (magic, slot count) followed by an
+# open-addressing hash table of (id hash, record offset + 1) uint64 pairs.
+# A zero offset marks an empty slot.
+_INDEX_MAGIC = b"BKIDX\x00\x00\x01"
+_HEADER = struct.Struct("<8sQ")
+_SLOT = struct.Struct("<QQ")
+
+
+def _id_hash(google_id):
+    return int.from_bytes(hashlib.blake2b(google_id.encode(), digest_size=8).digest(), "little")
+
+
+def index_path_for(catalog_path):
+    return f"{catalog_path}.idx"
+
+
+def build_catalog_index(catalog_path):
+    """
+    Write the offset index for a JSON Lines catalog of Google Books volumes.
+    Returns the number of records indexed.
+    """
+    entries = []
+    with open(catalog_path, "rb") as catalog:
+        offset = 0
+        for line in catalog:
+            if line.strip():
+                entries.append((_id_hash(json.loads(line)["id"]), offset))
+            offset += len(line)
+
+    slots = 1
+    while slots < max(len(entries) * 2, 8):
+        slots <<= 1
+    table = bytearray(_SLOT.size * slots)
+    for key_hash, offset in entries:
+        slot = key_hash & (slots - 1)
+        while _SLOT.unpack_from(table, slot * _SLOT.size)[1]:
+            slot = (slot + 1) & (slots - 1)
+        _SLOT.pack_into(table, slot * _SLOT.size, key_hash, offset + 1)
+
+    tmp_path = index_path_for(catalog_path) + ".tmp"
+    with open(tmp_path, "wb") as index:
+        index.write(_HEADER.pack(_INDEX_MAGIC, slots))
+        index.write(table)
+    os.replace(tmp_path, index_path_for(catalog_path))
+    return len(entries)
+
+
+class LocalCatalogProvider(BookProvider):
+    """
+    Serves books from an on-disk JSON Lines catalog (one Google Books volume
+    per line). The catalog and its index (see build_catalog_index) are
+    memory-mapped, so startup does no parsing and the OS page cache holds
+    only the records that are actually read. Lookups by id are O(1).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._index = None
+        self._slots = 0
+
+    def _open(self):
+        if self._catalog is not None:
+            return
+        with self._lock:
+            if self._catalog is not None:
+                return
+            with open(index_path_for(self.path), "rb") as index_file:
+                index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, slots = _HEADER.unpack_from(index, 0)
+            if magic != _INDEX_MAGIC:
+                raise ValueError(f"{index_path_for(self.path)} is not a catalog index.")
+            with open(self.path, "rb") as catalog_file:
+                self._catalog = mmap.mmap(catalog_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index, self._slots = index, slots
+
+    def _record_at(self, offset):
+        end = self._catalog.find(b"\n", offset)
+        return json.loads(self._catalog[offset:end if end != -1 else len(self._catalog)])
+
+    def get_details(self, google_id):
+        self._open()
+        key_hash = _id_hash(google_id)
+        mask = self._slots - 1
+        slot = key_hash & mask
+        while True:
+            stored_hash, offset = _SLOT.unpack_from(self._index, _HEADER.size + slot * _SLOT.size)
+            if not offset:
+                return None
+            if stored_hash == key_hash:
+                record = self._record_at(offset - 1)
+                if record.get("id") == google_id:
+                    return record
+            slot = (slot + 1) & mask
+
+    def search(self, query, max_results=20, start_index=0):
+        """Sequential scan: meant for offline runs and load tests, not huge catalogs."""
+        self._open()
+        terms = [term.encode() for term in query.lower().split()]
+        if not terms:
+            return None
+        items, skipped = [], 0
+        position, size = 0, len(self._catalog)
+        while position < size and len(items) < max_results:
+            end = self._catalog.find(b"\n", position)
+            if end == -1:
+                end = size
+            line = self._catalog[position:end]
+            position = end + 1
+            # Cheap byte filter before paying for JSON parsing.
+            lowered = line.lower()
+            if not all(term in lowered for term in terms):
+                continue
+            record = json.loads(line)
+            volume = record.get("volumeInfo", {})
+            text = " ".join([volume.get("title", "")] + volume.get("authors", [])).lower()
+            if not all(term.decode() in text for term in terms):
+                continue
+            if skipped < start_index:
+                skipped += 1
+            else:
+                items.append(record)
+        return {"totalItems": len(items), "items": items}
+
+
+# -------------------------------
+# Provider chain
+# -------------------------------
+
+@lru_cache(maxsize=None)
+def get_providers():
+    """
+    Instantiate BOOK_PROVIDERS in order. Entries are dotted paths or
+    (dotted path, kwargs) pairs.
+    """
+    providers = []
+    for entry in getattr(settings, "BOOK_PROVIDERS", ["books.providers.HttpBookProvider"]):
+        path, options = (entry, {}) if isinstance(entry, str) else entry
+        providers.append(import_string(path)(**options))
+    return providers
+
+
+@receiver(setting_changed)
+def _reset_providers(setting, **kwargs):
+    if setting == "BOOK_PROVIDERS":
+        get_providers.cache_clear()
@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .services import decode_cursor, encode_cursor, normalize_google_book, search_google_books
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_TTL = getattr(settings, "SEARCH_PAGE_TTL", 5 * 60)
+# Seen-id hashes carried in the cursor for de-duplication across pages.
+SEARCH_CURSOR_SEEN = 100
+
+
+# -------------------------------
+# Cached upstream pages
+# -------------------------------
+
+def _page_key(query, offset, page_size):
+    digest = hashlib.sha1(query.encode()).hexdigest()
+    return f"search_page_{digest}_{offset}_{page_size}"
+
+
+def fetch_search_page(query, offset, page_size):
+    """
+    Raw upstream items for one page, served from the cache when prefetched.
+    A failed upstream call gives an empty page and is not cached, so the
+    next request retries it.
+    """
+    key = _page_key(query, offset, page_size)
+    items = cache.get(key)
+    if items is None:
+        data = search_google_books(query, max_results=page_size, start_index=offset)
+        if data is None:
+            return []
+        items = data.get("items", [])
+        cache.set(key, items, SEARCH_PAGE_TTL)
+    return items
+
+
+# -------------------------------
+# Speculative next-page prefetch
+# -------------------------------
+
+class SearchPrefetcher:
+    """
+    Warms the cache with page N+1 while the client reads page N.
+
+    Each client waits for at most one prefetch: a newer page request from
+    the same client cancels the previous one if it has not started and no
+    other client waits for it. A prefetch that reaches a worker after its
+    clients have moved on or been idle for `idle_seconds` is dropped. At
+    most `max_pending` prefetches are queued or running; extra ones are not
+    scheduled.
+    """
+
+    def __init__(self, workers=2, max_pending=16, idle_seconds=30):
+        self.max_pending = max_pending
+        self.idle_seconds = idle_seconds
+        self._pending = {}  # page key -> future
+        self._clients = {}  # client -> (page key it waits for, time of its last request)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="search-prefetch")
+
+    def _waiting(self, key):
+        return [requested_at for waited, requested_at in self._clients.values() if waited == key]
+
+    def schedule(self, client, query, offset, page_size):
+        key = _page_key(query, offset, page_size)
+        with self._lock:
+            previous = self._clients.pop(client, None)
+            if previous is not None and previous[0] != key and not self._waiting(previous[0]):
+                if self._pending[previous[0]].cancel():
+                    del self._pending[previous[0]]
+            if key in self._pending:
+                self._clients[client] = (key, time.monotonic())
+                return False
+            if len(self._pending) >= self.max_pending:
+                return False
+            # Submitted under the lock so _run can't finish before it is recorded.
+            self._pending[key] = self._executor.submit(self._run, key, query, offset, page_size)
+            self._clients[client] = (key, time.monotonic())
+        return True
+
+    def _run(self, key, query, offset, page_size):
+        try:
+            with self._lock:
+                waiting = self._waiting(key)
+            if waiting and time.monotonic() - max(waiting) <= self.idle_seconds and cache.get(key) is None:
+                fetch_search_page(query, offset, page_size)
+        except Exception:
+            logger.exception("Search prefetch failed for offset %s", offset)
+        finally:
+            with self._lock:
+                del self._pending[key]
+                for client in [client for client, (waited, _) in self._clients.items() if waited == key]:
+                    del self._clients[client]
+
+
+prefetcher = SearchPrefetcher(
+    workers=getattr(settings, "SEARCH_PREFETCH_WORKERS", 2),
+    max_pending=getattr(settings, "SEARCH_PREFETCH_MAX_PENDING", 16),
+    idle_seconds=getattr(settings, "SEARCH_PREFETCH_IDLE_SECONDS", 30),
+)
+
+
+# -------------------------------
+# Cursor pagination
+# -------------------------------
+
+def _id_hash(google_id):
+    return zlib.crc32((google_id or "").encode())
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def search_client_key(request):
+    """Who is paging, for per-client prefetch: the credential if any, else the address."""
+    credential = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if credential:
+        return hashlib.sha1(credential.encode()).hexdigest()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def search_books_page(query, cursor=None, page_size=20, client=None):
+    """
+    One page of normalized search results and the cursor for the next one.
+    The cursor carries the query, the upstream offset and hashes of recently
+    returned ids, so books repeated by the upstream across pages are dropped.
+    `client` (see search_client_key) scopes the next-page prefetch.
+    Raises ValueError for a cursor that is invalid or belongs to another query.
+    """
+    offset, seen = 0, []
+    if cursor:
+        state = decode_cursor(cursor)
+        if not isinstance(state, dict) or state.get("q") != query:
+            raise ValueError("Cursor does not match this query.")
+        offset, seen = state.get("o", 0), state.get("s", [])
+        if not (_is_int(offset) and offset >= 0 and isinstance(seen, list)
+                and len(seen) <= SEARCH_CURSOR_SEEN and all(map(_is_int, seen))):
+            raise ValueError("Invalid cursor.")
+
+    items = fetch_search_page(query, offset, page_size)
+    seen_set = set(seen)
+    books = []
+    for item in items:
+        id_hash = _id_hash(item.get("id"))
+        if id_hash in seen_set:
+            continue
+        seen_set.add(id_hash)
+        seen.append(id_hash)
+        books.append(normalize_google_book(item))
+
+    next_cursor = None
+    if len(items) >= page_size:
+        next_offset = offset + len(items)
+        next_cursor = encode_cursor({"q": query, "o": next_offset, "s": seen[-SEARCH_CURSOR_SEEN:]})
+        if getattr(settings, "SEARCH_PREFETCH_ENABLED", True):
+            prefetcher.schedule(client, query, next_offset, page_size)
+    return books, next_cursor
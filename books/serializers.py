@@ -1,12 +1,58 @@
 from rest_framework import serializers
 from .models import Book, UserBookInteraction, Review
+from .services import get_book_by_key
+
+
+# -----------------------------------
+# Sparse fieldsets
+# -----------------------------------
+
+# Named shortcuts accepted by `?fields=`, e.g. `?fields=compact,rank`.
+FIELD_PROFILES = {
+    "compact": [
+        "id", "google_id", "title", "authors", "thumbnail", "thumbnail_url", "status", "is_favorite",
+    ],
+}
+
+
+def parse_fields(request):
+    """Requested field names from `?fields=`, or None for every field."""
+    value = request.query_params.get("fields")
+    if not value:
+        return None
+    fields = set()
+    for name in value.split(","):
+        name = name.strip()
+        fields.update(FIELD_PROFILES.get(name, [name]))
+    return fields
+
+
+def pick_fields(data, fields):
+    """Apply a parsed fieldset to an already-built dict."""
+    if fields is None:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
+
+
+class SparseFieldsMixin:
+    """
+    Drops every field not listed in `context["fields"]` at construction,
+    so unrequested fields are never computed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get("fields")
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 # -----------------------------------
 # Book Serializers
 # -----------------------------------
 
-class BookSerializer(serializers.Serializer):
+class BookSerializer(SparseFieldsMixin, serializers.Serializer):
     """
     Serializer for normalized external API books (Google Books, NYT).
     This matches the unified schema returned by services.py.
@@ -24,19 +70,22 @@ class BookSerializer(serializers.Serializer):
     rank = serializers.IntegerField(allow_null=True, required=False)
 
 
-class BookDetailSerializer(serializers.ModelSerializer):
+class BookDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for detailed book info from our local DB model.
     """
     class Meta:
         model = Book
         fields = [
+            "id",
             "google_id",
             "title",
             "authors",
             "published_date",
             "thumbnail_url",
             "short_description",
+            "categories",
+            "average_rating",
         ]
 
 
@@ -55,11 +104,22 @@ class SummarySerializer(serializers.Serializer):
 # User Interactions
 # -----------------------------------
 
+class BookKeyField(serializers.PrimaryKeyRelatedField):
+    """Accepts a book by integer id or google_id; always renders the id."""
+
+    def to_internal_value(self, data):
+        book = get_book_by_key(data)
+        if book is None:
+            self.fail("does_not_exist", pk_value=data)
+        return book
+
+
 class UserBookInteractionSerializer(serializers.ModelSerializer):
     """
     Serializer for the UserBookInteraction model.
     """
     user = serializers.PrimaryKeyRelatedField(read_only=True)
+    book = BookKeyField(queryset=Book.objects.all())
 
     class Meta:
         model = UserBookInteraction
@@ -78,5 +138,5 @@ class ReviewSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Review
-        fields = ["id", "book", "user", "username", "rating", "comment", "created_at"]
+        fields = ["id", "book", "user", "username", "rating", "comment", "created_at", "updated_at"]
         read_only_fields = ["user", "book"]
@@ -1,46 +1,53 @@
-import requests
+import base64
+import binascii
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from django.conf import settings
 from django.core.cache import cache
-from .models import Book
-import openai
+from django.db.models import Q
+from .models import Book, Author
+from .cache import book_cache
+from .autocomplete import index_book
+from .providers import get_providers, upstream_request
+from .popularity import get_trending_book_ids
+
+logger = logging.getLogger(__name__)
 
 # -------------------------------
-# External API helpers
+# External API helpers (see providers.py)
 # -------------------------------
 
-def search_google_books(query, max_results=20):
-    """Query the Google Books API with a search term."""
-    url = "https://www.googleapis.com/books/v1/volumes"
-    params = {
-        "q": query,
-        "maxResults": max_results,
-        "key": getattr(settings, "GOOGLE_BOOKS_API_KEY", None),
-    }
-    response = requests.get(url, params=params, timeout=10)
-    if response.status_code != 200:
-        return None
-    return response.json()
+def search_google_books(query, max_results=20, start_index=0):
+    """Search books through the BOOK_PROVIDERS chain (Google Books by default)."""
+    result = None
+    for provider in get_providers():
+        data = provider.search(query, max_results=max_results, start_index=start_index)
+        if data and data.get("items"):
+            return data
+        result = data if data is not None else result
+    return result
 
 
 def get_google_book_details(google_id):
     """Get details for a specific book by Google ID."""
-    url = f"https://www.googleapis.com/books/v1/volumes/{google_id}"
-    params = {"key": getattr(settings, "GOOGLE_BOOKS_API_KEY", None)}
-    response = requests.get(url, params=params, timeout=10)
-    if response.status_code != 200:
-        return None
-    return response.json()
+    for provider in get_providers():
+        data = provider.get_details(google_id)
+        if data is not None:
+            return data
+    return None
 
 
 def get_nyt_bestsellers(list_name="hardcover-fiction", limit=10):
     """Get NYT bestseller list."""
-    url = f"https://api.nytimes.com/svc/books/v3/lists/current/{list_name}.json"
-    params = {"api-key": getattr(settings, "NYT_BOOKS_API_KEY", None)}
-    response = requests.get(url, params=params, timeout=10)
-    if response.status_code != 200:
-        return []
-    data = response.json()
-    return data.get("results", {}).get("books", [])[:limit]
+    for provider in get_providers():
+        books = provider.get_bestsellers(list_name, limit)
+        if books:
+            return books
+    return []
 
 
 # -------------------------------
@@ -80,30 +87,231 @@ def normalize_nyt_book(item):
     }
 
 
+def book_to_unified(book):
+    """Render a local Book in the unified schema used by list endpoints."""
+    return {
+        "google_id": book.google_id,
+        "title": book.title,
+        "authors": book.authors,
+        "published_date": book.published_date,
+        "categories": book.categories,
+        "thumbnail": book.thumbnail_url,
+        "description": book.full_description,
+        "average_rating": book.average_rating,
+        "amazon_url": None,
+        "rank": None,
+    }
+
+
 # -------------------------------
 # DB caching / get_or_create
 # -------------------------------
 
+def book_fields_from_google(data):
+    """Map a Google Books volume onto Book model fields."""
+    volume = data.get("volumeInfo", {})
+    return {
+        "google_id": data.get("id"),
+        "title": volume.get("title", "Unknown Title")[:255],
+        "authors": volume.get("authors", []),
+        "published_date": volume.get("publishedDate"),
+        "thumbnail_url": (volume.get("imageLinks", {}) or {}).get("thumbnail"),
+        "full_description": volume.get("description", ""),
+        "categories": volume.get("categories", []),
+        "average_rating": volume.get("averageRating"),
+    }
+
+
 def get_or_create_book_details(google_id):
-    """Check DB for book; fetch from Google if missing."""
+    """Check the book cache / DB for book; fetch from Google if missing."""
+    book = book_cache.get(google_id)
+    if book is not None:
+        return book
+
+    data = get_google_book_details(google_id)
+    if not data or "volumeInfo" not in data:
+        return None
+    return Book.objects.create(**book_fields_from_google(data))
+
+
+def book_key_lookup(book_key, prefix=""):
+    """
+    Filter kwargs for a book addressed by integer id or google_id, e.g.
+    book_key_lookup("42", "book__") -> {"book__pk": 42}. All-digit keys are
+    ids; Google volume ids always contain letters.
+    """
+    book_key = str(book_key)
+    if book_key.isdigit():
+        return {f"{prefix}pk": int(book_key)}
+    return {f"{prefix}google_id": book_key}
+
+
+def get_book_by_key(book_key):
+    """
+    Local Book addressed by either key: the integer id or the google_id.
+    Returns None if no book matches.
+    """
+    lookup = book_key_lookup(book_key)
+    if "pk" in lookup:
+        return Book.objects.filter(**lookup).first()
+    return book_cache.get(lookup["google_id"])
+
+
+def get_or_create_book_by_key(book_key):
+    """
+    Book addressed by either key. Integer ids only resolve locally; a
+    google_id missing from the DB is fetched from Google.
+    """
+    if str(book_key).isdigit():
+        return get_book_by_key(book_key)
+    return get_or_create_book_details(book_key)
+
+
+def book_written(book):
+    """
+    Propagate a Book write to the book cache, author index, autocomplete
+    index and similarity index. Runs from post_save and after bulk inserts.
+    """
+    book_cache.invalidate(book.google_id)
+    sync_book_authors(book)
+    index_book(book)
+    # The similarity index only exists once books.similarity (and numpy) has
+    # been loaded by a request; don't import it just to find it empty.
+    similarity = sys.modules.get("books.similarity")
+    if similarity is not None:
+        similarity.index_book_vector(book)
+
+
+def get_or_create_books_bulk(google_ids):
+    """
+    Resolve many Google IDs at once: local hits in one query, misses fetched
+    from Google concurrently and inserted in one batch.
+    Returns ({google_id: Book or None}, set of google_ids whose upstream
+    fetch failed). A failed fetch only affects its own id.
+    """
+    google_ids = list(dict.fromkeys(google_ids))
+    found = Book.objects.in_bulk(google_ids, field_name="google_id")
+    missing = [google_id for google_id in google_ids if google_id not in found]
+    if not missing:
+        return {google_id: found[google_id] for google_id in google_ids}, set()
+
+    workers = min(len(missing), getattr(settings, "BOOK_FETCH_CONCURRENCY", 8))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each fetch runs in a copy of this request's context (replica
+        # pinning, profiler capture).
+        futures = [pool.submit(copy_context().run, get_google_book_details, google_id) for google_id in missing]
+        results, failed = [], set()
+        for google_id, future in zip(missing, futures):
+            try:
+                results.append(future.result())
+            except Exception:
+                logger.warning("Fetching book %s from upstream failed", google_id, exc_info=True)
+                results.append(None)
+                failed.add(google_id)
+
+    new_books = []
+    for google_id, data in zip(missing, results):
+        if data and "volumeInfo" in data:
+            book = Book(**book_fields_from_google(data))
+            found[google_id] = book
+            new_books.append(book)
+
+    if new_books:
+        Book.objects.bulk_create(new_books, ignore_conflicts=True)
+        # ignore_conflicts leaves the ids unset; read the rows back, which
+        # also picks up any a concurrent request inserted first.
+        saved = Book.objects.in_bulk([book.google_id for book in new_books], field_name="google_id")
+        found.update(saved)
+        # bulk_create skips post_save, so run the Book write hooks here.
+        for book in saved.values():
+            book_written(book)
+
+    return {google_id: found.get(google_id) for google_id in google_ids}, failed
+
+
+# -------------------------------
+# Author index
+# -------------------------------
+
+def sync_book_authors(book):
+    """Link `book` to one Author row per entry in its `authors` list."""
+    wanted = {}
+    for name in book.authors or []:
+        canonical = Author.canonicalize(name)
+        if canonical:
+            wanted.setdefault(canonical, str(name)[:255])
+
+    current = set(book.author_entries.values_list("canonical_name", flat=True))
+    if current == set(wanted):
+        return
+
+    Author.objects.bulk_create(
+        [Author(name=name, canonical_name=canonical) for canonical, name in wanted.items()],
+        ignore_conflicts=True,
+    )
+    book.author_entries.set(Author.objects.filter(canonical_name__in=wanted))
+
+
+def get_books_by_author(name):
+    """Local books by an author, matched case-insensitively."""
+    return Book.objects.filter(
+        author_entries__canonical_name=Author.canonicalize(name)
+    ).order_by("title", "google_id")
+
+
+# -------------------------------
+# Category browse (keyset pagination)
+# -------------------------------
+
+CATEGORY_SORTS = {
+    "rating": "average_rating",
+    "date": "published_date",
+}
+# Type of each sort field's value inside a cursor.
+_CURSOR_VALUE_TYPES = {
+    "average_rating": (int, float),
+    "published_date": str,
+}
+
+
+def encode_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode an opaque cursor; raises ValueError if it was tampered with."""
     try:
-        return Book.objects.get(google_id=google_id)
-    except Book.DoesNotExist:
-        data = get_google_book_details(google_id)
-        if not data or "volumeInfo" not in data:
-            return None
-        volume = data.get("volumeInfo", {})
-        book = Book.objects.create(
-            google_id=data.get("id"),
-            title=volume.get("title", "Unknown Title"),
-            authors=volume.get("authors", []),
-            published_date=volume.get("publishedDate"),
-            categories=volume.get("categories", []),
-            thumbnail=volume.get("imageLinks", {}).get("thumbnail"),
-            description=volume.get("description", ""),
-            average_rating=volume.get("averageRating")
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError("Invalid cursor.") from exc
+
+
+def browse_category(category, sort="rating", cursor=None, limit=20):
+    """
+    Local books in `category`, best first, continuing after `cursor`.
+    Returns (books, next_cursor).
+    """
+    field = CATEGORY_SORTS[sort]
+    books = Book.objects.filter(
+        categories__contains=[category], **{f"{field}__isnull": False}
+    ).order_by(f"-{field}", "-google_id")
+    if cursor:
+        state = decode_cursor(cursor)
+        if not (isinstance(state, list) and len(state) == 2 and isinstance(state[1], str)
+                and isinstance(state[0], _CURSOR_VALUE_TYPES[field]) and not isinstance(state[0], bool)):
+            raise ValueError("Invalid cursor.")
+        value, google_id = state
+        books = books.filter(
+            Q(**{f"{field}__lt": value}) | Q(**{field: value, "google_id__lt": google_id})
         )
-        return book
+
+    page = list(books[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor([getattr(last, field), last.google_id])
+    return page, next_cursor
 
 
 # -------------------------------
@@ -111,21 +319,35 @@ def get_or_create_book_details(google_id):
 # -------------------------------
 
 def get_genre_top_books(limit=10):
-    """Get top book from each genre (Google Books)."""
+    """Get top book from each genre (local catalog, Google Books as fallback)."""
     genres = [
         "Fiction", "Science", "History", "Biography", "Fantasy",
         "Romance", "Mystery", "Self-Help", "Technology", "Philosophy",
     ]
     books = []
     for genre in genres[:limit]:
+        local, _ = browse_category(genre, sort="rating", limit=1)
+        if local:
+            books.append(book_to_unified(local[0]))
+            continue
         data = search_google_books(genre, max_results=1)
         if data and "items" in data:
             books.append(normalize_google_book(data["items"][0]))
     return books
 
 
+def get_trending_books(limit=10):
+    """Trending local books, best first, from the precomputed trending list."""
+    book_ids = get_trending_book_ids(limit=limit)
+    found = Book.objects.in_bulk(book_ids)
+    return [found[book_id] for book_id in book_ids if book_id in found]
+
+
 def get_recent_books(limit=10):
-    """Get recently published books (Google Books)."""
+    """Get trending books (Google Books "subject:fiction" until there are any)."""
+    trending = get_trending_books(limit=limit)
+    if trending:
+        return [book_to_unified(book) for book in trending]
     data = search_google_books("subject:fiction", max_results=limit)
     if not data:
         return []
@@ -142,33 +364,80 @@ def get_bestsellers(limit=10):
 # AI Summary (OpenAI / caching)
 # -------------------------------
 
-def generate_and_cache_ai_summary(book_id):
-    """Generate spoiler-free AI summary and cache it."""
-    cache_key = f"book_summary_{book_id}"
-    summary = cache.get(cache_key)
-    if summary:
-        return summary
+SUMMARY_CACHE_TIMEOUT = 60 * 60 * 24  # 24 hours cache
 
-    try:
-        book = Book.objects.get(id=book_id)
-    except Book.DoesNotExist:
-        return "Summary not available."
 
-    prompt = (
+def summary_cache_key(book_id):
+    return f"book_summary_{book_id}"
+
+
+def build_summary_prompt(book):
+    return (
         f"Write a spoiler-free, concise summary for the book titled '{book.title}' "
         f"by {', '.join(book.authors or ['Unknown Author'])}."
     )
 
+
+def request_ai_summary(prompt, stream=False):
+    """Call the OpenAI chat API; with stream=True returns an iterator of chunks."""
+    import openai  # heavy SDK, loaded on first summary request only
+
     openai.api_key = getattr(settings, "OPENAI_API_KEY", None)
+    started, status = time.perf_counter(), None
     try:
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=200
+            max_tokens=200,
+            stream=stream,
+        )
+        status = 200
+        return response
+    finally:
+        upstream_request.send(
+            sender=None, url="https://api.openai.com/v1/chat/completions",
+            status=status, duration=time.perf_counter() - started,
         )
+
+
+def store_ai_summary(book, summary):
+    """Persist a finished summary to the cache and Book.ai_summary."""
+    cache.set(summary_cache_key(book.pk), summary, SUMMARY_CACHE_TIMEOUT)
+    Book.objects.filter(pk=book.pk).update(ai_summary=summary)
+    book_cache.invalidate(book.google_id)
+
+
+def generate_and_cache_ai_summary(book_key):
+    """
+    Spoiler-free AI summary for a book (`book_key` is an id or google_id).
+    Served from the cache or Book.ai_summary when already generated; new
+    summaries are stored like streamed ones, failures are not stored.
+    """
+    book = get_book_by_key(book_key)
+    if book is None:
+        return "Summary not available."
+
+    summary = cache.get(summary_cache_key(book.pk)) or book.ai_summary
+    if summary:
+        return summary
+
+    try:
+        response = request_ai_summary(build_summary_prompt(book))
+        summary = response.choices[0].message.content.strip()
+    except Exception:
+        logger.exception("AI summary failed for book %s", book.pk)
+        summary = ""
+    if not summary:
+        return "Summary not available due to API error."
+
+    store_ai_summary(book, summary)
+    return summary
+
+    try:
+        response = request_ai_summary(build_summary_prompt(book))
         summary = response.choices[0].message.content.strip()
     except Exception:
         summary = "Summary not available due to API error."
 
-    cache.set(cache_key, summary, 60 * 60 * 24)  # 24 hours cache
+    cache.set(cache_key, summary, SUMMARY_CACHE_TIMEOUT)
     return summary
@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .cache import book_cache
+from .library import invalidate_library
+from . import popularity
+from .models import Book, Review, SyncTombstone, UserBookInteraction
+from .services import book_written
+from .sync import record_deletion
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, **kwargs):
+    book_written(instance)
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    book_cache.invalidate(instance.google_id)
+
+
+@receiver(post_init, sender=UserBookInteraction)
+def interaction_loaded(sender, instance, **kwargs):
+    popularity.snapshot(instance)
+
+
+@receiver(post_save, sender=UserBookInteraction)
+def interaction_saved(sender, instance, created, **kwargs):
+    """Feed the write-behind popularity buffer and retire the user's cached library."""
+    popularity.interaction_saved(instance, created)
+    invalidate_library(instance.user_id)
+
+
+@receiver(post_delete, sender=UserBookInteraction)
+def interaction_deleted(sender, instance, origin=None, **kwargs):
+    # Also fires for interactions cascaded from a deleted Book or user.
+    popularity.interaction_deleted(instance)
+    invalidate_library(instance.user_id)
+    record_deletion(SyncTombstone.Kind.INTERACTION, instance, origin)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, origin=None, **kwargs):
+    record_deletion(SyncTombstone.Kind.REVIEW, instance, origin)
@@ -0,0 +1,485 @@
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+# Bumped after every Book write, whichever processes have this module loaded.
+from .autocomplete import INDEX_VERSION_KEY
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Relative weight of each text field in a book's feature vector.
+FIELD_WEIGHTS = {"title": 3.0, "authors": 2.5, "categories": 2.0, "description": 1.0}
+
+
+# -------------------------------
+# Featurization
+# -------------------------------
+
+def book_features(title, authors, categories, description):
+    """Weighted bag of hashed-field tokens: {feature: weight}."""
+    fields = {
+        "title": TOKEN_RE.findall((title or "").lower()),
+        # Whole author names and categories are single features.
+        "authors": [" ".join(TOKEN_RE.findall(name.lower())) for name in authors or []],
+        "categories": [" ".join(TOKEN_RE.findall(name.lower())) for name in categories or []],
+        "description": TOKEN_RE.findall((description or "").lower()),
+    }
+    features = {}
+    for field, tokens in fields.items():
+        for token, count in Counter(t for t in tokens if len(t) > 2 or field != "description").items():
+            features[f"{field}:{token}"] = FIELD_WEIGHTS[field] * (1.0 + math.log(count))
+    return features
+
+
+# -------------------------------
+# Vector index
+# -------------------------------
+
+# Snapshot layout: 16-byte header (magic, metadata length), JSON metadata
+# with each section's offset, dtype and shape, then the sections (vectors,
+# packed ids, IVF), 8-byte aligned.
+_SNAPSHOT_MAGIC = b"BKSI\x00\x00\x00\x01"
+_HEADER = struct.Struct("<8sQ")
+# Rows per matrix product when assigning vectors to lists, to bound memory.
+_ASSIGN_CHUNK = 65536
+
+
+def _aligned(size):
+    return -(-size // 8) * 8
+
+
+def _id_hash(google_id):
+    return int.from_bytes(hashlib.blake2b(google_id.encode(), digest_size=8).digest(), "little")
+
+
+class _PackedIds:
+    """The base rows' google_ids in flat arrays, with sorted hashes to find a row."""
+
+    SECTIONS = ("id_blob", "id_offsets", "id_hashes", "id_rows")
+
+    def __init__(self, id_blob, id_offsets, id_hashes, id_rows):
+        self.id_blob, self.id_offsets, self.id_hashes, self.id_rows = id_blob, id_offsets, id_hashes, id_rows
+
+    @classmethod
+    def pack(cls, ids):
+        encoded = [google_id.encode() for google_id in ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(google_id) for google_id in encoded], out=offsets[1:])
+        hashes = np.fromiter((_id_hash(google_id) for google_id in ids), dtype=np.uint64, count=len(ids))
+        rows = np.argsort(hashes, kind="stable").astype(np.uint32)
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, hashes[rows], rows)
+
+    def __len__(self):
+        return len(self.id_offsets) - 1
+
+    def __getitem__(self, row):
+        return self.id_blob[self.id_offsets[row]:self.id_offsets[row + 1]].tobytes().decode()
+
+    def row_for(self, google_id):
+        id_hash = np.uint64(_id_hash(google_id))
+        pos = int(np.searchsorted(self.id_hashes, id_hash))
+        if pos < len(self.id_hashes) and self.id_hashes[pos] == id_hash:
+            row = int(self.id_rows[pos])
+            if self[row] == google_id:
+                return row
+        return None
+
+
+def _nearest(vectors, centroids):
+    """Index of each vector's closest centroid by cosine."""
+    nearest = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_CHUNK):
+        nearest[start:start + _ASSIGN_CHUNK] = np.argmax(vectors[start:start + _ASSIGN_CHUNK] @ centroids.T, axis=1)
+    return nearest
+
+
+class SimilarityIndex:
+    """
+    Dense float32 matrix of unit-length book vectors with top-K cosine search.
+
+    Features are hashed into `buckets` dimensions and reduced to `dims`
+    with a fixed random projection. Unlike SVD the projection needs no
+    fitting, so new books can be embedded and appended at any time and
+    vectors stay comparable across rebuilds.
+
+    The bulk of the vectors is the base matrix set by build() or mapped
+    from a snapshot by load(). Past `brute_force_max` books build() also
+    trains an inverted-file (IVF) index: spherical k-means splits the base
+    into `lists` clusters and a query scores only the books of its
+    `probes` nearest clusters. Books added later go to a small overlay
+    matrix that is always scanned in full (an edited book's base row is
+    masked) and is folded in by the next build.
+    """
+
+    KMEANS_ITERATIONS = 10
+    KMEANS_SAMPLE_PER_LIST = 40
+
+    def __init__(self, dims=64, buckets=1 << 14, seed=7, brute_force_max=None, lists=1024, probes=128):
+        self.dims = dims
+        self.buckets = buckets
+        self.seed = seed
+        self.brute_force_max = brute_force_max
+        self.lists = lists
+        self.probes = probes
+        self._warned = False
+        rng = np.random.default_rng(seed)
+        self._projection = (rng.standard_normal((buckets, dims)) / math.sqrt(dims)).astype(np.float32)
+        self._base = np.zeros((0, dims), dtype=np.float32)
+        self._base_ids = _PackedIds.pack([])
+        self._ivf = None  # (centroids, list_offsets): cluster n is base[list_offsets[n]:list_offsets[n + 1]]
+        self._extra = np.zeros((0, dims), dtype=np.float32)
+        self._extra_ids = []  # overlay rows follow the base rows
+        self._extra_rows = {}  # google_id -> overlay row
+        self._masked = set()  # base rows superseded by an overlay row
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._base) - len(self._masked) + len(self._extra_ids)
+
+    def _row(self, google_id):
+        row = self._extra_rows.get(google_id)
+        return self._base_ids.row_for(google_id) if row is None else row
+
+    def _id(self, row):
+        base_ids = self._base_ids
+        return base_ids[row] if row < len(base_ids) else self._extra_ids[row - len(base_ids)]
+
+    def embed(self, title, authors, categories, description):
+        features = book_features(title, authors, categories, description)
+        vector = np.zeros(self.dims, dtype=np.float32)
+        if not features:
+            return vector
+        hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+        weights = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        # The top hash bit picks the sign so colliding features tend to cancel.
+        weights *= np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        vector = weights @ self._projection[hashes % self.buckets]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_book(self, book):
+        return self.embed(
+            book.title, book.authors, book.categories, book.full_description or book.short_description
+        )
+
+    def build(self, ids, vectors):
+        """Replace the index with `vectors` (one row per id), training the IVF if it is large."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dims)
+        ids, ivf = list(ids), None
+        if self.brute_force_max is not None and len(vectors) > self.brute_force_max:
+            centroids, nearest = self._train(vectors)
+            # Store each cluster's books contiguously, so probing one is a slice.
+            order = np.argsort(nearest, kind="stable")
+            vectors, ids = vectors[order], [ids[row] for row in order]
+            ivf = (centroids, np.searchsorted(nearest[order], np.arange(len(centroids) + 1)).astype(np.int64))
+        self._install(vectors, _PackedIds.pack(ids), ivf)
+
+    def _train(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        lists = min(self.lists, len(vectors))
+        sample_size = min(len(vectors), lists * self.KMEANS_SAMPLE_PER_LIST)
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, lists, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERATIONS):
+            nearest = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            # A cluster that lost all its members keeps its old centroid.
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+        return centroids, _nearest(vectors, centroids)
+
+    def _install(self, vectors, base_ids, ivf):
+        with self._lock:
+            self._base, self._base_ids, self._ivf = vectors, base_ids, ivf
+            self._extra = np.zeros((0, self.dims), dtype=np.float32)
+            self._extra_ids, self._extra_rows = [], {}
+            self._masked = set()
+
+    def add(self, google_id, vector):
+        """Insert or replace one vector in the overlay, growing it geometrically."""
+        with self._lock:
+            base_count = len(self._base)
+            row = self._extra_rows.get(google_id)
+            if row is None:
+                base_row = self._base_ids.row_for(google_id)
+                if base_row is not None:
+                    self._masked.add(base_row)
+                position = len(self._extra_ids)
+                if position == len(self._extra):
+                    grown = np.zeros((max(1024, position * 2), self.dims), dtype=np.float32)
+                    grown[:position] = self._extra[:position]
+                    self._extra = grown
+                row = base_count + position
+                self._extra[position] = vector
+                self._extra_ids.append(google_id)
+                self._extra_rows[google_id] = row
+            else:
+                self._extra[row - base_count] = vector
+
+    def vector_for(self, google_id):
+        row = self._row(google_id)
+        if row is None:
+            return None
+        base = self._base
+        return base[row] if row < len(base) else self._extra[row - len(base)]
+
+    def _probed_ranges(self, base, ivf, vector):
+        """Base row ranges worth scoring: all rows, or the nearest IVF clusters."""
+        if ivf is None:
+            return [(0, len(base))]
+        centroids, list_offsets = ivf
+        probes = min(self.probes, len(centroids))
+        nearest = np.sort(np.argpartition(-(centroids @ vector), probes - 1)[:probes])
+        return [(list_offsets[n], list_offsets[n + 1]) for n in nearest]
+
+    def most_similar(self, vector, k=10, exclude=None):
+        """Return [(google_id, score)] for the k nearest vectors by cosine."""
+        with self._lock:
+            base, ivf, extra, extra_count = self._base, self._ivf, self._extra, len(self._extra_ids)
+            masked = np.fromiter(self._masked, dtype=np.int64, count=len(self._masked))
+            excluded = None if exclude is None else self._row(exclude)
+            ids = self._id
+        count = len(base) + extra_count
+        if ivf is None and self.brute_force_max is not None and count > self.brute_force_max and not self._warned:
+            self._warned = True
+            logger.warning(
+                "Similarity index holds %d books, over SIMILARITY_BRUTE_FORCE_MAX=%d, without an "
+                "approximate index; run `manage.py rebuild_similarity_index` to train one",
+                count, self.brute_force_max,
+            )
+        dropped = masked if excluded is None else np.append(masked, excluded)
+        ranges = self._probed_ranges(base, ivf, vector) + [(len(base), len(base) + extra_count)]
+        rows = np.concatenate([np.arange(lo, hi) for lo, hi in ranges])
+        scores = np.concatenate([base[lo:hi] @ vector for lo, hi in ranges[:-1]] + [extra[:extra_count] @ vector])
+        if len(rows) == count:
+            scores[dropped] = -np.inf
+        elif len(dropped):
+            scores[np.isin(rows, dropped)] = -np.inf
+        k = min(k, len(rows))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids(rows[n]), float(scores[n])) for n in top if scores[n] > -np.inf]
+
+    def save(self, path, **meta):
+        """Write the base matrix and its IVF (not the overlay) to `path` atomically."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {"vectors": self._base}
+        arrays.update((name, getattr(self._base_ids, name)) for name in _PackedIds.SECTIONS)
+        if self._ivf is not None:
+            arrays.update(zip(("centroids", "list_offsets"), self._ivf))
+        sections, offset = {}, 0
+        for name, array in arrays.items():
+            sections[name] = [offset, array.dtype.str, list(array.shape)]
+            offset += _aligned(array.nbytes)
+        header = json.dumps({"sections": sections, **meta}).encode()
+        start = _aligned(_HEADER.size + len(header))
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as snapshot:
+            snapshot.write(_HEADER.pack(_SNAPSHOT_MAGIC, len(header)))
+            snapshot.write(header)
+            for name, array in arrays.items():
+                snapshot.seek(start + sections[name][0])
+                snapshot.write(np.ascontiguousarray(array).data)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Map a snapshot written by save(); returns its metadata."""
+        with open(path, "rb") as snapshot_file:
+            snapshot = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = _HEADER.unpack_from(snapshot, 0)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a similarity index.")
+        meta = json.loads(snapshot[_HEADER.size:_HEADER.size + length])
+        start = _aligned(_HEADER.size + length)
+        arrays = {
+            name: np.frombuffer(snapshot, dtype=dtype, count=math.prod(shape), offset=start + offset).reshape(shape)
+            for name, (offset, dtype, shape) in meta.pop("sections").items()
+        }
+        ivf = None
+        if "centroids" in arrays:
+            ivf = (arrays["centroids"], arrays["list_offsets"])
+        base_ids = _PackedIds(*(arrays[name] for name in _PackedIds.SECTIONS))
+        self._install(arrays["vectors"], base_ids, ivf)
+        return meta
+
+
+# -------------------------------
+# Process-wide index
+# -------------------------------
+
+SIMILARITY_REFRESH_SECONDS = getattr(settings, "SIMILARITY_REFRESH_SECONDS", 5)
+REFRESH_OVERLAP = 500
+
+_index = None
+_index_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="similarity")
+# What this process has loaded: the shared version seen, the highest Book id,
+# the snapshot's mtime, and when it last checked for changes.
+_sync = {"version": None, "max_id": 0, "snapshot_mtime": None, "checked_at": 0.0}
+
+
+def _index_path():
+    return str(getattr(settings, "SIMILARITY_INDEX_PATH", settings.BASE_DIR / "var" / "similarity"))
+
+
+def _snapshot_mtime():
+    try:
+        return os.stat(_index_path()).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def new_index():
+    return SimilarityIndex(
+        dims=getattr(settings, "SIMILARITY_DIMS", 64),
+        brute_force_max=getattr(settings, "SIMILARITY_BRUTE_FORCE_MAX", 200_000),
+        lists=getattr(settings, "SIMILARITY_IVF_LISTS", 1024),
+        probes=getattr(settings, "SIMILARITY_IVF_PROBES", 128),
+    )
+
+
+def _load_index():
+    """Map the saved snapshot (empty if it was never built), then pull in books saved since."""
+    index = new_index()
+    mtime = _snapshot_mtime()
+    meta = index.load(_index_path()) if mtime is not None else {}
+    _sync.update(
+        version=meta.get("version"), max_id=meta.get("max_id", 0), snapshot_mtime=mtime, checked_at=time.monotonic()
+    )
+    refresh_similarity_index(index)
+    return index
+
+
+def get_similarity_index():
+    """Load the saved index on first use, then keep it in step with other processes."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load_index()
+    _maybe_refresh()
+    return _index
+
+
+def refresh_similarity_index(index):
+    """
+    Embed books saved by other processes since the last check. New books
+    are found by id, re-reading the last REFRESH_OVERLAP ids in case a
+    lower id committed late; edits to existing books arrive with the next
+    rebuild. Without a snapshot there is nothing to catch up with: the
+    index fills as books are asked for.
+    """
+    if _sync["snapshot_mtime"] is None:
+        return 0
+    version = cache.get(INDEX_VERSION_KEY)
+    _sync["checked_at"] = time.monotonic()
+    if version == _sync["version"]:
+        return 0
+    books = list(
+        Book.objects.filter(id__gt=_sync["max_id"] - REFRESH_OVERLAP).order_by("id")
+        .only("id", "google_id", "title", "authors", "categories", "full_description", "short_description")
+    )
+    for book in books:
+        if index.vector_for(book.google_id) is None:
+            index.add(book.google_id, index.embed_book(book))
+    if books:
+        _sync["max_id"] = max(_sync["max_id"], books[-1].id)
+    _sync["version"] = version
+    return len(books)
+
+
+def _maybe_refresh():
+    """
+    Every SIMILARITY_REFRESH_SECONDS: map a snapshot saved by another
+    process (`manage.py rebuild_similarity_index`), or else pull in new books.
+    """
+    if time.monotonic() - _sync["checked_at"] < SIMILARITY_REFRESH_SECONDS:
+        return
+    # One thread refreshes; the others keep serving the current index.
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    _sync["checked_at"] = time.monotonic()
+    mtime = _snapshot_mtime()
+    if mtime is not None and mtime != _sync["snapshot_mtime"]:
+        # Parsing the ids of a large snapshot takes a while; keep it off the request.
+        _loader.submit(_swap_in_snapshot)  # releases the lock when done
+        return
+    try:
+        refresh_similarity_index(_index)
+    finally:
+        _refresh_lock.release()
+
+
+def _swap_in_snapshot():
+    global _index
+    try:
+        _index = _load_index()
+    except Exception:
+        logger.exception("Loading the similarity snapshot failed")
+    finally:
+        close_old_connections()
+        _refresh_lock.release()
+
+
+def rebuild_similarity_index(batch_size=5000):
+    """Embed every local book and save the matrix (and IVF); returns the book count."""
+    global _index
+    # Read before the scan: a write that lands during it bumps the version
+    # again and is picked up by the next refresh.
+    version = cache.get(INDEX_VERSION_KEY)
+    index = new_index()
+    books = Book.objects.only(
+        "id", "google_id", "title", "authors", "categories", "full_description", "short_description"
+    ).iterator(chunk_size=batch_size)
+    ids, vectors, max_id = [], [], 0
+    for book in books:
+        ids.append(book.google_id)
+        vectors.append(index.embed_book(book))
+        max_id = max(max_id, book.id)
+    index.build(ids, np.array(vectors, dtype=np.float32).reshape(-1, index.dims))
+    index.save(_index_path(), max_id=max_id, version=version)
+    # Map the file like every other process instead of keeping a heap copy.
+    _index = _load_index()
+    return len(_index)
+
+
+def index_book_vector(book):
+    """Embed a saved Book into the loaded index (no-op until it is loaded)."""
+    if _index is not None:
+        _index.add(book.google_id, _index.embed_book(book))
+
+
+def similar_books(book, limit=10):
+    """Books most similar to `book`, best first."""
+    index = get_similarity_index()
+    vector = index.vector_for(book.google_id)
+    if vector is None:
+        vector = index.embed_book(book)
+        index.add(book.google_id, vector)
+    ranked = index.most_similar(vector, k=limit, exclude=book.google_id)
+    found = Book.objects.in_bulk([google_id for google_id, _ in ranked], field_name="google_id")
+    return [found[google_id] for google_id, _ in ranked if google_id in found]
@@ -0,0 +1,112 @@
+import json
+import logging
+import threading
+
+from django.core.cache import cache
+from django.db import close_old_connections
+from rest_framework.renderers import BaseRenderer
+
+from .services import build_summary_prompt, request_ai_summary, store_ai_summary, summary_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Events message."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets views accept `Accept: text/event-stream`; plain payloads become one event."""
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get("response")
+        event = "error" if response is not None and response.status_code >= 400 else "message"
+        return sse_event(data, event=event).encode()
+
+
+# -------------------------------
+# Shared upstream summary streams
+# -------------------------------
+
+class SummaryStream:
+    """
+    One upstream OpenAI stream for a book, read by any number of viewers.
+    Tokens are buffered, so a viewer that attaches late first replays what
+    was already generated and then follows the live tokens.
+    """
+
+    def __init__(self, book):
+        self.book = book
+        self.tokens = []
+        self.done = False
+        self.failed = False
+        self._condition = threading.Condition()
+
+    def run(self):
+        try:
+            for chunk in request_ai_summary(build_summary_prompt(self.book), stream=True):
+                token = chunk.choices[0].delta.get("content")
+                if token:
+                    with self._condition:
+                        self.tokens.append(token)
+                        self._condition.notify_all()
+            store_ai_summary(self.book, "".join(self.tokens).strip())
+        except Exception:
+            logger.exception("AI summary stream failed for book %s", self.book.pk)
+            self.failed = True
+        finally:
+            with _streams_lock:
+                _streams.pop(self.book.pk, None)
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+            close_old_connections()
+
+    def follow(self, timeout=30):
+        """Yield tokens from the start of the stream until it completes."""
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self.tokens) and not self.done:
+                    if not self._condition.wait(timeout):
+                        return
+                tokens, done = self.tokens[position:], self.done
+            position += len(tokens)
+            yield from tokens
+            if done and position >= len(self.tokens):
+                return
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def attach_summary_stream(book):
+    """Join the in-progress stream for `book`, or start one."""
+    with _streams_lock:
+        stream = _streams.get(book.pk)
+        if stream is None:
+            stream = _streams[book.pk] = SummaryStream(book)
+            threading.Thread(target=stream.run, name=f"summary-{book.pk}", daemon=True).start()
+    return stream
+
+
+def summary_events(book):
+    """SSE messages for a book's summary: token events, then a final `done`."""
+    summary = cache.get(summary_cache_key(book.pk)) or book.ai_summary
+    if summary:
+        yield sse_event({"summary": summary}, event="done")
+        return
+
+    stream = attach_summary_stream(book)
+    for token in stream.follow():
+        yield sse_event({"token": token})
+    if stream.failed or not stream.done:
+        yield sse_event({"error": "Summary not available due to API error."}, event="error")
+    else:
+        yield sse_event({"summary": "".join(stream.tokens).strip()}, event="done")
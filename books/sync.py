@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Review, SyncTombstone, UserBookInteraction
+from .services import decode_cursor, encode_cursor
+
+SYNC_PAGE_SIZE = getattr(settings, "SYNC_PAGE_SIZE", 200)
+SYNC_SETTLE_SECONDS = getattr(settings, "SYNC_SETTLE_SECONDS", 2)
+SYNC_TOMBSTONE_DAYS = getattr(settings, "SYNC_TOMBSTONE_DAYS", 90)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class SyncTokenExpired(Exception):
+    """The token is older than tombstone retention; the client must sync from scratch."""
+
+
+# -------------------------------
+# Tombstones (see signals.py)
+# -------------------------------
+
+def record_deletion(kind, instance, origin=None):
+    """Leave a tombstone for a deleted interaction or review."""
+    # Deleting the user deletes their tombstones as well; writing new ones
+    # from inside that cascade would point at a user that is going away.
+    user_model = get_user_model()
+    if isinstance(origin, user_model) or getattr(origin, "model", None) is user_model:
+        return
+    SyncTombstone.objects.create(
+        user_id=instance.user_id, kind=kind, object_id=instance.pk, book_pk=instance.book_id
+    )
+
+
+def prune_tombstones():
+    """Drop tombstones past retention; tokens that old get SyncTokenExpired."""
+    cutoff = timezone.now() - timedelta(days=SYNC_TOMBSTONE_DAYS)
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
+
+
+# -------------------------------
+# Change feed
+# -------------------------------
+
+def _streams(user):
+    """name -> (queryset of the user's rows, change timestamp field)"""
+    return {
+        "interactions": (UserBookInteraction.objects.filter(user=user).select_related("book"), "updated_at"),
+        "reviews": (Review.objects.filter(user=user).select_related("user"), "updated_at"),
+        "deleted": (SyncTombstone.objects.filter(user=user), "deleted_at"),
+    }
+
+
+def _decode_token(token):
+    state = decode_cursor(token)
+    try:
+        positions = {
+            name: (datetime.fromisoformat(state[name][0]), int(state[name][1]))
+            for name in ("interactions", "reviews", "deleted")
+        }
+    except (KeyError, IndexError, TypeError, ValueError) as exc:
+        raise ValueError("Invalid sync token.") from exc
+    # Tokens we issue are always timezone-aware; a naive one can't be compared.
+    if any(timezone.is_naive(changed_at) for changed_at, _ in positions.values()):
+        raise ValueError("Invalid sync token.")
+    return positions
+
+
+def sync_changes(user, token=None, limit=SYNC_PAGE_SIZE):
+    """
+    The user's interaction, review and deletion changes since `token`,
+    oldest first and at most `limit` in total.
+
+    Returns ({stream name: [rows]}, next token, has_more). Without a token
+    every current row is returned and past deletions are skipped. Raises
+    ValueError for a malformed token and SyncTokenExpired for a stale one.
+    """
+    streams = _streams(user)
+    # Rows are stamped before their transaction commits; leaving out the last
+    # few seconds keeps a slow commit from landing behind a returned token.
+    upper = timezone.now() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    if token:
+        positions = _decode_token(token)
+        if positions["deleted"][0] < timezone.now() - timedelta(days=SYNC_TOMBSTONE_DAYS):
+            raise SyncTokenExpired()
+    else:
+        positions = {"interactions": (_EPOCH, 0), "reviews": (_EPOCH, 0), "deleted": (upper, 0)}
+
+    fetched = {}
+    for name, (queryset, field) in streams.items():
+        changed_at, last_id = positions[name]
+        fetched[name] = list(
+            queryset.filter(**{f"{field}__lt": upper})
+            .filter(Q(**{f"{field}__gt": changed_at}) | Q(**{field: changed_at, "id__gt": last_id}))
+            .order_by(field, "id")[:limit]
+        )
+
+    merged = sorted(
+        ((getattr(row, streams[name][1]), name, row.pk, row) for name, rows in fetched.items() for row in rows),
+        key=lambda entry: entry[:3],
+    )[:limit]
+    changes = {name: [] for name in streams}
+    for _, name, _, row in merged:
+        changes[name].append(row)
+
+    has_more = False
+    for name, rows in fetched.items():
+        if len(rows) < limit and len(changes[name]) == len(rows):
+            # Everything before `upper` has been seen.
+            positions[name] = (upper, 0)
+        else:
+            has_more = True
+            if changes[name]:
+                last = changes[name][-1]
+                positions[name] = (getattr(last, streams[name][1]), last.pk)
+
+    next_token = encode_cursor({name: [changed_at.isoformat(), last_id]
+                                for name, (changed_at, last_id) in positions.items()})
+    return changes, next_token, has_more
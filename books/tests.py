@@ -1,3 +1,1024 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from books import autocomplete, popularity
+from books import urls as books_urls
+from books.cache import BookCache, book_cache
+from books.library import get_library
+from books.search import SearchPrefetcher
+from books.sync import sync_changes
+from books.models import Author, Book, BookStats, Review, SyncTombstone, UserBookInteraction
+from books.providers import BookProvider, LocalCatalogProvider, build_catalog_index
+from books.services import (
+    encode_cursor,
+    get_books_by_author,
+    get_google_book_details,
+    search_google_books,
+    summary_cache_key,
+)
+from books.streaming import attach_summary_stream
+from users import urls as users_urls
+
+User = get_user_model()
+
+# Matches get_genre_top_books, so the home carousel is served locally.
+GENRES = [
+    "Fiction", "Science", "History", "Biography", "Fantasy",
+    "Romance", "Mystery", "Self-Help", "Technology", "Philosophy",
+]
+
+
+# -------------------------------
+# Offline upstreams
+# -------------------------------
+
+def fake_volume(google_id):
+    return {
+        "id": google_id,
+        "volumeInfo": {
+            "title": f"Remote Book {google_id}",
+            "authors": ["Remote Author"],
+            "publishedDate": "2020",
+            "categories": ["Fiction"],
+            "description": "A book fetched from the fake upstream.",
+            "averageRating": 4.0,
+        },
+    }
+
+
+class FakeBookProvider(BookProvider):
+    """Stands in for Google Books / NYT and counts every call."""
+    calls = []
+
+    def search(self, query, max_results=20, start_index=0):
+        self.calls.append(("search", query))
+        if query.startswith("outage"):
+            return None
+        return {"items": [fake_volume(f"remote-{query}-{n}") for n in range(start_index, start_index + max_results)]}
+
+    def get_details(self, google_id):
+        self.calls.append(("details", google_id))
+        if google_id.startswith("missing"):
+            return None
+        if google_id.startswith("broken"):
+            raise ConnectionError("upstream unavailable")
+        return fake_volume(google_id)
+
+    def get_bestsellers(self, list_name, limit):
+        self.calls.append(("bestsellers", list_name))
+        return [{"title": f"Bestseller {n}", "author": "Someone", "rank": n + 1} for n in range(limit)]
+
+
+def fake_ai_summary(prompt, stream=False):
+    FakeBookProvider.calls.append(("openai", prompt))
+    message = SimpleNamespace(content="A spoiler-free summary.")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+# -------------------------------
+# Budgets
+# -------------------------------
+
+Budget = namedtuple("Budget", "route method kwargs data auth max_queries max_upstream")
+
+# Maximum SQL queries and upstream calls per request, on a cold cache.
+# `kwargs` and `data` are callables taking the fixture namespace.
+BUDGETS = [
+    # Public book endpoints
+    Budget("v1:book-search", "get", None, lambda f: {"q": "dune"}, False, 0, 1),
+    Budget("v1:book-autocomplete", "get", None, lambda f: {"q": "book"}, False, 1, 0),
+    Budget("v1:book-detail-batch", "get", None,
+           lambda f: {"ids": f"{f.books[0].google_id},{f.books[1].google_id},new-1,missing-1"}, False, 8, 2),
+    Budget("v1:book-detail", "get", lambda f: {"book_id": f.books[0].google_id}, None, False, 1, 0),
+    Budget("v1:book-detail", "get", lambda f: {"book_id": "new-2"}, None, False, 7, 1),
+    Budget("v1:book-detail", "get", lambda f: {"book_id": f.books[0].pk}, None, False, 1, 0),
+    Budget("v1:similar-books", "get", lambda f: {"book_id": f.books[0].google_id}, None, False, 1, 0),
+    Budget("v1:similar-books", "get", lambda f: {"book_id": f.books[0].pk}, None, False, 1, 0),
+    Budget("v1:book-cache-stats", "get", None, None, "admin", 1, 0),
+    Budget("v1:author-books", "get", lambda f: {"name": "author 1"}, None, False, 2, 0),
+    Budget("v1:category-books", "get", lambda f: {"category": "Fiction"}, None, False, 1, 0),
+    Budget("v1:book-summary", "get", lambda f: {"book_id": f.books[0].pk}, None, False, 2, 1),
+    Budget("v1:book-summary-stream", "get", lambda f: {"book_id": f.books[1].google_id}, None, False, 1, 0),
+    Budget("v1:home-books", "get", None, None, False, 11, 2),
+    Budget("v1:trending-books", "get", None, None, False, 1, 0),
+
+    # User interactions
+    Budget("v1:user-interaction", "post", None,
+           lambda f: {"book": f.books[-1].pk, "status": "WTR"}, True, 3, 0),
+    Budget("v1:user-interaction", "put", None,
+           lambda f: {"book_id": f.books[0].pk, "status": "RD"}, True, 3, 0),
+    Budget("v1:user-library", "get", None, None, True, 2, 0),
+    Budget("v1:user-favorites", "get", None, None, True, 2, 0),
+    Budget("v1:user-library-sync", "get", None, None, True, 4, 0),
+
+    # Reviews
+    Budget("v1:book-reviews", "post", lambda f: {"book_id": f.books[-1].pk},
+           lambda f: {"rating": 5, "comment": "Great"}, True, 3, 0),
+    Budget("v1:review-detail", "put", lambda f: {"review_id": f.review.pk},
+           lambda f: {"rating": 3}, True, 4, 0),
+    Budget("v1:review-detail", "delete", lambda f: {"review_id": f.review.pk}, None, True, 5, 0),
+
+    # Users
+    Budget("users:register", "post", None,
+           lambda f: {"username": "newreader", "email": "new@example.com",
+                      "password": "S3cure-pass!", "password2": "S3cure-pass!"}, False, 2, 0),
+    Budget("users:token_obtain_pair", "post", None,
+           lambda f: {"username": "reader", "password": "pass-Word-1"}, False, 2, 0),
+    Budget("users:token_refresh", "post", None, lambda f: {"refresh": f.refresh}, False, 13, 0),
+    Budget("users:user_me", "get", None, None, True, 1, 0),
+    Budget("users:user_me", "put", None, lambda f: {"first_name": "Ada"}, True, 2, 0),
+    Budget("users:change_password", "put", None,
+           lambda f: {"old_password": "pass-Word-1", "new_password": "N3w-pass-Word"}, True, 2, 0),
+    Budget("users:user_favorites", "get", None, None, True, 1, 0),
+]
+
+
+def _route_names(urlconf, namespace):
+    return {f"{namespace}:{pattern.name}" for pattern in urlconf.urlpatterns}
+
+
+@override_settings(
+    BOOK_PROVIDERS=["books.tests.FakeBookProvider"],
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+    DATABASE_REPLICAS=[],
+    # Background prefetches would land in the next request's upstream count.
+    SEARCH_PREFETCH_ENABLED=False,
+)
+@mock.patch("books.services.request_ai_summary", fake_ai_summary)
+class EndpointBudgetTests(TestCase):
+    """Per-endpoint SQL query and upstream call budgets, run fully offline."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", "reader@example.com", "pass-Word-1")
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "pass-Word-1")
+        cls.others = [User.objects.create_user(f"other{n}", password="pass-Word-1") for n in range(5)]
+
+        cls.books = [
+            Book.objects.create(
+                google_id=f"vol{n:05d}AAAJ",
+                title=f"Book {n}",
+                authors=[f"Author {n % 4}", "Co Author"],
+                categories=[GENRES[n % len(GENRES)]],
+                average_rating=3 + (n % 3) * 0.5,
+                published_date=f"20{n:02d}",
+                full_description=f"Description of book {n} with dragons and ships.",
+            )
+            for n in range(40)
+        ]
+        Book.objects.filter(pk=cls.books[1].pk).update(ai_summary="Already summarized.")
+
+        statuses = [choice for choice, _ in UserBookInteraction.Status.choices]
+        for n, book in enumerate(cls.books[:30]):
+            UserBookInteraction.objects.create(
+                user=cls.user, book=book, status=statuses[n % 3], is_favorite=n % 4 == 0
+            )
+            for other in cls.others:
+                UserBookInteraction.objects.create(user=other, book=book, status=statuses[(n + 1) % 3])
+                Review.objects.create(user=other, book=book, rating=4, comment="Fine")
+        cls.review = Review.objects.create(user=cls.user, book=cls.books[0], rating=4)
+
+    def setUp(self):
+        self.fixtures = SimpleNamespace(
+            books=self.books, review=self.review, refresh=str(RefreshToken.for_user(self.user))
+        )
+
+    def client_for(self, auth):
+        client = APIClient()
+        if auth:
+            user = self.admin if auth == "admin" else self.user
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+        return client
+
+    def run_budget(self, budget):
+        url = reverse(budget.route, kwargs=budget.kwargs(self.fixtures) if budget.kwargs else None)
+        data = budget.data(self.fixtures) if budget.data else None
+        client = self.client_for(budget.auth)
+        # Every budget is measured cold: no cached users, books or indexes.
+        cache.clear()
+        book_cache.l1.clear()
+        autocomplete.book_index.ready = False
+        FakeBookProvider.calls = []
+
+        with CaptureQueriesContext(connection) as queries:
+            if budget.method == "get":
+                response = client.get(url, data)
+            else:
+                response = getattr(client, budget.method)(url, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+
+        self.assertLess(response.status_code, 400, f"{budget.method.upper()} {url}: {response.status_code}")
+        executed = "\n".join(f"  {n}. {query['sql']}" for n, query in enumerate(queries, 1))
+        self.assertLessEqual(
+            len(queries), budget.max_queries,
+            f"{budget.method.upper()} {url} ran {len(queries)} queries "
+            f"(budget {budget.max_queries}):\n{executed}",
+        )
+        self.assertLessEqual(
+            len(FakeBookProvider.calls), budget.max_upstream,
+            f"{budget.method.upper()} {url} made {len(FakeBookProvider.calls)} upstream calls "
+            f"(budget {budget.max_upstream}): {FakeBookProvider.calls}",
+        )
+
+    def test_every_route_has_a_budget(self):
+        routes = _route_names(books_urls, "v1") | _route_names(users_urls, "users")
+        self.assertEqual(routes - {budget.route for budget in BUDGETS}, set())
+
+    def test_budgets(self):
+        for budget in BUDGETS:
+            with self.subTest(route=budget.route, method=budget.method):
+                self.run_budget(budget)
+
+
+@override_settings(BOOK_PROVIDERS=["books.tests.FakeBookProvider"], DATABASE_REPLICAS=[])
+class BookBatchTests(TestCase):
+    """One failing upstream fetch is reported for its own id only."""
+
+    def test_upstream_error_is_reported_per_id(self):
+        Book.objects.create(google_id="localAAAJ", title="Local")
+        with self.assertLogs("books.services", "WARNING"):
+            response = self.client.get(reverse("v1:book-detail-batch"), {"ids": "localAAAJ,broken-1,new-1,missing-1"})
+
+        self.assertEqual(response.status_code, 200)
+        results = {entry["google_id"]: entry for entry in response.data["books"]}
+        self.assertEqual(results["broken-1"], {"google_id": "broken-1", "error": "Upstream error."})
+        self.assertEqual(results["missing-1"], {"google_id": "missing-1", "error": "Book not found."})
+        self.assertEqual(results["localAAAJ"]["book"]["title"], "Local")
+        self.assertEqual(results["new-1"]["book"]["title"], "Remote Book new-1")
+        self.assertFalse(Book.objects.filter(google_id="broken-1").exists())
+
+    def test_bulk_inserts_run_the_book_write_hooks(self):
+        from books import similarity
+
+        similarity._index = similarity.new_index()
+        self.addCleanup(setattr, similarity, "_index", None)
+        self.client.get(reverse("v1:book-detail-batch"), {"ids": "bulk-1"})
+        self.assertIsNotNone(similarity._index.vector_for("bulk-1"))
+        self.assertEqual(list(Book.objects.get(google_id="bulk-1").author_entries.values_list("name", flat=True)), ["Remote Author"])
+
+
+@override_settings(BOOK_PROVIDERS=["books.tests.FakeBookProvider"])
+class BookKeyTests(TestCase):
+    """Detail and similar-books URLs accept the integer id or the google_id."""
+
+    def setUp(self):
+        cache.clear()
+        FakeBookProvider.calls = []
+        self.book = Book.objects.create(google_id="keyedAAAJ", title="Keyed")
+        # The similarity index loaded by these requests is process-wide.
+        from books import similarity
+
+        self.addCleanup(setattr, similarity, "_index", None)
+
+    def test_integer_id_resolves_locally(self):
+        for route in ("v1:book-detail", "v1:similar-books"):
+            with self.subTest(route=route):
+                self.assertEqual(self.client.get(reverse(route, kwargs={"book_id": self.book.pk})).status_code, 200)
+                self.assertEqual(self.client.get(reverse(route, kwargs={"book_id": 999999})).status_code, 404)
+        response = self.client.get(reverse("v1:book-detail", kwargs={"book_id": self.book.pk}))
+        self.assertEqual(response.data["google_id"], "keyedAAAJ")
+        self.assertEqual(FakeBookProvider.calls, [])
+
+    def test_unknown_google_id_is_fetched(self):
+        response = self.client.get(reverse("v1:book-detail", kwargs={"book_id": "fresh-1"}))
+        self.assertEqual(response.data["title"], "Remote Book fresh-1")
+        self.assertEqual(FakeBookProvider.calls, [("details", "fresh-1")])
+
+
+@override_settings(BOOK_PROVIDERS=["books.tests.FakeBookProvider"], SEARCH_PREFETCH_ENABLED=False)
+class SearchPageTests(TestCase):
+    """Only successful upstream pages are cached; malformed cursors are a 400."""
+
+    def setUp(self):
+        cache.clear()
+        FakeBookProvider.calls = []
+
+    def search(self, **params):
+        return self.client.get(reverse("v1:book-search"), {"q": "dune", **params})
+
+    def test_failed_upstream_page_is_retried(self):
+        for _ in range(2):
+            response = self.client.get(reverse("v1:book-search"), {"q": "outage"})
+            self.assertEqual(response.data, {"books": [], "next_cursor": None})
+        self.assertEqual(len(FakeBookProvider.calls), 2)
+
+        self.search()
+        self.search()
+        self.assertEqual(len(FakeBookProvider.calls), 3)
+
+    def test_cursor_pages_follow_on(self):
+        first = self.search(page_size=5).data
+        second = self.search(page_size=5, cursor=first["next_cursor"]).data
+        self.assertEqual([book["google_id"] for book in second["books"]],
+                         [f"remote-dune-{n}" for n in range(5, 10)])
+
+    def test_malformed_cursor_is_a_400(self):
+        for state in ({"q": "dune", "s": "abc"}, {"q": "dune", "s": {"a": 1}}, {"q": "dune", "s": ["x"]},
+                      {"q": "dune", "o": "5"}, {"q": "dune", "o": -1}, {"q": "dune", "o": [1]},
+                      {"q": "dune", "o": True}, {"q": "dune", "s": list(range(1000))}, ["dune"]):
+            with self.subTest(state=state):
+                self.assertEqual(self.search(cursor=encode_cursor(state)).status_code, 400)
+        self.assertEqual(self.search(cursor="not-a-cursor").status_code, 400)
+
+
+class SearchPrefetcherTests(SimpleTestCase):
+    """One waiting prefetch per client; a newer page or an idle client cancels it."""
+
+    def setUp(self):
+        cache.clear()
+        self.fetched = []
+        patcher = mock.patch("books.search.fetch_search_page", lambda q, o, n: self.fetched.append((q, o)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_queued(self, prefetcher, *schedules):
+        """Schedule behind a busy worker, then let the queue drain."""
+        release = threading.Event()
+        prefetcher._executor.submit(release.wait)
+        results = [prefetcher.schedule(*args) for args in schedules]
+        release.set()
+        prefetcher._executor.shutdown(wait=True)
+        return results
+
+    def test_newer_page_cancels_the_waiting_one(self):
+        prefetcher = SearchPrefetcher(workers=1)
+        self.run_queued(prefetcher, ("a", "dune", 20, 20), ("b", "dune", 20, 20), ("a", "dune", 40, 20))
+        # b also waits for page 20, so a moving on to page 40 doesn't cancel it.
+        self.assertEqual(self.fetched, [("dune", 20), ("dune", 40)])
+
+        prefetcher = SearchPrefetcher(workers=1)
+        self.run_queued(prefetcher, ("a", "dune", 20, 20), ("a", "dune", 40, 20), ("a", "dune", 60, 20))
+        self.assertEqual(self.fetched[2:], [("dune", 60)])
+        self.assertEqual(prefetcher._pending, {})
+        self.assertEqual(prefetcher._clients, {})
+
+    def test_idle_client_is_not_prefetched(self):
+        prefetcher = SearchPrefetcher(workers=1, idle_seconds=0)
+        self.run_queued(prefetcher, ("a", "dune", 20, 20))
+        self.assertEqual(self.fetched, [])
+
+    def test_pending_limit(self):
+        prefetcher = SearchPrefetcher(workers=1, max_pending=1)
+        self.assertEqual(self.run_queued(prefetcher, ("a", "dune", 20, 20), ("b", "emma", 20, 20)), [True, False])
+
+
+@override_settings(BOOK_PROVIDERS=["books.tests.FakeBookProvider"], SEARCH_PREFETCH_ENABLED=False)
+class SparseFieldsTests(TestCase):
+    """`?fields=` trims responses to the requested names and profiles."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("sparse", password="pass-Word-1")
+        book = Book.objects.create(google_id="sparseAAAJ", title="Sparse", authors=["A"])
+        UserBookInteraction.objects.create(user=cls.user, book=book, status="RD")
+
+    def setUp(self):
+        cache.clear()
+
+    def keys(self, response, name):
+        return [set(entry) for entry in response.data[name]]
+
+    def test_search_fields(self):
+        url = reverse("v1:book-search")
+        full = self.keys(self.client.get(url, {"q": "dune", "page_size": 2}), "books")
+        self.assertIn("description", full[0])
+        picked = self.client.get(url, {"q": "dune", "page_size": 2, "fields": "title, google_id"})
+        self.assertEqual(self.keys(picked, "books"), [{"google_id", "title"}] * 2)
+        compact = self.client.get(url, {"q": "dune", "page_size": 2, "fields": "compact"})
+        self.assertEqual(self.keys(compact, "books"), [{"google_id", "title", "authors", "thumbnail"}] * 2)
+
+    def test_library_fields(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        url = reverse("v1:user-library")
+        self.assertEqual(self.keys(self.client.get(url, {"fields": "compact"}), "library"),
+                         [{"id", "google_id", "title", "authors", "thumbnail_url", "status", "is_favorite"}])
+        # Unknown names are ignored rather than rejected.
+        self.assertEqual(self.keys(self.client.get(url, {"fields": "title,nope"}), "library"), [{"title"}])
+
+
+class SimilarityIndexTests(SimpleTestCase):
+    """Exact cosine search, IVF search past the brute-force limit, and snapshots."""
+
+    def index(self, titles, **kwargs):
+        from .similarity import SimilarityIndex
+
+        index = SimilarityIndex(**kwargs)
+        for google_id, title in titles.items():
+            index.add(google_id, index.embed(title, ["Frank Herbert"], ["Science Fiction"], ""))
+        return index
+
+    def test_most_similar(self):
+        index = self.index({"a": "Dune", "b": "Dune Messiah", "c": "Children of Dune"})
+        ranked = index.most_similar(index.vector_for("a"), k=5, exclude="a")
+        self.assertEqual({google_id for google_id, _ in ranked}, {"b", "c"})
+        self.assertGreaterEqual(ranked[0][1], ranked[1][1])
+
+    def test_warns_once_above_brute_force_max(self):
+        index = self.index({"a": "Dune", "b": "Dune Messiah"}, brute_force_max=2)
+        with self.assertNoLogs("books.similarity"):
+            index.most_similar(index.vector_for("a"))
+        index.add("c", index.vector_for("a"))
+        with self.assertLogs("books.similarity", "WARNING") as logs:
+            index.most_similar(index.vector_for("a"))
+            index.most_similar(index.vector_for("b"))
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("SIMILARITY_BRUTE_FORCE_MAX=2", logs.output[0])
+
+    def built(self, count, **kwargs):
+        from .similarity import SimilarityIndex
+
+        index = SimilarityIndex(**kwargs)
+        titles = [f"{word} {n}" for n in range(count // 4) for word in ("Dune", "Emma", "Ubik", "Kindred")]
+        vectors = [index.embed(title, [], [title.split()[0]], "") for title in titles]
+        index.build([f"b{n}" for n in range(len(titles))], vectors)
+        return index
+
+    def test_ivf_above_brute_force_max(self):
+        exact = self.built(200)
+        index = self.built(200, brute_force_max=100, lists=8, probes=8)
+        self.assertIsNotNone(index._ivf)
+        query = exact.vector_for("b5")
+        with self.assertNoLogs("books.similarity"):
+            # Probing every list is exact.
+            self.assertEqual(index.most_similar(query, k=5, exclude="b5"), exact.most_similar(query, k=5, exclude="b5"))
+            index.probes = 1
+            self.assertEqual(index.most_similar(query, k=1)[0][0], "b5")
+
+    def test_snapshot_round_trip(self):
+        from .similarity import SimilarityIndex
+
+        index = self.built(40, brute_force_max=10, lists=4, probes=2)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "index")
+        index.save(path, max_id=40)
+
+        loaded = SimilarityIndex(brute_force_max=10, lists=4, probes=2)
+        self.assertEqual(loaded.load(path), {"max_id": 40})
+        query = index.vector_for("b1")
+        self.assertEqual(loaded.most_similar(query, k=5), index.most_similar(query, k=5))
+
+        # A replaced vector shadows the mapped one; new books join the overlay.
+        loaded.add("b1", index.vector_for("b2"))
+        loaded.add("new", query)
+        self.assertEqual(len(loaded), 41)
+        ranked = [google_id for google_id, _ in loaded.most_similar(query, k=40)]
+        self.assertEqual(ranked[0], "new")
+        self.assertEqual(len(ranked), len(set(ranked)))
+
+
+class SimilaritySyncTests(TestCase):
+    """Workers map the saved snapshot and pick up books and snapshots saved elsewhere."""
+
+    def setUp(self):
+        from books import similarity
+
+        self.similarity = similarity
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "index")
+        override = override_settings(SIMILARITY_INDEX_PATH=self.path)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(setattr, similarity, "_index", None)
+        cache.clear()
+        Book.objects.create(google_id="savedAAAJ", title="Saved Before")
+
+    @mock.patch("books.similarity.SIMILARITY_REFRESH_SECONDS", 0)
+    def test_books_saved_elsewhere_are_pulled_in(self):
+        self.assertEqual(self.similarity.rebuild_similarity_index(), 1)
+        self.similarity._index = None
+        with self.assertNumQueries(0):
+            index = self.similarity.get_similarity_index()
+        self.assertIsNotNone(index.vector_for("savedAAAJ"))
+
+        # bulk_create skips the local post_save hook, like a write in another worker.
+        Book.objects.bulk_create([Book(google_id="elsewhereAAAJ", title="Written Elsewhere")])
+        self.assertIsNone(self.similarity.get_similarity_index().vector_for("elsewhereAAAJ"))
+        cache.set(self.similarity.INDEX_VERSION_KEY, 1, None)
+        self.assertIsNotNone(self.similarity.get_similarity_index().vector_for("elsewhereAAAJ"))
+
+    @mock.patch("books.similarity.SIMILARITY_REFRESH_SECONDS", 0)
+    def test_new_snapshot_is_mapped(self):
+        self.similarity.rebuild_similarity_index()
+        old = self.similarity.get_similarity_index()
+        rebuilt = self.similarity.new_index()
+        rebuilt.build(["otherAAAJ"], [old.vector_for("savedAAAJ")])
+        rebuilt.save(self.path, max_id=0)
+        os.utime(self.path, (time.time() + 1,) * 2)
+
+        with mock.patch.object(self.similarity._loader, "submit", side_effect=lambda task: task()):
+            index = self.similarity.get_similarity_index()
+        self.assertIsNot(index, old)
+        self.assertIsNotNone(index.vector_for("otherAAAJ"))
+
+
+class AutocompleteIndexTests(TestCase):
+    """Wide prefixes stay memoized across inserts; other workers' books are pulled in."""
+
+    def test_insert_updates_memoized_top_k_in_place(self):
+        index = autocomplete.PrefixIndex(scan_limit=2)
+        index.build([(f"t{n}", f"The Book {n}", [], n) for n in range(5)])
+        self.assertEqual([hit["google_id"] for hit in index.search("t", limit=3)], ["t4", "t3", "t2"])
+
+        with mock.patch.object(index, "_top_slots", side_effect=AssertionError("rescanned")):
+            index.add("hot", "The Hot One", [], weight=10)
+            index.add("cold", "The Cold One", [], weight=0)
+            index.add("t3", "Renamed", [])
+            self.assertEqual([hit["google_id"] for hit in index.search("th", limit=3)], ["hot", "t4", "t2"])
+
+    @mock.patch("books.autocomplete.AUTOCOMPLETE_REFRESH_SECONDS", 0)
+    def test_refresh_picks_up_books_saved_elsewhere(self):
+        cache.clear()
+        autocomplete.build_book_index()
+        # bulk_create skips the local post_save hook, like a write in another worker.
+        Book.objects.bulk_create([Book(google_id="elsewhereAAAJ", title="Written Elsewhere")])
+        self.assertEqual(autocomplete.autocomplete_books("written"), [])
+
+        cache.set(autocomplete.INDEX_VERSION_KEY, 1, None)
+        self.assertEqual([hit["google_id"] for hit in autocomplete.autocomplete_books("written")],
+                         ["elsewhereAAAJ"])
+
+    def test_snapshot_round_trip(self):
+        index = autocomplete.PrefixIndex(scan_limit=2)
+        index.build([(f"t{n}", f"Thé Book {n}", [f"Author\x1f{n}"], n) for n in range(5)])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "index")
+        index.save(path, max_id=5)
+
+        loaded = autocomplete.PrefixIndex(scan_limit=2)
+        self.assertEqual(loaded.load(path)["max_id"], 5)
+        self.assertEqual(loaded.search("the", limit=3), index.search("the", limit=3))
+        self.assertEqual(loaded.search("author"), index.search("author"))
+
+        # An edited book's packed copy is masked by the new one.
+        loaded.add("t4", "Renamed", [])
+        self.assertEqual([hit["google_id"] for hit in loaded.search("th", limit=3)], ["t3", "t2", "t1"])
+        self.assertEqual(loaded.search("renamed"), [{"google_id": "t4", "title": "Renamed", "authors": []}])
+        self.assertEqual(len(loaded), 5)
+
+    def test_workers_map_the_snapshot_without_scanning_books(self):
+        Book.objects.create(google_id="mappedAAAJ", title="Mapped Once")
+        autocomplete.build_book_index()
+        autocomplete.book_index.ready = False
+        with self.assertNumQueries(0):
+            self.assertEqual([hit["google_id"] for hit in autocomplete.autocomplete_books("mapped")],
+                             ["mappedAAAJ"])
+
+    def test_first_snapshot_is_built_by_one_process(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.assertTrue(cache.add(autocomplete.BUILD_LOCK_KEY, True))
+        self.addCleanup(cache.delete, autocomplete.BUILD_LOCK_KEY)
+        autocomplete.book_index.ready = False
+        with override_settings(AUTOCOMPLETE_INDEX_PATH=os.path.join(directory.name, "index")):
+            with self.assertNumQueries(0):
+                self.assertEqual(autocomplete.autocomplete_books("anything"), [])
+
+
+class PopularityTests(TransactionTestCase):
+    """Buffered counters reach the database on a timer; a rebuild recomputes everything."""
+
+    def setUp(self):
+        cache.clear()
+        # Committed interaction writes feed the process-wide buffer; drop them afterwards.
+        self.addCleanup(popularity.buffer._drain)
+        self.user = User.objects.create_user("popular", password="pass-Word-1")
+        self.books = [Book.objects.create(google_id=f"pop{n}AAAJ", title=f"Popular {n}") for n in range(2)]
+
+    @mock.patch("books.popularity.FLUSH_EVENTS", 1000)
+    @mock.patch("books.popularity.FLUSH_INTERVAL", 0.2)
+    def test_quiet_buffer_is_flushed_by_the_timer(self):
+        buffer = popularity.PopularityBuffer()
+        # The flush thread keeps its connection; close it so the test database can be dropped.
+        self.addCleanup(lambda: buffer._executor.submit(connections.close_all).result())
+        buffer.record(self.books[0].pk, {"read_count": 1}, [popularity.EVENT_WEIGHTS["RD"]])
+
+        deadline = time.monotonic() + 5
+        while not BookStats.objects.filter(book=self.books[0], read_count=1).exists():
+            self.assertLess(time.monotonic(), deadline, "buffer was not flushed")
+            time.sleep(0.05)
+        self.assertEqual(popularity.get_trending_book_ids(), [self.books[0].pk])
+
+    def test_rebuild_recomputes_counts_and_trending_score(self):
+        other = User.objects.create_user("popular2", password="pass-Word-1")
+        UserBookInteraction.objects.create(user=self.user, book=self.books[0], status="RD", is_favorite=True)
+        UserBookInteraction.objects.create(user=other, book=self.books[0], status="RDG")
+        UserBookInteraction.objects.create(user=self.user, book=self.books[1], status="WTR")
+        BookStats.objects.create(book=self.books[1], read_count=7, trending_score=1e6)
+
+        popularity.rebuild_counts()
+
+        hot, cold = BookStats.objects.get(book=self.books[0]), BookStats.objects.get(book=self.books[1])
+        self.assertEqual((hot.read_count, hot.reading_count, hot.favorite_count), (1, 1, 1))
+        self.assertEqual((cold.read_count, cold.want_to_read_count), (0, 1))
+        self.assertGreater(hot.trending_score, cold.trending_score)
+        self.assertEqual(popularity.refresh_trending(), [self.books[0].pk, self.books[1].pk])
+
+
+class AuthorIndexTests(TestCase):
+    """Book writes keep Author links in step; lookups ignore case and spacing."""
+
+    def test_book_writes_sync_author_links(self):
+        book = Book.objects.create(google_id="authAAAJ", title="Earthsea",
+                                   authors=["Ursula K. Le Guin", "ursula k.  le GUIN", " "])
+        self.assertEqual(list(book.author_entries.values_list("canonical_name", flat=True)), ["ursula k. le guin"])
+
+        book.authors = ["Someone Else"]
+        book.save()
+        self.assertEqual(list(book.author_entries.values_list("name", flat=True)), ["Someone Else"])
+        # The old author row stays for other books; it just no longer lists this one.
+        self.assertFalse(Author.objects.get(canonical_name="ursula k. le guin").books.exists())
+
+    def test_books_by_author_is_case_insensitive(self):
+        for n, authors in enumerate([["Ursula K. Le Guin"], ["URSULA K. LE GUIN", "Co Author"], ["Other"]]):
+            Book.objects.create(google_id=f"auth{n}AAAJ", title=f"Book {n}", authors=authors)
+
+        self.assertEqual([book.google_id for book in get_books_by_author("  ursula k.   le guin ")],
+                         ["auth0AAAJ", "auth1AAAJ"])
+        response = self.client.get(reverse("v1:author-books", kwargs={"name": "Ursula K. LE Guin"}))
+        self.assertEqual([book["google_id"] for book in response.data["results"]], ["auth0AAAJ", "auth1AAAJ"])
+
+
+class AuthorBackfillMigrationTests(TransactionTestCase):
+    """
+    Runs 0003's backfill for real. Migrations past 0007 can't be reversed,
+    so the test database's schema is rebuilt from scratch, migrated
+    forward to 0003, and brought back to the latest state afterwards.
+    """
+    alias = "default"
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connections[self.alias])
+        executor.migrate(targets or executor.loader.graph.leaf_nodes())
+        return executor.loader.project_state(targets).apps if targets else None
+
+    def setUp(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+        self.addCleanup(self.migrate, None)
+
+    def test_backfill_links_existing_books(self):
+        old_apps = self.migrate([("books", "0002_review_userbookinteraction")])
+        OldBook = old_apps.get_model("books", "Book")
+        OldBook.objects.using(self.alias).bulk_create([
+            OldBook(google_id="oneAAAJ", title="One", authors=["Ann Author", "Ben  Writer"]),
+            OldBook(google_id="twoAAAJ", title="Two", authors=["ANN AUTHOR"]),
+            OldBook(google_id="threeAAAJ", title="Three", authors=[]),
+        ])
+
+        new_apps = self.migrate([("books", "0003_author")])
+        Author = new_apps.get_model("books", "Author")
+        links = Author.books.through.objects.using(self.alias).values_list("author__canonical_name", "book_id")
+        self.assertEqual(sorted(links), [("ann author", "oneAAAJ"), ("ann author", "twoAAAJ"), ("ben writer", "oneAAAJ")])
+        self.assertEqual(Author.objects.using(self.alias).get(canonical_name="ann author").name, "Ann Author")
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    """Cross-worker invalidation needs a shared cache; a per-process one is flagged."""
+
+    def messages(self, backend, deploy=False):
+        from .checks import check_shared_cache, check_shared_cache_deploy
+
+        check = check_shared_cache_deploy if deploy else check_shared_cache
+        with self.settings(CACHES={"default": {"BACKEND": backend, "LOCATION": "127.0.0.1:6379"}}):
+            return [message.id for message in check(None)]
+
+    def test_process_local_cache_is_flagged(self):
+        self.assertEqual(self.messages("django.core.cache.backends.locmem.LocMemCache"), ["books.W001"])
+        self.assertEqual(self.messages("django.core.cache.backends.locmem.LocMemCache", deploy=True), ["books.E001"])
+        with self.settings(DATABASE_REPLICAS=["replica1"]):
+            self.assertEqual(self.messages("django.core.cache.backends.locmem.LocMemCache"), ["books.E002"])
+
+    def test_shared_cache_passes(self):
+        self.assertEqual(self.messages("django.core.cache.backends.redis.RedisCache"), [])
+        self.assertEqual(self.messages("django.core.cache.backends.redis.RedisCache", deploy=True), [])
+
+
+class BookCacheTests(TestCase):
+    """Two BookCache instances over one shared cache stand in for two worker processes."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(google_id="cachedAAAJ", title="Original")
+        self.this_worker, self.other_worker = BookCache(l1_ttl=60), BookCache(l1_ttl=60)
+
+    def rename(self, title):
+        # What a Book write does in the other worker: new row, version bump.
+        Book.objects.filter(pk=self.book.pk).update(title=title)
+        self.other_worker.invalidate(self.book.google_id)
+
+    def test_tiers_are_filled_in_order(self):
+        self.this_worker.get(self.book.google_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.other_worker.get(self.book.google_id).title, "Original")
+            self.this_worker.get(self.book.google_id)
+        stats = self.this_worker.stats()
+        self.assertEqual((stats["misses"], stats["l1_hits"]), (1, 1))
+        self.assertEqual(self.other_worker.stats()["l2_hits"], 1)
+
+    def test_other_workers_write_is_seen_after_l1_ttl(self):
+        self.this_worker.get(self.book.google_id)
+        self.rename("Renamed")
+
+        # Trusted without revalidation for l1_ttl: a bounded stale read.
+        self.assertEqual(self.this_worker.get(self.book.google_id).title, "Original")
+        self.this_worker.l1_ttl = 0
+        self.assertEqual(self.this_worker.get(self.book.google_id).title, "Renamed")
+        self.assertEqual(self.this_worker.get_many([self.book.google_id])[self.book.google_id].title, "Renamed")
+
+    def test_revalidation_keeps_unchanged_entries(self):
+        self.this_worker.l1_ttl = 0
+        self.this_worker.get(self.book.google_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.this_worker.get(self.book.google_id).title, "Original")
+
+    def test_l2_entry_of_an_older_version_is_ignored(self):
+        self.other_worker.get(self.book.google_id)  # L2 now holds "Original"
+        self.rename("Renamed")
+        self.assertEqual(self.this_worker.get(self.book.google_id).title, "Renamed")
+
+    def test_local_write_drops_l1_at_once(self):
+        book_cache.l1.clear()
+        book_cache.get(self.book.google_id)
+        self.book.title = "Saved here"
+        self.book.save()
+        self.assertEqual(book_cache.get(self.book.google_id).title, "Saved here")
+
+
+class CategoryBrowseTests(TestCase):
+    """Keyset pages follow (sort value, google_id) descending, without gaps or repeats."""
+
+    @classmethod
+    def setUpTestData(cls):
+        ratings = [4.5, 3.0, 4.5, None, 5.0, 3.0, 4.5]
+        for n, rating in enumerate(ratings):
+            Book.objects.create(google_id=f"cat{n}AAAJ", title=f"Category {n}", categories=["Fiction"],
+                                average_rating=rating, published_date=f"20{10 + n}")
+        Book.objects.create(google_id="otherAAAJ", title="Other", categories=["History"], average_rating=5.0)
+
+    def browse(self, limit=2, **params):
+        ids, cursor = [], None
+        while True:
+            data = self.client.get(reverse("v1:category-books", kwargs={"category": "Fiction"}),
+                                   {"limit": limit, **({"cursor": cursor} if cursor else {}), **params}).data
+            ids.extend(book["google_id"] for book in data["books"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return ids
+
+    def test_pages_by_rating_with_ties(self):
+        # Ties on rating fall back to google_id, descending; unrated books are left out.
+        self.assertEqual(self.browse(), ["cat4AAAJ", "cat6AAAJ", "cat2AAAJ", "cat0AAAJ", "cat5AAAJ", "cat1AAAJ"])
+        self.assertEqual(self.browse(limit=100), self.browse(limit=1))
+
+    def test_pages_by_date(self):
+        self.assertEqual(self.browse(sort="date"), [f"cat{n}AAAJ" for n in range(6, -1, -1)])
+
+    def test_rows_inserted_between_pages_do_not_shift_the_cursor(self):
+        url = reverse("v1:category-books", kwargs={"category": "Fiction"})
+        first = self.client.get(url, {"limit": 3}).data
+        Book.objects.create(google_id="newAAAJ", title="New", categories=["Fiction"], average_rating=5.0)
+        second = self.client.get(url, {"limit": 3, "cursor": first["next_cursor"]}).data
+        self.assertEqual([book["google_id"] for book in second["books"]], ["cat0AAAJ", "cat5AAAJ", "cat1AAAJ"])
+
+    def test_invalid_cursor_and_sort_are_400(self):
+        url = reverse("v1:category-books", kwargs={"category": "Fiction"})
+        for cursor in ("garbage", encode_cursor({"a": 1, "b": 2}), encode_cursor([[4.5], "cat0AAAJ"]),
+                       encode_cursor(["high", "cat0AAAJ"]), encode_cursor([4.5, 7]), encode_cursor([4.5])):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url, {"cursor": cursor}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"sort": "title"}).status_code, 400)
+
+
+class LocalCatalogProviderTests(SimpleTestCase):
+    """The memory-mapped catalog answers by id and search, and falls through to the next provider."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "catalog.jsonl")
+        volumes = [fake_volume(f"local{n}AAAJ") for n in range(50)]
+        volumes[7]["volumeInfo"].update(title="The Left Hand of Darkness", authors=["Ursula K. Le Guin"])
+        with open(self.path, "w") as catalog:
+            for n, volume in enumerate(volumes):
+                catalog.write(json.dumps(volume) + "\n")
+                if n == 10:
+                    catalog.write("\n")  # blank lines are skipped
+        self.assertEqual(build_catalog_index(self.path), 50)
+        FakeBookProvider.calls = []
+
+    def test_lookup_by_id(self):
+        provider = LocalCatalogProvider(self.path)
+        for n in (0, 7, 11, 49):
+            self.assertEqual(provider.get_details(f"local{n}AAAJ")["id"], f"local{n}AAAJ")
+        self.assertIsNone(provider.get_details("absentAAAJ"))
+
+    def test_search_matches_title_and_authors(self):
+        provider = LocalCatalogProvider(self.path)
+        self.assertEqual([item["id"] for item in provider.search("le guin darkness")["items"]], ["local7AAAJ"])
+        # 49 matches (local7 was renamed), so skipping 45 leaves the last four.
+        page = provider.search("remote author", max_results=5, start_index=45)["items"]
+        self.assertEqual([item["id"] for item in page], [f"local{n}AAAJ" for n in range(46, 50)])
+
+    def test_chain_falls_through_to_the_next_provider(self):
+        providers = [("books.providers.LocalCatalogProvider", {"path": self.path}), "books.tests.FakeBookProvider"]
+        with override_settings(BOOK_PROVIDERS=providers):
+            self.assertEqual(get_google_book_details("local3AAAJ")["id"], "local3AAAJ")
+            self.assertEqual(FakeBookProvider.calls, [])
+            self.assertEqual(get_google_book_details("remoteAAAJ")["id"], "remoteAAAJ")
+            self.assertEqual(search_google_books("no such words")["items"][0]["id"], "remote-no such words-0")
+        self.assertEqual(FakeBookProvider.calls, [("details", "remoteAAAJ"), ("search", "no such words")])
+
+
+class LibraryCacheTests(TestCase):
+    """The cached library projection is reused until an interaction write."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("shelf", password="pass-Word-1")
+        cls.books = [Book.objects.create(google_id=f"shelf{n}AAAJ", title=f"Shelf {n}") for n in range(3)]
+        for n, book in enumerate(cls.books):
+            UserBookInteraction.objects.create(user=cls.user, book=book, status="RD", is_favorite=n == 0)
+
+    def setUp(self):
+        cache.clear()
+        book_cache.l1.clear()
+
+    def test_warm_library_skips_the_database(self):
+        get_library(self.user.pk)  # builds the projection
+        get_library(self.user.pk)  # hydrates the book cache
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_library(self.user.pk)), 3)
+            self.assertEqual([book.pk for book, *_ in get_library(self.user.pk, favorites_only=True)],
+                             [self.books[0].pk])
+
+    def test_interaction_write_invalidates(self):
+        get_library(self.user.pk)
+        interaction = UserBookInteraction.objects.get(user=self.user, book=self.books[1])
+        interaction.is_favorite = True
+        interaction.save()
+        self.assertEqual(len(get_library(self.user.pk, favorites_only=True)), 2)
+        interaction.delete()
+        self.assertEqual(len(get_library(self.user.pk)), 2)
+
+
+@mock.patch("books.sync.SYNC_SETTLE_SECONDS", 0)
+class LibrarySyncTests(TestCase):
+    """Delta sync returns only what changed since the token, in bounded pages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("syncer", password="pass-Word-1")
+        cls.books = [Book.objects.create(google_id=f"sync{n}AAAJ", title=f"Sync {n}") for n in range(5)]
+        for book in cls.books:
+            UserBookInteraction.objects.create(user=cls.user, book=book, status="WTR")
+        cls.review = Review.objects.create(user=cls.user, book=cls.books[0], rating=4)
+
+    def sync_all(self, token=None, limit=2):
+        changes = {"interactions": [], "reviews": [], "deleted": []}
+        has_more = True
+        while has_more:
+            page, token, has_more = sync_changes(self.user, token, limit)
+            self.assertLessEqual(sum(map(len, page.values())), limit)
+            for name, rows in page.items():
+                changes[name].extend(rows)
+        return changes, token
+
+    def test_initial_sync_pages_through_everything(self):
+        changes, _ = self.sync_all()
+        self.assertEqual(len(changes["interactions"]), 5)
+        self.assertEqual(changes["reviews"], [self.review])
+        self.assertEqual(changes["deleted"], [])
+
+    def test_returns_only_changes_since_token(self):
+        _, token = self.sync_all()
+        interaction = UserBookInteraction.objects.get(user=self.user, book=self.books[3])
+        interaction.status = "RD"
+        interaction.save()
+        self.review.delete()
+
+        changes, token = self.sync_all(token)
+        self.assertEqual(changes["interactions"], [interaction])
+        self.assertEqual(changes["reviews"], [])
+        self.assertEqual([(t.kind, t.book_pk) for t in changes["deleted"]], [("review", self.books[0].pk)])
+        self.assertEqual(self.sync_all(token)[0], {"interactions": [], "reviews": [], "deleted": []})
+
+    def test_malformed_token_is_rejected(self):
+        naive = encode_cursor({name: ["2025-01-01T00:00:00", 0] for name in ("interactions", "reviews", "deleted")})
+        for token in (naive, encode_cursor({"interactions": ["x", 0]}), "not-a-token"):
+            with self.subTest(token=token), self.assertRaises(ValueError):
+                sync_changes(self.user, token)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(reverse("v1:user-library-sync"), {"token": naive}).status_code, 400)
+
+    def test_deleting_the_user_leaves_no_tombstones(self):
+        self.user.delete()
+        self.assertFalse(SyncTombstone.objects.exists())
+
+
+class FakeSummaryStream:
+    """Stands in for a streamed OpenAI response; waits for `gate` before the first token."""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, prompt, stream=False):
+        self.calls += 1
+        self.gate.wait(5)
+        for token in ["A ", "spoiler-free ", "summary."]:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta={"content": token})])
+
+
+class SummaryTests(TestCase):
+    """The non-streaming summary reuses Book.ai_summary and never stores failures."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(google_id="summaryAAAJ", title="Summed", authors=["Someone"])
+        self.upstream = mock.Mock(side_effect=fake_ai_summary)
+        patcher = mock.patch("books.services.request_ai_summary", self.upstream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def summary(self):
+        return self.client.get(reverse("v1:book-summary", kwargs={"book_id": self.book.pk})).data["summary"]
+
+    def test_summary_is_stored_and_reused(self):
+        self.assertEqual(self.summary(), "A spoiler-free summary.")
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.ai_summary, "A spoiler-free summary.")
+        cache.clear()  # e.g. the cache entry expired
+        self.assertEqual(self.summary(), "A spoiler-free summary.")
+        self.assertEqual(self.upstream.call_count, 1)
+
+    def test_failure_is_not_stored(self):
+        self.upstream.side_effect = ConnectionError("upstream unavailable")
+        with self.assertLogs("books.services", "ERROR"):
+            self.assertEqual(self.summary(), "Summary not available due to API error.")
+        self.assertIsNone(cache.get(summary_cache_key(self.book.pk)))
+
+        self.upstream.side_effect = fake_ai_summary
+        self.assertEqual(self.summary(), "A spoiler-free summary.")
+
+
+class SummaryStreamTests(TransactionTestCase):
+    """The stream thread writes through its own connection, so rows must be committed."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(google_id="streamAAAJ", title="Streamed", authors=["Someone"])
+        self.upstream = FakeSummaryStream()
+        patcher = mock.patch("books.streaming.request_ai_summary", self.upstream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_streams_tokens_then_done_and_stores_summary(self):
+        response = self.client.get(reverse("v1:book-summary-stream", kwargs={"book_id": self.book.pk}))
+        events = b"".join(response.streaming_content).decode().strip().split("\n\n")
+
+        self.assertEqual(events[:3], [f'data: {{"token": "{token}"}}' for token in ["A ", "spoiler-free ", "summary."]])
+        self.assertEqual(events[3], 'event: done\ndata: {"summary": "A spoiler-free summary."}')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.ai_summary, "A spoiler-free summary.")
+        self.assertEqual(cache.get(summary_cache_key(self.book.pk)), "A spoiler-free summary.")
+
+        # Later viewers get the stored summary without another upstream call.
+        again = b"".join(self.client.get(
+            reverse("v1:book-summary-stream", kwargs={"book_id": self.book.google_id})
+        ).streaming_content)
+        self.assertEqual(again.decode().count("event: done"), 1)
+        self.assertEqual(self.upstream.calls, 1)
+
+    def test_concurrent_viewers_share_one_upstream_call(self):
+        self.upstream.gate.clear()
+        first, second = attach_summary_stream(self.book), attach_summary_stream(self.book)
+        self.assertIs(first, second)
+        self.upstream.gate.set()
+
+        self.assertEqual("".join(first.follow()), "A spoiler-free summary.")
+        self.assertEqual("".join(second.follow()), "A spoiler-free summary.")
+        self.assertEqual(self.upstream.calls, 1)
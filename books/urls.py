@@ -1,11 +1,20 @@
 from django.urls import path
 from .views import (
     BookSearchView,
+    BookAutocompleteView,
     BookDetailView,
+    BookBatchDetailView,
+    BookCacheStatsView,
+    AuthorBooksView,
+    CategoryBooksView,
+    SimilarBooksView,
     BookSummaryView,
+    BookSummaryStreamView,
     HomeBooksView,
+    TrendingBooksView,
     UserBookInteractionView,
     UserLibraryView,
+    UserLibrarySyncView,
     ReviewListCreateView,
     ReviewDetailView,
     UserFavoritesView,
@@ -14,16 +23,25 @@ from .views import (
 urlpatterns = [
     # Public book endpoints
     path("search/", BookSearchView.as_view(), name="book-search"),
-    path("details/<str:google_id>/", BookDetailView.as_view(), name="book-detail"),
-    path("summary/<int:book_id>/", BookSummaryView.as_view(), name="book-summary"),
+    path("autocomplete/", BookAutocompleteView.as_view(), name="book-autocomplete"),
+    path("details/batch/", BookBatchDetailView.as_view(), name="book-detail-batch"),
+    path("details/<str:book_id>/", BookDetailView.as_view(), name="book-detail"),
+    path("similar/<str:book_id>/", SimilarBooksView.as_view(), name="similar-books"),
+    path("cache/stats/", BookCacheStatsView.as_view(), name="book-cache-stats"),
+    path("authors/<str:name>/books/", AuthorBooksView.as_view(), name="author-books"),
+    path("categories/<str:category>/books/", CategoryBooksView.as_view(), name="category-books"),
+    path("summary/<str:book_id>/", BookSummaryView.as_view(), name="book-summary"),
+    path("summary/<str:book_id>/stream/", BookSummaryStreamView.as_view(), name="book-summary-stream"),
     path("home/", HomeBooksView.as_view(), name="home-books"),
+    path("trending/", TrendingBooksView.as_view(), name="trending-books"),
 
     # User interactions (JWT protected)
     path("interactions/", UserBookInteractionView.as_view(), name="user-interaction"),
     path("interactions/my-library/", UserLibraryView.as_view(), name="user-library"),
     path("interactions/favorites/", UserFavoritesView.as_view(), name="user-favorites"),
+    path("interactions/sync/", UserLibrarySyncView.as_view(), name="user-library-sync"),
 
     # Reviews
-    path("books/<int:book_id>/reviews/", ReviewListCreateView.as_view(), name="book-reviews"),
+    path("books/<str:book_id>/reviews/", ReviewListCreateView.as_view(), name="book-reviews"),
     path("reviews/<int:review_id>/", ReviewDetailView.as_view(), name="review-detail"),
 ]
@@ -1,6 +1,10 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from .models import Book, UserBookInteraction, Review
 from .serializers import (
@@ -8,17 +12,31 @@ from .serializers import (
     BookDetailSerializer,
     UserBookInteractionSerializer,
     ReviewSerializer,
+    parse_fields,
+    pick_fields,
 )
 from .services import (
-    search_google_books,
-    normalize_google_book,
-    get_or_create_book_details,
+    get_or_create_book_by_key,
+    get_or_create_books_bulk,
+    get_book_by_key,
+    book_key_lookup,
     generate_and_cache_ai_summary,
     get_genre_top_books,
     get_recent_books,
-    get_bestsellers
+    get_trending_books,
+    get_bestsellers,
+    get_books_by_author,
+    browse_category,
+    book_to_unified,
+    CATEGORY_SORTS,
 )
+from .autocomplete import autocomplete_books
+from .cache import book_cache
+from .library import get_library
 from .permissions import IsOwnerOrReadOnly
+from .search import search_books_page, search_client_key
+from .streaming import EventStreamRenderer, summary_events
+from .sync import SYNC_PAGE_SIZE, SyncTokenExpired, sync_changes
 
 
 # -------------------------------
@@ -32,12 +50,60 @@ class BookSearchView(APIView):
         if not query:
             return Response({"error": "Query parameter 'q' is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        data = search_google_books(query)
-        if not data or "items" not in data:
-            return Response({"books": []})
+        try:
+            page_size = min(max(int(request.GET.get("page_size", 20)), 1), 40)
+            books, next_cursor = search_books_page(
+                query, cursor=request.GET.get("cursor"), page_size=page_size, client=search_client_key(request)
+            )
+        except ValueError:
+            return Response({"error": "Invalid page_size or cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = BookSerializer(books, many=True, context={"fields": parse_fields(request)})
+        return Response({"books": serializer.data, "next_cursor": next_cursor})
+
+
+# -------------------------------
+# Batch Book Details
+# -------------------------------
+class BookBatchDetailView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        google_ids = [google_id for google_id in request.GET.get("ids", "").split(",") if google_id]
+        if not google_ids:
+            return Response({"error": "Query parameter 'ids' is required."}, status=status.HTTP_400_BAD_REQUEST)
+        max_ids = getattr(settings, "BOOK_BATCH_MAX_IDS", 50)
+        if len(google_ids) > max_ids:
+            return Response(
+                {"error": f"At most {max_ids} ids per request."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        books, failed = get_or_create_books_bulk(google_ids)
+        results = []
+        for google_id in google_ids:
+            book = books.get(google_id)
+            if google_id in failed:
+                results.append({"google_id": google_id, "error": "Upstream error."})
+            elif book is None:
+                results.append({"google_id": google_id, "error": "Book not found."})
+            else:
+                results.append({"google_id": google_id, "book": BookDetailSerializer(book).data})
+        return Response({"books": results})
+
 
-        books = [normalize_google_book(item) for item in data.get("items", [])]
-        return Response({"books": books})
+# -------------------------------
+# Autocomplete
+# -------------------------------
+class BookAutocompleteView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = request.GET.get("q", "")
+        try:
+            limit = min(max(int(request.GET.get("limit", 10)), 1), 20)
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"suggestions": autocomplete_books(query, limit=limit)})
 
 
 # -------------------------------
@@ -46,14 +112,86 @@ class BookSearchView(APIView):
 class BookDetailView(APIView):
     permission_classes = [permissions.AllowAny]
 
-    def get(self, request, google_id):
-        book = get_or_create_book_details(google_id)
+    def get(self, request, book_id):
+        book = get_or_create_book_by_key(book_id)
         if not book:
             return Response({"error": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
         serializer = BookDetailSerializer(book)
         return Response(serializer.data)
 
 
+class BookCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(book_cache.stats())
+
+
+# -------------------------------
+# Books by Author
+# -------------------------------
+class BookPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class AuthorBooksView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, name):
+        paginator = BookPagination()
+        page = paginator.paginate_queryset(get_books_by_author(name), request, view=self)
+        serializer = BookDetailSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+# -------------------------------
+# Similar Books
+# -------------------------------
+class SimilarBooksView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, book_id):
+        # Imported here so numpy is only loaded by processes that use it.
+        from .similarity import similar_books
+
+        book = get_or_create_book_by_key(book_id)
+        if not book:
+            return Response({"error": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = min(max(int(request.GET.get("limit", 10)), 1), 50)
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"books": [book_to_unified(similar) for similar in similar_books(book, limit=limit)]})
+
+
+# -------------------------------
+# Category Browse
+# -------------------------------
+class CategoryBooksView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, category):
+        sort = request.GET.get("sort", "rating")
+        if sort not in CATEGORY_SORTS:
+            return Response(
+                {"error": f"sort must be one of: {', '.join(CATEGORY_SORTS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            limit = min(max(int(request.GET.get("limit", 20)), 1), 100)
+            books, next_cursor = browse_category(
+                category, sort=sort, cursor=request.GET.get("cursor"), limit=limit
+            )
+        except ValueError:
+            return Response({"error": "Invalid limit or cursor."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "books": [book_to_unified(book) for book in books],
+            "next_cursor": next_cursor,
+        })
+
+
 # -------------------------------
 # AI Summary
 # -------------------------------
@@ -65,6 +203,21 @@ class BookSummaryView(APIView):
         return Response({"summary": summary})
 
 
+class BookSummaryStreamView(APIView):
+    """Streams the summary as Server-Sent Events while it is generated."""
+    permission_classes = [permissions.AllowAny]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    def get(self, request, book_id):
+        book = get_book_by_key(book_id)
+        if not book:
+            return Response({"error": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
+        response = StreamingHttpResponse(summary_events(book), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # stop nginx from buffering the stream
+        return response
+
+
 # -------------------------------
 # Home / Genre Top / Recent / Bestseller Books
 # -------------------------------
@@ -72,13 +225,31 @@ class HomeBooksView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        return Response({
+        context = {"fields": parse_fields(request)}
+        sections = {
             "carousel": get_genre_top_books(limit=10),
             "recent": get_recent_books(limit=10),
             "bestsellers": get_bestsellers(limit=10)
+        }
+        return Response({
+            name: BookSerializer(books, many=True, context=context).data
+            for name, books in sections.items()
         })
 
 
+class TrendingBooksView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.GET.get("limit", 20)), 1), 100)
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        books = [book_to_unified(book) for book in get_trending_books(limit=limit)]
+        serializer = BookSerializer(books, many=True, context={"fields": parse_fields(request)})
+        return Response({"books": serializer.data})
+
+
 # -------------------------------
 # UserBookInteraction
 # -------------------------------
@@ -97,7 +268,7 @@ class UserBookInteractionView(APIView):
         if not book_id:
             return Response({"error": "book_id is required."}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            interaction = UserBookInteraction.objects.get(user=request.user, book_id=book_id)
+            interaction = UserBookInteraction.objects.get(user=request.user, **book_key_lookup(book_id, "book__"))
         except UserBookInteraction.DoesNotExist:
             return Response({"error": "Interaction not found."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -117,9 +288,12 @@ class ReviewListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, book_id):
+        book = get_book_by_key(book_id)
+        if not book:
+            return Response({"error": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
         serializer = ReviewSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
-            serializer.save(user=request.user, book_id=book_id)
+            serializer.save(user=request.user, book=book)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -149,25 +323,26 @@ class ReviewDetailView(APIView):
 # -------------------------------
 # User Library & Favorites
 # -------------------------------
+def _library_entry(book, status, is_favorite, fields):
+    return pick_fields({
+        "id": book.pk,
+        "google_id": book.google_id,
+        "title": book.title,
+        "authors": book.authors,
+        "published_date": book.published_date,
+        "thumbnail_url": book.thumbnail_url,
+        "short_description": book.short_description,
+        "status": status,
+        "is_favorite": is_favorite,
+    }, fields)
+
+
 class UserLibraryView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        interactions = UserBookInteraction.objects.filter(user=request.user)
-        data = []
-        for interaction in interactions:
-            book = interaction.book
-            data.append({
-                "id": book.id,
-                "google_id": book.google_id,
-                "title": book.title,
-                "authors": book.authors,
-                "published_date": book.published_date,
-                "thumbnail_url": book.thumbnail_url,
-                "short_description": book.short_description,
-                "status": interaction.status,
-                "is_favorite": interaction.is_favorite,
-            })
+        fields = parse_fields(request)
+        data = [_library_entry(*entry, fields) for entry in get_library(request.user.pk)]
         return Response({"library": data})
 
 
@@ -175,19 +350,40 @@ class UserFavoritesView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        favorites = UserBookInteraction.objects.filter(user=request.user, is_favorite=True)
-        data = []
-        for interaction in favorites:
-            book = interaction.book
-            data.append({
-                "id": book.id,
-                "google_id": book.google_id,
-                "title": book.title,
-                "authors": book.authors,
-                "published_date": book.published_date,
-                "thumbnail_url": book.thumbnail_url,
-                "short_description": book.short_description,
-                "status": interaction.status,
-                "is_favorite": interaction.is_favorite,
-            })
+        fields = parse_fields(request)
+        data = [_library_entry(*entry, fields) for entry in get_library(request.user.pk, favorites_only=True)]
         return Response({"favorites": data})
+
+
+class UserLibrarySyncView(APIView):
+    """
+    Delta sync for the library and the user's reviews. Pass back the
+    returned `sync_token` to get only what changed since; keep calling
+    while `has_more` is true. A 410 means the token is too old and the
+    client should start over without one.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.GET.get("limit", SYNC_PAGE_SIZE)), 1), 1000)
+            changes, sync_token, has_more = sync_changes(request.user, request.GET.get("token"), limit)
+        except SyncTokenExpired:
+            return Response({"error": "Sync token expired; sync from scratch."}, status=status.HTTP_410_GONE)
+        except ValueError:
+            return Response({"error": "Invalid limit or sync token."}, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = parse_fields(request)
+        return Response({
+            "interactions": [
+                {**_library_entry(i.book, i.status, i.is_favorite, fields), "updated_at": i.updated_at}
+                for i in changes["interactions"]
+            ],
+            "reviews": ReviewSerializer(changes["reviews"], many=True).data,
+            "deleted": [
+                {"type": t.kind, "id": t.object_id, "book": t.book_pk, "deleted_at": t.deleted_at}
+                for t in changes["deleted"]
+            ],
+            "sync_token": sync_token,
+            "has_more": has_more,
+        })
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+from books.autocomplete import warm_book_index  # noqa: E402
+from books.checks import warn_if_cache_is_process_local  # noqa: E402
+
+warn_if_cache_is_process_local()
+warm_book_index()
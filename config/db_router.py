@@ -0,0 +1,92 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+# True once the current request must read from the primary.
+_pinned = ContextVar("db_pinned", default=False)
+# True once the current request has written to the primary.
+_wrote = ContextVar("db_wrote", default=False)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def get_replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+# -------------------------------
+# Router
+# -------------------------------
+
+class PrimaryReplicaRouter:
+    """
+    Send reads to a random replica and writes to `default`.
+
+    Reads go to the primary instead when the request is pinned (an unsafe
+    method, an earlier write in the same request, or a recent write by the
+    same client, see ReplicaStickinessMiddleware) or when running inside a
+    transaction on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or _pinned.get() or connections["default"].in_atomic_block:
+            return "default"
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _pinned.set(True)
+        _wrote.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replicas()
+
+
+# -------------------------------
+# Read-your-writes stickiness
+# -------------------------------
+
+def _client_key(request):
+    credential = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credential:
+        return None
+    return "db_sticky_" + hashlib.sha1(credential.encode()).hexdigest()
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Pin a client to the primary for REPLICA_STICKINESS_SECONDS after it
+    writes, so it reads its own writes despite replication lag. Clients
+    are told apart by their Authorization header or session cookie. The
+    pin lives in the Django cache, which must be shared between workers
+    (CACHE_URL) for the next request to honour it wherever it lands.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_replicas():
+            return self.get_response(request)
+
+        key = _client_key(request)
+        pinned = request.method not in SAFE_METHODS or bool(key and cache.get(key))
+        pinned_token = _pinned.set(pinned)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if key and _wrote.get():
+                cache.set(key, True, getattr(settings, "REPLICA_STICKINESS_SECONDS", 5))
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+        return response
@@ -0,0 +1,78 @@
+import os
+import re
+import secrets
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+def _accepted_encodings(header):
+    """Encodings the client accepts with a non-zero q-value."""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        match = re.search(r"q=(\d*\.?\d+)", params)
+        if not match or float(match.group(1)) > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def _brotli_compress(data, max_random_bytes):
+    """
+    Brotli stream ending in a metadata block of random length, which
+    decoders skip: the counterpart of the random gzip filename that
+    compress_string() adds against BREACH.
+    """
+    compressor = brotli.Compressor(quality=5)
+    stream = compressor.process(data) + compressor.flush()  # flush() ends byte-aligned
+    padding = secrets.randbelow(min(max_random_bytes, 256))
+    if padding:
+        # ISLAST=0, MNIBBLES=0 (metadata), reserved 0, MSKIPBYTES=1, MSKIPLEN-1.
+        stream += (0b110 | 1 << 4 | (padding - 1) << 6).to_bytes(2, "little") + os.urandom(padding)
+    return stream + b"\x03"  # ISLAST=1, ISLASTEMPTY=1
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware with brotli support and a size threshold: responses of
+    at least RESPONSE_COMPRESSION_MIN_BYTES are compressed with brotli when
+    the client accepts it (and the module is installed), otherwise gzip.
+    Both are padded by up to `max_random_bytes` against BREACH. Streaming
+    responses (e.g. Server-Sent Events) pass through untouched.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.min_bytes = getattr(settings, "RESPONSE_COMPRESSION_MIN_BYTES", 1024)
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding"):
+            return response
+        if len(response.content) < self.min_bytes:
+            return response
+
+        accepted = _accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if brotli is None or "br" not in accepted:
+            if "gzip" in accepted:
+                return super().process_response(request, response)
+            patch_vary_headers(response, ("Accept-Encoding",))
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed = _brotli_compress(response.content, self.max_random_bytes)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(compressed))
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            # The body changed, so a strong validator no longer matches it.
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
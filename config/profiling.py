@@ -0,0 +1,257 @@
+import hmac
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from books.providers import upstream_request
+
+# The capture being recorded for the current request, if any.
+_capture = ContextVar("profile_capture", default=None)
+_ring_lock = threading.Lock()
+_last_stamp = 0
+
+# Zero-padded nanosecond stamp, then a random suffix against other processes.
+CAPTURE_NAME = re.compile(r"^\d{20}-[0-9a-f]{8}$")
+
+
+# -------------------------------
+# Sampling profiler
+# -------------------------------
+
+def _short_path(filename):
+    """Project-relative or site-packages-relative path for frame labels."""
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        return filename[len(base) + 1:]
+    _, found, rest = filename.rpartition("site-packages/")
+    return rest if found else filename
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every `interval` seconds from a helper
+    thread and counts identical stacks. The profiled code runs untouched, so
+    the cost is the helper's wake-ups, not per-call instrumentation.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        labels = {}
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+                names.append(label)
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def folded(self):
+        """Stacks in the folded format read by flamegraph.pl, inferno and speedscope."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+# -------------------------------
+# SQL and upstream recording
+# -------------------------------
+
+def _query_recorder(alias, capture):
+    def record(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # Parameters are left out: they can carry user data.
+            capture["queries"].append(
+                {"db": alias, "sql": sql, "ms": round((time.perf_counter() - started) * 1000, 3)}
+            )
+    return record
+
+
+@receiver(upstream_request)
+def _record_upstream(sender, url, status, duration, **kwargs):
+    capture = _capture.get()
+    if capture is not None:
+        capture["upstream"].append({"url": url, "status": status, "ms": round(duration * 1000, 3)})
+
+
+# -------------------------------
+# On-disk ring of captures
+# -------------------------------
+
+def _capture_dir():
+    return Path(getattr(settings, "PROFILER_DIR", settings.BASE_DIR / "var" / "profiles"))
+
+
+def new_capture_name():
+    """Names sort in creation order, even for captures made in the same instant."""
+    global _last_stamp
+    with _ring_lock:
+        _last_stamp = max(time.time_ns(), _last_stamp + 1)
+        return f"{_last_stamp:020d}-{uuid.uuid4().hex[:8]}"
+
+
+def save_capture(name, capture):
+    """Write a capture, then drop the oldest ones beyond PROFILER_MAX_CAPTURES."""
+    directory = _capture_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp_path = directory / f"{name}.tmp"
+    tmp_path.write_text(json.dumps(capture))
+    tmp_path.replace(directory / f"{name}.json")
+    with _ring_lock:
+        # Names start with a monotonic stamp, so they sort oldest first.
+        paths = sorted(directory.glob("*.json"))
+        for path in paths[:-getattr(settings, "PROFILER_MAX_CAPTURES", 50)]:
+            path.unlink(missing_ok=True)
+
+
+def list_captures():
+    """Metadata of every stored capture, newest first."""
+    captures = []
+    for path in sorted(_capture_dir().glob("*.json"), reverse=True):
+        try:
+            captures.append(json.loads(path.read_text())["meta"])
+        except (OSError, ValueError, KeyError):
+            continue  # pruned or half-written meanwhile
+    return captures
+
+
+def load_capture(name):
+    if not CAPTURE_NAME.match(name):
+        return None
+    try:
+        return json.loads((_capture_dir() / f"{name}.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+# -------------------------------
+# Middleware
+# -------------------------------
+
+class RequestProfilerMiddleware:
+    """
+    Profiles a request that sends `X-Profile: <PROFILER_TOKEN>`, or one picked
+    at random at PROFILER_SAMPLE_RATE. The capture (folded stacks, SQL and
+    upstream calls) goes to the on-disk ring and its name is returned in the
+    X-Profile-Capture header. Requests that are not picked only pay for a
+    header lookup. At most PROFILER_MAX_CONCURRENT requests are profiled at
+    once; others run normally.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.token = getattr(settings, "PROFILER_TOKEN", "")
+        self.sample_rate = getattr(settings, "PROFILER_SAMPLE_RATE", 0.0)
+        self.interval = getattr(settings, "PROFILER_INTERVAL", 0.005)
+        self._slots = threading.BoundedSemaphore(getattr(settings, "PROFILER_MAX_CONCURRENT", 2))
+
+    def _trigger(self, request):
+        header = request.headers.get("X-Profile")
+        if header and self.token and hmac.compare_digest(header, self.token):
+            return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def __call__(self, request):
+        trigger = self._trigger(request)
+        if trigger is None or not self._slots.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self._profile(request, trigger)
+        finally:
+            self._slots.release()
+
+    def _profile(self, request, trigger):
+        capture = {"queries": [], "upstream": []}
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        context_token = _capture.set(capture)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_query_recorder(connection.alias, capture)))
+                sampler.start()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    sampler.stop()
+        finally:
+            _capture.reset(context_token)
+
+        name = new_capture_name()
+        capture["meta"] = {
+            "name": name,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "trigger": trigger,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            "samples": sum(sampler.stacks.values()),
+            "query_count": len(capture["queries"]),
+            "upstream_count": len(capture["upstream"]),
+        }
+        capture["folded"] = sampler.folded()
+        save_capture(name, capture)
+        response["X-Profile-Capture"] = name
+        return response
+
+
+# -------------------------------
+# Admin endpoints
+# -------------------------------
+
+class ProfileCaptureListView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({"captures": list_captures()})
+
+
+class ProfileCaptureDetailView(APIView):
+    """The full capture as JSON, or `?output=folded` to download the stacks for a flamegraph tool."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, name):
+        capture = load_capture(name)
+        if capture is None:
+            return Response({"error": "Capture not found."}, status=status.HTTP_404_NOT_FOUND)
+        if request.GET.get("output") == "folded":
+            response = HttpResponse(capture["folded"], content_type="text/plain; charset=utf-8")
+            response["Content-Disposition"] = f'attachment; filename="{name}.folded"'
+            return response
+        return Response(capture)
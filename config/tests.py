@@ -0,0 +1,243 @@
+import gzip
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from books import popularity
+from books.cache import book_cache
+from books.models import Book
+from books.providers import upstream_request
+from .db_router import PrimaryReplicaRouter, ReplicaStickinessMiddleware, _pinned, _wrote
+from .middleware import CompressionMiddleware
+from .profiling import RequestProfilerMiddleware, list_captures, load_capture
+
+User = get_user_model()
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_BYTES=1024)
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Bodies over the threshold are compressed with the best accepted encoding."""
+
+    body = b'{"title": "Dune"}' * 100
+
+    def respond(self, accept, body=None, response=None):
+        response = response or HttpResponse(self.body if body is None else body)
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_gzip(self):
+        response = self.respond("gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_brotli_preferred_when_available(self):
+        fake = SimpleNamespace(Compressor=lambda quality: SimpleNamespace(
+            process=lambda data: b"br:" + data[:10], flush=lambda: b"",
+        ))
+        with mock.patch("config.middleware.brotli", fake):
+            self.assertEqual(self.respond("gzip, br")["Content-Encoding"], "br")
+            self.assertEqual(self.respond("gzip, br;q=0")["Content-Encoding"], "gzip")
+        with mock.patch("config.middleware.brotli", None):
+            self.assertEqual(self.respond("br, gzip")["Content-Encoding"], "gzip")
+
+    def test_not_compressed(self):
+        cases = {
+            "below threshold": self.respond("gzip", body=self.body[:1023]),
+            "gzip refused": self.respond("gzip;q=0"),
+            "nothing accepted": self.respond(""),
+            "incompressible": self.respond("gzip", body=os.urandom(4096)),
+            "streaming": self.respond("gzip", response=StreamingHttpResponse(iter([self.body]))),
+        }
+        for case, response in cases.items():
+            with self.subTest(case):
+                self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertFalse(cases["below threshold"].has_header("Vary"))
+        self.assertEqual(cases["nothing accepted"].content, self.body)
+
+    def test_lengths_are_randomized_against_breach(self):
+        gzip_lengths = {len(self.respond("gzip").content) for _ in range(20)}
+        self.assertGreater(len(gzip_lengths), 1)
+        fake = SimpleNamespace(Compressor=lambda quality: SimpleNamespace(process=lambda data: b"x", flush=lambda: b""))
+        with mock.patch("config.middleware.brotli", fake):
+            bodies = [self.respond("br").content for _ in range(20)]
+        self.assertGreater(len({len(body) for body in bodies}), 1)
+        self.assertTrue(all(body.startswith(b"x") and body.endswith(b"\x03") for body in bodies))
+
+    def test_etag_is_weakened(self):
+        response = HttpResponse(self.body)
+        response["ETag"] = '"abc"'
+        self.assertEqual(self.respond("gzip", response=response)["ETag"], 'W/"abc"')
+
+    def test_threshold_is_configurable(self):
+        with self.settings(RESPONSE_COMPRESSION_MIN_BYTES=10_000):
+            self.assertFalse(self.respond("gzip").has_header("Content-Encoding"))
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        pinned, wrote = _pinned.set(False), _wrote.set(False)
+        self.addCleanup(_pinned.reset, pinned)
+        self.addCleanup(_wrote.reset, wrote)
+
+    def test_reads_use_replica(self):
+        self.assertEqual(self.router.db_for_read(Book), "replica1")
+
+    def test_write_pins_following_reads_to_primary(self):
+        self.assertEqual(self.router.db_for_write(Book), "default")
+        self.assertEqual(self.router.db_for_read(Book), "default")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_reads_use_primary_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Book), "default")
+
+    def test_migrations_skip_replicas(self):
+        self.assertTrue(self.router.allow_migrate("default", "books"))
+        self.assertFalse(self.router.allow_migrate("replica1", "books"))
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaStickinessMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.reads = []
+
+    def read_view(self, request):
+        self.reads.append(self.router.db_for_read(Book))
+        return HttpResponse()
+
+    def write_view(self, request):
+        self.router.db_for_write(Book)
+        return HttpResponse()
+
+    def test_client_reads_own_writes(self):
+        ReplicaStickinessMiddleware(self.write_view)(self.factory.post("/", HTTP_AUTHORIZATION="Bearer a"))
+        ReplicaStickinessMiddleware(self.read_view)(self.factory.get("/", HTTP_AUTHORIZATION="Bearer a"))
+        ReplicaStickinessMiddleware(self.read_view)(self.factory.get("/", HTTP_AUTHORIZATION="Bearer b"))
+        self.assertEqual(self.reads, ["default", "replica1"])
+
+    def test_unsafe_method_reads_primary(self):
+        ReplicaStickinessMiddleware(self.read_view)(self.factory.post("/", HTTP_AUTHORIZATION="Bearer a"))
+        self.assertEqual(self.reads, ["default"])
+
+    def test_pin_does_not_leak_between_requests(self):
+        ReplicaStickinessMiddleware(self.write_view)(self.factory.post("/"))
+        ReplicaStickinessMiddleware(self.read_view)(self.factory.get("/"))
+        self.assertEqual(self.reads, ["replica1"])
+
+
+@override_settings(DATABASE_REPLICAS=["replica_standin"])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Routing against a second real database. The stand-in replica is not
+    replicated, so a row written to only one side shows which database
+    served a query, like a replica that lags behind.
+    """
+    databases = {"default", "replica_standin"}
+
+    def setUp(self):
+        cache.clear()
+        book_cache.l1.clear()
+        # The router keeps flush away from replicas, so empty the stand-in here.
+        self.addCleanup(lambda: [model.objects.using("replica_standin").all().delete() for model in (Book, User)])
+        self.addCleanup(popularity.buffer._drain)
+        pinned, wrote = _pinned.set(False), _wrote.set(False)
+        self.addCleanup(_pinned.reset, pinned)
+        self.addCleanup(_wrote.reset, wrote)
+
+    def test_orm_reads_replica_and_writes_primary(self):
+        Book.objects.using("replica_standin").create(google_id="replicaAAAJ", title="Only on the replica")
+        self.assertEqual(list(Book.objects.values_list("google_id", flat=True)), ["replicaAAAJ"])
+
+        Book.objects.create(google_id="primaryAAAJ", title="Only on the primary")
+        self.assertFalse(Book.objects.using("replica_standin").filter(google_id="primaryAAAJ").exists())
+        # The write pinned the rest of this "request" to the primary.
+        self.assertEqual(list(Book.objects.values_list("google_id", flat=True)), ["primaryAAAJ"])
+
+    def test_client_reads_its_own_writes_through_the_stack(self):
+        book = Book.objects.create(google_id="lagAAAJ", title="Current title")
+        Book.objects.using("replica_standin").create(pk=book.pk, google_id="lagAAAJ", title="Stale title")
+        clients = []
+        for username in ("writer", "reader"):
+            user = User.objects.create_user(username, password="pass-Word-1")
+            User.objects.using("replica_standin").create(pk=user.pk, username=username, password=user.password)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+            clients.append(client)
+        writer, reader = clients
+        _pinned.set(False)
+
+        def title(client):
+            book_cache.l1.clear()
+            cache.delete(f"book_{book.google_id}")
+            response = client.get(reverse("v1:book-detail", kwargs={"book_id": book.google_id}))
+            return response.data["title"]
+
+        self.assertEqual(title(writer), "Stale title")
+        response = writer.post(reverse("v1:user-interaction"), {"book": book.pk, "status": "WTR"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(title(writer), "Current title")
+        self.assertEqual(title(reader), "Stale title")
+
+
+@override_settings(PROFILER_TOKEN="secret", PROFILER_MAX_CAPTURES=2, PROFILER_INTERVAL=0.001)
+class RequestProfilerMiddlewareTests(TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(PROFILER_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.factory = RequestFactory()
+
+    def slow_view(self, request):
+        Book.objects.filter(google_id="profiled").exists()
+        upstream_request.send(sender=None, url="https://example.com/volumes", status=200, duration=0.01)
+        time.sleep(0.02)
+        return HttpResponse()
+
+    def test_untriggered_request_is_not_captured(self):
+        response = RequestProfilerMiddleware(self.slow_view)(self.factory.get("/", HTTP_X_PROFILE="wrong"))
+        self.assertNotIn("X-Profile-Capture", response)
+        self.assertEqual(list_captures(), [])
+
+    def test_capture_records_stacks_queries_and_upstream_calls(self):
+        response = RequestProfilerMiddleware(self.slow_view)(self.factory.get("/", HTTP_X_PROFILE="secret"))
+        capture = load_capture(response["X-Profile-Capture"])
+        self.assertEqual(capture["meta"]["query_count"], 1)
+        self.assertEqual(capture["upstream"][0]["url"], "https://example.com/volumes")
+        self.assertIn("slow_view", capture["folded"])
+
+    def test_ring_keeps_newest_captures(self):
+        # Same wall-clock instant for every capture: order must still hold.
+        with mock.patch("config.profiling.time.time_ns", return_value=1):
+            names = [
+                RequestProfilerMiddleware(self.slow_view)(self.factory.get("/", HTTP_X_PROFILE="secret"))["X-Profile-Capture"]
+                for _ in range(3)
+            ]
+        self.assertEqual([meta["name"] for meta in list_captures()], names[:0:-1])
+
+    def test_admin_endpoints(self):
+        name = RequestProfilerMiddleware(self.slow_view)(self.factory.get("/", HTTP_X_PROFILE="secret"))["X-Profile-Capture"]
+        client = APIClient()
+        self.assertEqual(client.get(reverse("profile-captures")).status_code, 401)
+        client.force_authenticate(get_user_model().objects.create_superuser("root", password="pass-Word-1"))
+        self.assertEqual(client.get(reverse("profile-captures")).data["captures"][0]["name"], name)
+        folded = client.get(reverse("profile-capture", kwargs={"name": name}), {"output": "folded"})
+        self.assertIn(b"slow_view", folded.content)
+        self.assertEqual(client.get(reverse("profile-capture", kwargs={"name": "..%2Fsecret"})).status_code, 404)
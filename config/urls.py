@@ -1,10 +1,16 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from .profiling import ProfileCaptureDetailView, ProfileCaptureListView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
     path('api/v1/', include(('books.urls', 'books'), namespace='v1')),
 
     path('api/v1/users/', include(('users.urls', 'users'), namespace='users')),
+
+    # Request profiler captures (admin only)
+    path('api/v1/profiles/', ProfileCaptureListView.as_view(), name='profile-captures'),
+    path('api/v1/profiles/<str:name>/', ProfileCaptureDetailView.as_view(), name='profile-capture'),
 ]
@@ -0,0 +1,104 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.fields.files import FieldFile
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from books.checks import cache_is_process_local
+
+
+# -------------------------------
+# Versioned user cache
+# -------------------------------
+
+def _version_key(user_id):
+    return f"user_version_{user_id}"
+
+
+def get_user_cache_version(user_id):
+    """Current cache version for a user, created on first use."""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_cached_user(user_id):
+    """Bump the user's version so every cached copy is ignored from now on."""
+    # A fresh timestamp rather than incr(): still unique if the key was evicted.
+    cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def _user_key(user_id, version):
+    return f"user_{user_id}_v{version}"
+
+
+# -------------------------------
+# Cached projection
+# -------------------------------
+
+def _cached_fields():
+    """Every concrete user column except the password hash."""
+    return [field for field in get_user_model()._meta.concrete_fields if field.attname != "password"]
+
+
+def project_user(user):
+    """The cacheable part of a user: its database alias and column values, without the password."""
+    values = []
+    for field in _cached_fields():
+        value = field.value_from_object(user)
+        # A FieldFile would pickle its whole model instance, password included.
+        values.append(value.name if isinstance(value, FieldFile) else value)
+    return user._state.db, values
+
+
+def restore_user(projection):
+    """
+    Rebuild a user from project_user(). The password is a deferred field:
+    reading it (check_password) loads it from the database, and save()
+    only writes the loaded fields, so it is never overwritten by accident.
+    """
+    db, values = projection
+    return get_user_model().from_db(db, [field.attname for field in _cached_fields()], values)
+
+
+# -------------------------------
+# Authentication backend
+# -------------------------------
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves `request.user` from a short-TTL cache
+    instead of loading CustomUser on every request. Entries are keyed by a
+    per-user version, bumped whenever the user row is saved or deleted
+    (see users/signals.py), so password changes, profile edits and
+    deactivation take effect on the next request. The cache holds a
+    projection without the password hash (see project_user).
+
+    Version bumps only reach other workers through a shared cache, so
+    users are loaded from the database on every request when the cache
+    is process-local, and when CHECK_REVOKE_TOKEN needs the password hash.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None or api_settings.CHECK_REVOKE_TOKEN or cache_is_process_local():
+            return super().get_user(validated_token)
+
+        key = _user_key(user_id, get_user_cache_version(user_id))
+        projection = cache.get(key)
+        if projection is not None:
+            user = restore_user(projection)
+            if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            return user
+        user = super().get_user(validated_token)
+        cache.set(key, project_user(user), getattr(settings, "USER_CACHE_TTL", 60))
+        return user
@@ -0,0 +1,149 @@
+import hashlib
+import io
+import logging
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from rest_framework import serializers
+
+from .authentication import invalidate_cached_user
+
+logger = logging.getLogger(__name__)
+
+# Square edge length in pixels for each generated variant.
+PROFILE_IMAGE_SIZES = getattr(settings, "PROFILE_IMAGE_SIZES", {"small": 64, "medium": 128, "large": 256})
+PROFILE_IMAGE_MAX_BYTES = getattr(settings, "PROFILE_IMAGE_MAX_BYTES", 5 * 1024 * 1024)
+# Width x height cap, checked from the header before any pixels are decoded.
+PROFILE_IMAGE_MAX_PIXELS = getattr(settings, "PROFILE_IMAGE_MAX_PIXELS", 25_000_000)
+PROFILE_IMAGE_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "PROFILE_IMAGE_WORKERS", 2),
+    thread_name_prefix="profile-images",
+)
+
+
+# -------------------------------
+# Upload validation
+# -------------------------------
+
+def _open_checked(source):
+    """
+    Open an image, refusing decompression bombs: anything over
+    PROFILE_IMAGE_MAX_PIXELS, or that Pillow itself flags as a bomb.
+    Raises ValueError for an oversized image.
+    """
+    from PIL import Image
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", Image.DecompressionBombWarning)
+        try:
+            image = Image.open(source)
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning) as exc:
+            raise ValueError("Image has too many pixels.") from exc
+    width, height = image.size
+    if width * height > PROFILE_IMAGE_MAX_PIXELS:
+        raise ValueError("Image has too many pixels.")
+    return image
+
+
+def validate_profile_image(upload):
+    """Cheap checks done in the request: size, pixel count, and that Pillow can parse the header."""
+    from PIL import UnidentifiedImageError
+
+    if upload.size > PROFILE_IMAGE_MAX_BYTES:
+        raise serializers.ValidationError("Profile image is too large.")
+    try:
+        with _open_checked(upload) as image:
+            image_format = image.format
+            image.verify()
+    except ValueError:
+        raise serializers.ValidationError("Profile image dimensions are too large.")
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise serializers.ValidationError("Upload a valid image.")
+    finally:
+        upload.seek(0)
+    if image_format not in PROFILE_IMAGE_FORMATS:
+        raise serializers.ValidationError("Unsupported image format.")
+    return upload
+
+
+# -------------------------------
+# Variant generation (background)
+# -------------------------------
+
+def _variant_name(user_id, label, data):
+    # The content hash gives every new image new URLs, so caches and CDNs
+    # never serve the previous picture under the same name.
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    return f"profiles/variants/{user_id}/{label}-{digest}.webp"
+
+
+def render_profile_variants(source):
+    """Yield (label, webp bytes) for each configured size, without metadata."""
+    from PIL import Image, ImageOps
+
+    with _open_checked(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        for label, edge in PROFILE_IMAGE_SIZES.items():
+            variant = ImageOps.fit(image, (edge, edge), Image.LANCZOS)
+            buffer = io.BytesIO()
+            # Re-encoding from pixels drops EXIF/ICC/XMP blocks.
+            variant.save(buffer, "WEBP", quality=80, method=4)
+            yield label, buffer.getvalue()
+
+
+def build_profile_variants(user_id):
+    """Resize the user's current profile image and record the variant paths."""
+    User = get_user_model()
+    try:
+        user = User.objects.only("id", "profile_image").get(pk=user_id)
+    except User.DoesNotExist:
+        return
+    if not user.profile_image:
+        return
+
+    variants = {}
+    with user.profile_image.open("rb") as source:
+        for label, data in render_profile_variants(source):
+            name = _variant_name(user_id, label, data)
+            # Same name means same bytes, so an existing file can be reused.
+            variants[label] = name if default_storage.exists(name) else default_storage.save(name, ContentFile(data))
+
+    # Only record the variants if the image was not replaced meanwhile.
+    User.objects.filter(pk=user_id, profile_image=user.profile_image.name).update(
+        profile_image_variants=variants
+    )
+    invalidate_cached_user(user_id)
+
+
+def _run_build(user_id):
+    try:
+        build_profile_variants(user_id)
+    except Exception:
+        logger.exception("Profile image processing failed for user %s", user_id)
+
+
+def schedule_profile_variants(user_id):
+    """Process the image on the worker pool once the upload has been committed."""
+    transaction.on_commit(lambda: _executor.submit(_run_build, user_id))
+
+
+def delete_profile_variants(variants):
+    """Remove replaced variant files once the change has been committed."""
+    names = list((variants or {}).values())
+    if names:
+        transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+def profile_variant_urls(user):
+    return {
+        label: default_storage.url(name)
+        for label, name in (user.profile_image_variants or {}).items()
+    }
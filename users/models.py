@@ -9,6 +9,8 @@ class CustomUser(AbstractUser):
     # Example additional fields
     bio = models.TextField(blank=True, null=True)
     profile_image = models.ImageField(upload_to="profiles/", blank=True, null=True)
+    # Label -> storage path of the resized WebP copies built by users/images.py
+    profile_image_variants = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return self.username
@@ -5,6 +5,13 @@ User = get_user_model()
 
 from django.contrib.auth.password_validation import validate_password
 
+from .images import (
+    delete_profile_variants,
+    profile_variant_urls,
+    schedule_profile_variants,
+    validate_profile_image,
+)
+
 # -------------------------------
 # Registration
 # -------------------------------
@@ -35,11 +42,30 @@ class RegisterSerializer(serializers.ModelSerializer):
 # User Profile
 # -------------------------------
 class UserProfileSerializer(serializers.ModelSerializer):
+    profile_image = serializers.ImageField(
+        write_only=True, required=False, allow_null=True, validators=[validate_profile_image]
+    )
+    profile_image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ("username", "email", "first_name", "last_name")
+        fields = ("username", "email", "first_name", "last_name", "profile_image", "profile_image_variants")
         read_only_fields = ("username",)
 
+    def get_profile_image_variants(self, obj):
+        return profile_variant_urls(obj)
+
+    def update(self, instance, validated_data):
+        image_changed = "profile_image" in validated_data
+        if image_changed:
+            # Old variants no longer match; the worker fills in the new ones.
+            delete_profile_variants(instance.profile_image_variants)
+            instance.profile_image_variants = {}
+        instance = super().update(instance, validated_data)
+        if image_changed and instance.profile_image:
+            schedule_profile_variants(instance.pk)
+        return instance
+
 
 # -------------------------------
 # Change Password
@@ -1,3 +1,173 @@
-from django.test import TestCase
+import io
+import re
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.authentication import _user_key, get_user_cache_version, project_user
+from users.images import PROFILE_IMAGE_SIZES, build_profile_variants, validate_profile_image
+
+User = get_user_model()
+
+
+def image_bytes(size=(300, 200), image_format="PNG", color="teal"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def image_upload(size=(300, 200), image_format="PNG", color="teal"):
+    return SimpleUploadedFile(f"avatar.{image_format.lower()}", image_bytes(size, image_format, color))
+
+
+# Variant generation runs inline instead of on the worker pool.
+inline_executor = SimpleNamespace(submit=lambda fn, *args: fn(*args))
+
+
+class ProfileImageTests(TestCase):
+    """Uploads are checked before decoding; variants are content-addressed WebP copies."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.user = User.objects.create_user("pictured", password="pass-Word-1")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def assertRejected(self, upload, message):
+        with self.assertRaisesMessage(serializers.ValidationError, message):
+            validate_profile_image(upload)
+
+    def test_validation(self):
+        self.assertIsNotNone(validate_profile_image(image_upload()))
+        self.assertRejected(SimpleUploadedFile("avatar.png", b"not an image"), "Upload a valid image.")
+        self.assertRejected(image_upload(image_format="BMP"), "Unsupported image format.")
+        with mock.patch("users.images.PROFILE_IMAGE_MAX_PIXELS", 300 * 200 - 1):
+            self.assertRejected(image_upload(), "dimensions are too large")
+
+    def test_pillow_decompression_bomb_checks_are_rejected(self):
+        # 60,000 pixels: over the warning limit in the first case, over twice it in the second.
+        for pillow_limit in (40_000, 20_000):
+            with self.subTest(pillow_limit=pillow_limit), mock.patch.object(Image, "MAX_IMAGE_PIXELS", pillow_limit):
+                self.assertRejected(image_upload(), "dimensions are too large")
+
+    def test_variants_are_content_addressed_webp(self):
+        self.user.profile_image.save("avatar.png", ContentFile(image_bytes()))
+        build_profile_variants(self.user.pk)
+        self.user.refresh_from_db()
+
+        self.assertEqual(set(self.user.profile_image_variants), set(PROFILE_IMAGE_SIZES))
+        for label, name in self.user.profile_image_variants.items():
+            self.assertRegex(name, rf"^profiles/variants/{self.user.pk}/{label}-[0-9a-f]{{16}}\.webp$")
+            with default_storage.open(name) as stored, Image.open(stored) as variant:
+                self.assertEqual(variant.format, "WEBP")
+                self.assertEqual(variant.size, (PROFILE_IMAGE_SIZES[label],) * 2)
+                self.assertNotIn("exif", variant.info)
+
+    @mock.patch("users.images._executor", inline_executor)
+    def test_profile_update_replaces_variants(self):
+        url = reverse("users:user_me")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(url, {"profile_image": image_upload()}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["profile_image_variants"], {})
+
+        first = self.client.get(url).data["profile_image_variants"]
+        self.assertEqual(set(first), set(PROFILE_IMAGE_SIZES))
+        self.assertTrue(all(re.search(r"/profiles/variants/\d+/\w+-[0-9a-f]{16}\.webp$", u) for u in first.values()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(url, {"profile_image": image_upload(color="red")}, format="multipart")
+        second = self.client.get(url).data["profile_image_variants"]
+        self.assertEqual(set(second), set(PROFILE_IMAGE_SIZES))
+        self.assertFalse(set(first.values()) & set(second.values()))
+        # The replaced files are gone from storage.
+        old_names = [f"profiles/variants/{u.rsplit('/profiles/variants/', 1)[1]}" for u in first.values()]
+        self.assertFalse(any(default_storage.exists(name) for name in old_names))
+
+    def test_oversized_upload_is_a_400(self):
+        with mock.patch("users.images.PROFILE_IMAGE_MAX_PIXELS", 100):
+            response = self.client.put(reverse("users:user_me"), {"profile_image": image_upload()}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("profile_image", response.data)
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+@mock.patch("users.authentication.cache_is_process_local", lambda: False)
+class CachedAuthenticationTests(TestCase):
+    """Cached users skip the database, yet every account change applies to the very next request."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cached", password="pass-Word-1")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def me(self):
+        return self.client.get(reverse("users:user_me"))
+
+    def change_password(self, old, new):
+        return self.client.put(
+            reverse("users:change_password"), {"old_password": old, "new_password": new}, format="json"
+        )
+
+    def test_warm_request_skips_the_database_and_caches_no_password(self):
+        self.me()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me().data["username"], "cached")
+        cached = cache.get(_user_key(self.user.pk, get_user_cache_version(self.user.pk)))
+        self.assertNotIn(self.user.password, repr(cached))
+
+    def test_password_change_applies_to_the_next_request(self):
+        self.me()  # warm the cache
+        self.assertEqual(self.change_password("pass-Word-1", "N3w-pass-Word").status_code, 200)
+        self.assertEqual(self.change_password("pass-Word-1", "Other-pass-3").status_code, 400)
+        self.assertEqual(self.change_password("N3w-pass-Word", "Other-pass-3").status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("Other-pass-3"))
+
+    def test_profile_update_applies_to_the_next_request(self):
+        self.me()
+        self.client.put(reverse("users:user_me"), {"first_name": "Ada"}, format="json")
+        self.assertEqual(self.me().data["first_name"], "Ada")
+        # Saving the cached projection must not touch the password.
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("pass-Word-1"))
+
+    def test_deactivation_applies_to_the_next_request(self):
+        self.assertEqual(self.me().status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.me().status_code, 200)  # .update() skips signals; served from cache
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.me().status_code, 401)
+
+    def test_cached_inactive_user_is_rejected(self):
+        self.me()
+        self.user.is_active = False
+        key = _user_key(self.user.pk, get_user_cache_version(self.user.pk))
+        cache.set(key, project_user(self.user))
+        self.assertEqual(self.me().status_code, 401)
+
+    def test_process_local_cache_is_not_used(self):
+        self.me()
+        with mock.patch("users.authentication.cache_is_process_local", lambda: True):
+            with self.assertNumQueries(1):
+                self.me()